@@ -1,16 +1,46 @@
 import algorithm
+import candidate_pool
+import catalog_delta
+import catalog_file
+import columnar
+import facets
+import image_cache
+import listing_details
+import listing_index
+import metrics
+import relaxation
+import similar
+import speculation
+import sql_catalog
 import constraints
 from constraints import Constraint, PurchaseType
 import math
+from collections import deque
 import sqlite3
+import os
 import random
-from PIL import Image
-import requests
-from io import BytesIO
+import threading
+import logging
 
+log = logging.getLogger("housefindr")
+
+DB_PATH = "houselisting.db"
+
+#first image per listing, with MIN() SQLite takes the bare url column from the row with the smallest id
+FIRST_IMAGES = "SELECT listing_id, url, MIN(id) FROM images GROUP BY listing_id"
+
+_fetch_session = None
 
 def display_image_from_url(url):
-    response = requests.get(url)
+    #only the interactive console shows images, the server never pays for the imaging and HTTP libraries
+    from io import BytesIO
+    from PIL import Image
+    import requests
+
+    global _fetch_session
+    if _fetch_session is None:
+        _fetch_session = requests.Session() #reuse connections between images
+    response = _fetch_session.get(url, timeout=image_cache.FETCH_TIMEOUT)
 
     if response.status_code == 200:
         image = Image.open(BytesIO(response.content))
@@ -20,57 +50,305 @@ def display_image_from_url(url):
         print(f"Failed to retrieve the image. Status code: {response.status_code}")
 
 class UTAlgorithm:
-    def __init__(self):
-        
+    #shared: an already loaded UTAlgorithm whose read-only catalog this one reuses (see spawn)
+    #catalog_path: memory-mapped catalog snapshot (see catalog_file.py), mapped while it matches the DB, rewritten from the DB otherwise
+    #content_hash: validate the snapshot against a hash of the DB file instead of the row watermarks
+    #pushdown: keep the listings in the DB and query candidates per ranking (see sql_catalog.py), for catalogs too big to load
+    def __init__(self, shared=None, catalog_path=None, content_hash=False, pushdown=False):
+        self.catalog_path = catalog_path
+        self.content_hash = content_hash
+        self.source = shared #engine whose catalog this one follows, see sync_catalog
+        self.generation = 0 #bumped by refresh_catalog every time a new catalog is swapped in
+        self._catalog_lock = threading.Lock()
+        self.store = None
+        if shared is not None:
+            self._share_catalog(shared)
+        else:
+            self.watermark = catalog_file.db_watermark(DB_PATH) #taken first, rows added during the load are picked up again later
+            #title, address, links and photo galleries stay in the DB until a listing is opened
+            self.details = listing_details.ListingDetails(DB_PATH, int(os.getenv("LISTING_DETAIL_CACHE", "4096")))
+            if pushdown:
+                self._query_catalog()
+            elif catalog_path:
+                self._open_catalog(catalog_path, content_hash)
+            else:
+                self._load_catalog()
 
+        self.constraints = constraints.UserPreferences()
+        self.algorithm = algorithm.HousingRecommender(catalog=self.catalog, index=self.index, sim_cache=self.sim_cache,
+                                                      store=self.store, neighbors=self.neighbors)
+        self.pool = candidate_pool.CandidatePool(self.listings, self.by_id)
+        self.consumed = self.pool.consumed #ids already pushed to the feed, the catalog itself is never modified
+
+        self.feed = deque() #[current, next, n2, n3, ..., n6]
+                    #feed += algorithm.feedback + algorithm.recommend, popleft from front
+        self.speculation = None #background refill for both answers to feed[0], see speculate
+        self.relaxed = [] #constraints the relaxation ladder dropped for the homes last added to the feed
+        self._relaxation = None #relaxation.Relaxation last chosen, see relax_feed
+        self._facets = None #(generation, or the refreshed DB watermark in pushdown, facets.FacetCube), see facet_cube
+        self._facets_lock = threading.Lock()
+        self.lock = threading.RLock() #held for a whole request when serving concurrently, the catalog itself needs none
+
+    def _load_catalog(self):
         ###DO NOT TOUCH, FOR DB PROPAGATION###
 
         self.idToImg = {}
 
 
-        connection = sqlite3.connect("houselisting.db")
+        #read-only, the server never writes the DB; rows stream straight into Listings
+        connection = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
         cursor = connection.cursor()
-        
-        cursor.execute("SELECT * FROM listings")  
-        self.database = cursor.fetchall()
+
+        self.database = cursor.execute(f"SELECT {sql_catalog.COLUMNS} FROM listings")
         self.build_listings_from_db()
 
-        cursor.execute("SELECT * FROM images")
-        self.idToImg = cursor.fetchall()
+        self.idToImg = cursor.execute(FIRST_IMAGES)
         self.grab_images_from_db()
         connection.close()
         ###DO NOT TOUCH, FOR DB PROPAGATION###
 
-        self.constraints = constraints.UserPreferences()
-        self.algorithm = algorithm.HousingRecommender()
-
-        self.feed = [] #[current, next, n2, n3, ..., n6]
-                    #feed += algorithm.feedback + algorithm.recommend, pop from front
+        #batched scoring over the whole catalog when numpy is installed (and the styles fit its style column)
+        self.catalog = columnar.build(self.listings)
+        self.sim_cache = algorithm.SimilarityCache() #similarity vectors shared by every session on this catalog
+        self.neighbors = similar.Neighbors(self.listings, self.by_id) #"more like this" index, see Neighbors.start
+
+    def _open_catalog(self, path, content_hash):
+        source = catalog_file.db_fingerprint(DB_PATH, content_hash)
+        mapped = catalog_file.open_snapshot(path, source)
+        if mapped is not None:
+            self._map_catalog(mapped)
+            self.watermark = mapped.meta["watermark"]
+        else:
+            self._load_catalog()
+            self._export_catalog(path, source)
+
+    def _map_catalog(self, mapped):
+        #nothing is read from the DB, listings are built from the mapping as rows get used
+        for name, value in self._mapped_parts(mapped).items():
+            setattr(self, name, value)
+
+    def _query_catalog(self):
+        #nothing is loaded, every ranking is one indexed query and the queries always see the live table
+        #the indexes it relies on come from ingest.py or `python sql_catalog.py`, the server never writes the DB
+        self.store = sql_catalog.SqlCatalog(DB_PATH)
+        self.store.recount() #refresh_catalog reports the rows added since
+        self.listings = self.store
+        self.database = self.store
+        self.by_id = self.store.by_id
+        self.index = None
+        self.idToImg = self.store.images
+        self.catalog = None
+        self.sim_cache = algorithm.SimilarityCache()
+        #no "more like this": its index would hold the whole table in memory, and every boost would be a query per id
+        self.neighbors = None
+
+    @staticmethod
+    def _mapped_parts(mapped):
+        return {
+            "listings": mapped.listings,
+            "database": mapped.listings,
+            "by_id": mapped.by_id,
+            "index": mapped.index(),
+            "idToImg": mapped.images,
+            "catalog": mapped.columnar(),
+            "sim_cache": algorithm.SimilarityCache(),
+            "neighbors": similar.Neighbors(mapped.listings, mapped.by_id),
+        }
+
+    @staticmethod
+    def _memory_parts(listings, images):
+        #same pieces _load_catalog builds, for a catalog that is already parsed
+        by_id = {h.id: h for h in listings}
+        return {
+            "listings": listings,
+            "database": listings,
+            "by_id": by_id,
+            "index": listing_index.ListingIndex(listings),
+            "idToImg": images,
+            "catalog": columnar.build(listings),
+            "sim_cache": algorithm.SimilarityCache(),
+            "neighbors": similar.Neighbors(listings, by_id),
+        }
+
+    def _export_catalog(self, path, source):
+        #the next process to start maps this file instead of reading the DB
+        #source is the DB fingerprint taken before the load, rows written meanwhile make the snapshot stale
+        try:
+            catalog_file.write_catalog(path, self.listings, self.idToImg,
+                                       meta={"source": source, "watermark": self.watermark})
+        except (OSError, ValueError) as e:
+            log.warning("Could not write catalog file %s: %s", path, e)
+
+    def _share_catalog(self, shared):
+        #only references are copied, a session costs its own preferences, weights, feed and consumed ids
+        with shared._catalog_lock: #never half of an old catalog and half of a new one
+            self.database = shared.database
+            self.listings = shared.listings
+            self.by_id = shared.by_id
+            self.index = shared.index
+            self.catalog = shared.catalog
+            self.idToImg = shared.idToImg
+            self.sim_cache = shared.sim_cache
+            self.neighbors = shared.neighbors
+            self.store = shared.store
+            self.details = shared.details
+            self.watermark = shared.watermark
+            self.generation = shared.generation
+
+    def spawn(self):
+        """
+        New per-user engine layered over this engine's catalog
+        """
+        return UTAlgorithm(shared=self)
+
+    #===HOT RELOAD===#
+    #the catalog engine swaps in a new catalog, sessions follow it at their next request
+
+    def refresh_catalog(self):
+        """
+        Loads the listings and images added (or re-stamped through created_at) since the catalog was loaded
+        and swaps in a catalog that includes them; nothing is re-read or rebuilt when the DB has not moved
+        The rows are patched over the loaded catalog as a delta (see catalog_delta.py), the whole catalog is only
+        rebuilt, and a catalog file rewritten, once the delta has grown too big; deleted rows are not noticed
+        Returns how many listings were added or replaced
+        """
+        watermark = catalog_file.db_watermark(DB_PATH)
+        if watermark is None or watermark == self.watermark:
+            return 0
+        if self.store is not None: #pushdown queries already see every row, only the cached row count and facets move
+            before = len(self.store)
+            with self._catalog_lock:
+                self.watermark = watermark
+            return max(0, self.store.recount() - before)
+        max_id, max_created, max_image = self.watermark or (0, "", 0)
+
+        connection = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+        try:
+            rows = connection.execute(f"SELECT {sql_catalog.COLUMNS} FROM listings WHERE id > ? OR created_at > ? ORDER BY id",
+                                      (max_id, max_created)).fetchall()
+            image_rows = connection.execute("SELECT listing_id, url FROM images WHERE id > ? ORDER BY id",
+                                            (max_image,)).fetchall()
+        finally:
+            connection.close()
+
+        #changed rows take their old slot, new ones go at the end, so catalog order (and pool cursors) stay valid
+        fresh = list(map(sql_catalog.listing_from_row, rows))
+        previous = {name: getattr(self, name) for name in ("listings", "by_id", "index", "idToImg", "catalog", "neighbors")}
+        parts = catalog_delta.apply(previous, fresh, [(str(row[0]), row[1]) for row in image_rows])
+        if parts is None:
+            parts = self._rebuilt_parts(fresh, image_rows, watermark)
+        cube = None
+        with self._facets_lock:
+            built = self._facets
+        if built is not None and built[0] == self.generation: #patched instead of rebuilt on next use
+            replaced = [h for h in map(self.by_id.get, (h.id for h in fresh)) if h is not None]
+            cube = built[1].patched(replaced, fresh)
+
+        with self._catalog_lock:
+            for name, value in parts.items():
+                setattr(self, name, value)
+            self.watermark = watermark
+            self.generation += 1
+        if cube is not None:
+            with self._facets_lock:
+                self._facets = (self.generation, cube)
+        if previous["neighbors"].started(): #rebuilt in the background rather than on the first like after the swap
+            self.neighbors.start()
+        self.details.invalidate([row[0] for row in rows] + [row[0] for row in image_rows])
+        self._attach_catalog()
+        return len(rows)
+
+    def _rebuilt_parts(self, fresh, image_rows, watermark):
+        #the whole catalog with the fresh listings in it, written to the catalog file when there is one
+        fresh = {h.id: h for h in fresh}
+        listings = [fresh.pop(h.id, h) for h in self.listings]
+        listings.extend(fresh.values())
+        images = dict(self.idToImg.items())
+        for row in image_rows:
+            images.setdefault(str(row[0]), row[1])
+
+        parts = None
+        if self.catalog_path:
+            #workers share the snapshot, whichever refreshes first writes it and the rest just map it
+            source = catalog_file.db_fingerprint(DB_PATH, self.content_hash)
+            mapped = catalog_file.open_snapshot(self.catalog_path, source)
+            try:
+                if mapped is None or mapped.meta["watermark"] != watermark:
+                    catalog_file.write_catalog(self.catalog_path, listings, images,
+                                               meta={"source": source, "watermark": watermark})
+                    mapped = catalog_file.MappedCatalog(self.catalog_path)
+                parts = self._mapped_parts(mapped)
+            except ValueError as e: #e.g. more styles than the file's style column holds, served from memory instead
+                log.warning("Could not write catalog file %s: %s", self.catalog_path, e)
+        if parts is None:
+            parts = self._memory_parts(listings, images)
+        return parts
+
+    def sync_catalog(self):
+        """
+        Moves a session onto its source engine's current catalog, feed, consumed ids and learned state are kept
+        Call with the session lock held
+        """
+        if self.source is None or self.source.generation == self.generation:
+            return False
+        self._share_catalog(self.source)
+        self._attach_catalog()
+        return True
+
+    def _attach_catalog(self):
+        self.speculation = None #ranked over the previous catalog
+        self.algorithm.catalog = self.catalog
+        self.algorithm.index = self.index
+        self.algorithm.sim_cache = self.sim_cache
+        self.algorithm.store = self.store
+        self.algorithm.neighbors = self.neighbors
+        self.pool.listings = self.listings
+        self.pool.by_id = self.by_id
+
+    #===FACETS===#
+
+    def facet_cube(self):
+        """
+        Aggregate of this engine's catalog behind /facets, built on first use and again after a refresh
+        A pushdown catalog has no generations, its cube is rebuilt once refresh_catalog has seen the DB watermark move
+        """
+        with self._facets_lock: #built once even when the first requests arrive together
+            with self._catalog_lock:
+                generation, store, listings = self.generation, self.store, self.listings
+                key = self.watermark if store is not None else generation
+            if self._facets is None or self._facets[0] != key:
+                self._facets = (key, self._build_cube(store, listings))
+            return self._facets[1]
+
+    @staticmethod
+    def _build_cube(store, listings):
+        if store is not None:
+            return facets.from_sql(store)
+        if isinstance(listings, catalog_delta.DeltaListings): #the base's cube, with the delta patched in
+            base = listings.base_listings
+            replaced = [base[r] for r in listings.replaced]
+            return UTAlgorithm._build_cube(None, base).patched(replaced, listings.delta())
+        if isinstance(listings, catalog_file.MappedListings):
+            return facets.from_mapped(listings.catalog)
+        return facets.from_listings(listings)
 
     ###DO NOT TOUCH, FOR DB PROPAGATION###
     #auto-propagates all possible listings from database
     def build_listings_from_db(self):
         self.listings = []
         for row in self.database:
-            house = algorithm.Listing(
-                id=str(row[0]),
-                price=row[4],
-                sqft=row[8],
-                beds=row[6],
-                baths=row[7],
-                city=row[10],
-                style=row[-2],
-                listing_type=row[-3],
-                tenure=row[3],
-            )
+            house = sql_catalog.listing_from_row(row)
             self.listings.append(house)
 
+        #self.listings is the read-only catalog the indexes point into, sessions track what they used in self.consumed
+        self.index = listing_index.ListingIndex(self.listings)
+        self.by_id = {h.id: h for h in self.listings}
         self.database = self.listings
 
     def grab_images_from_db(self):
         images = {}
         for row in self.idToImg:
-            images[str(row[0])] = row[2]  #map id to image url
+            images[str(row[0])] = row[1]  #map listing id to its first image url, the rest are in self.details
         self.idToImg = images
     ###DO NOT TOUCH, FOR DB PROPAGATION###
 
@@ -80,7 +358,10 @@ class UTAlgorithm:
         return self.constraints.get_constraints()
 
     def return_database(self):
-        return self.database
+        return list(self.pool)
+
+    def remaining(self):
+        return len(self.pool)
     
     def get_current_home(self):
         if self.feed:
@@ -89,10 +370,7 @@ class UTAlgorithm:
             return None
         
     def get_home(self, ID):
-        for home in self.database:
-            if home.id == ID:
-                return home
-        return None
+        return self.pool.get(ID)
     
 
     def get_current_url(self):
@@ -104,21 +382,57 @@ class UTAlgorithm:
     def get_home_url(self, ID):
         return self.idToImg[ID]
 
+    def get_home_detail(self, ID):
+        return self.details.get(ID)
+
+    def get_home_gallery(self, ID):
+        return self.details.gallery(ID)
+
+    def get_similar_homes(self, ID, n=10):
+        if self.neighbors is None: #pushdown
+            return []
+        return self.neighbors.similar(ID, n)
+
     #===SETTERS===#
     def update_rigidity(self, constraint, value):
+        self.speculation = None #ranked under the old constraints
         self.constraints.update_constraint_rigidity(constraint, value)
         self.algorithm.constraints = self.constraints.get_constraints()
 
     def update_constraint(self, constraint, value):
+        self.speculation = None #ranked under the old constraints
         self.constraints.update_constraint_value(constraint, value)
         self.algorithm.constraints = self.constraints.get_constraints()
 
+    #===SAVE/RESTORE===#
+    #per-user state only, the catalog is rebuilt from the DB
+
+    def export_state(self):
+        return {
+            "constraints": self.constraints.export_preferences(),
+            "weights": dict(self.algorithm.weights),
+            "exclude_ids": list(self.algorithm.exclude_ids),
+            "boosts": dict(self.algorithm.boosts),
+            "consumed": list(self.consumed),
+            "feed": [h.id for h in self.feed],
+        }
+
+    def import_state(self, state):
+        self.speculation = None
+        self.constraints.load_preferences(state.get("constraints", {}))
+        self.algorithm.weights.update(state.get("weights", {}))
+        self.algorithm.exclude_ids = set(state.get("exclude_ids", []))
+        self.algorithm.boosts = dict(state.get("boosts", {}))
+        self.consumed.clear()
+        self.consumed.update(i for i in state.get("consumed", []) if i in self.by_id) #listings may have been deleted since
+        self.feed = deque(self.by_id[i] for i in state.get("feed", []) if i in self.by_id)
+
     #===PRINTS===#
     def print_constraints(self):
         self.constraints.print_constraints()
 
     def print_database(self):
-        for row in self.database:
+        for row in self.return_database():
             print(row)
 
     def print_home(self, ID):
@@ -152,17 +466,102 @@ class UTAlgorithm:
 
     #===ALGORITHM STUFF===#
 
+    #ranks once and hands out up to n new homes
+    def recommend_homes(self, n):
+        recs = self.algorithm.recommend_n(self.constraints, self.listings, n, consumed=self.consumed)
+        return self._hand_out(recs)
+
+    def _hand_out(self, recs):
+        for rec in recs:
+            self.pool.consume(rec) #remove from pool to avoid duplicates
+            if log.isEnabledFor(logging.DEBUG): #formatting a listing costs more than recommending it
+                log.debug("Recommended %s", self.get_home(rec.id))
+        return recs
+
     def reccomend_2_homes(self):
-        recs = []
-        for _ in range(2):
-            rec = self.algorithm.recommend_listing(self.constraints, self.database)
-            if rec:
-                recs.append(rec)
-                self.database.remove(rec) #remove from pool to avoid duplicates
-                print(self.get_home(rec.id))
+        recs = self.recommend_homes(2)
         if len(self.feed) <= 5: #max size of 7
             self.feed += recs
 
+    #tops the feed up to target_len in one ranking pass, used by the API to prefetch a deck
+    def fill_feed(self, target_len):
+        need = target_len - len(self.feed)
+        if need > 0:
+            recs = self.recommend_homes(need)
+            self.feed += recs
+            if len(recs) == need:
+                self.relaxed = []
+
+    #when the constraints leave too few homes, ranks once on the first relaxation step that can fill the feed
+    #the user's constraints are left as they are, self.relaxed reports what was dropped (see relaxation.py)
+    #the chosen step is kept while the preferences and the catalog stay the same, and is only counted again
+    #(from the next step down) once it runs dry
+    def relax_feed(self, target_len):
+        need = target_len - len(self.feed)
+        if need <= 0:
+            return None
+        ladder = self._relaxation
+        if ladder is None or ladder.version != self.constraints.version or ladder.generation != self.generation:
+            ladder = self._relaxation = relaxation.Relaxation(self.constraints, self.generation)
+        if ladder.level is None or ladder.dry:
+            start = 1 if ladder.level is None else ladder.level + 1
+            if ladder.choose(self.algorithm, self.listings, self.consumed, need, start) is None:
+                return None
+        relaxed = relaxation.relaxed_preferences(self.constraints, set(ladder.dropped()))
+        recs = self.algorithm.recommend_n(relaxed, self.listings, need, consumed=self.consumed)
+        ladder.dry = len(recs) < need
+        self.feed += self._hand_out(recs)
+        if recs:
+            self.relaxed = ladder.describe()
+            for c in self.relaxed:
+                metrics.RELAXED_CONSTRAINTS.inc(constraint=c)
+        return ladder
+
+    #like/dislike the current home, drop it from the feed and top the feed back up
+    #answered from the speculative branch when it is still valid, otherwise ranked now
+    def give_feedback(self, liked, target_len=2):
+        current = self.get_current_home()
+        if current is None:
+            return None
+        picks = self.speculation.take(self, current, liked) if self.speculation is not None else None
+        self.speculation = None
+
+        self.algorithm.update_user_feedback(self.constraints, current, liked)
+        self.feed.popleft()
+        if picks:
+            self.feed += self._hand_out(picks[:max(0, target_len - len(self.feed))])
+        self.fill_feed(target_len)
+        return current
+
+    #applies an ordered list of (id, liked) swipes, e.g. a queue the client built up offline,
+    #then re-ranks once at the end. ids that were already answered are skipped, so a resent batch is harmless
+    def give_feedback_batch(self, swipes, target_len=2):
+        self.speculation = None
+        in_feed = {h.id for h in self.feed}
+        applied, skipped = [], []
+        for listing_id, liked in swipes:
+            home = self.get_home(listing_id)
+            if home is None or (listing_id not in in_feed and listing_id in self.consumed):
+                skipped.append(listing_id)
+                continue
+            self.algorithm.update_user_feedback(self.constraints, home, liked)
+            self.pool.consume(home)
+            in_feed.discard(listing_id)
+            applied.append(listing_id)
+
+        done = set(applied)
+        self.feed = deque(h for h in self.feed if h.id not in done)
+        self.fill_feed(target_len)
+        return applied, skipped
+
+    #start ranking the next homes for both answers to the current home, in the background
+    def speculate(self, target_len=2):
+        self.speculation = None
+        current = self.get_current_home()
+        need = target_len - (len(self.feed) - 1)
+        if current is not None and need > 0:
+            self.speculation = speculation.Speculation(self, current, need)
+
 
     #main loop, use to run system
     #taken from algorithm.py interactive_loop, modified to for simplicity to interact with frontend
@@ -182,7 +581,7 @@ class UTAlgorithm:
             liked = (ans == "y")
             self.algorithm.update_user_feedback(self.constraints, rec, liked)
             print("Updated weights:", {k: round(v, 3) for k, v in self.algorithm.weights.items()})
-            self.feed.pop(0)
+            self.feed.popleft()
 
 
 if __name__ == "__main__":
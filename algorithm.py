@@ -1,24 +1,133 @@
 # Import necessary modules from constraints.py
 from constraints import UserPreferences, Constraint, Preference
-from dataclasses import dataclass
+from collections import OrderedDict
+import heapq
+import logging
 import random
+import threading
+import time
+import columnar
+import metrics
+import vocab
+from filter_plan import FilterPlan
+
+#order of the similarity vector, same order as the terms in score_listing
+SIM_FIELDS = (
+    ("budget",      Constraint.BUDGET),
+    ("square_feet", Constraint.SQUARE_FEET),
+    ("location",    Constraint.LOCATION),
+    ("home_type",   Constraint.HOME_TYPE),
+    ("style",       Constraint.STYLE),
+)
+
+log = logging.getLogger("housefindr")
+
+class SimilarityCache:
+    """
+    LRU of filtered candidates and their similarity vectors, keyed by (index, preference signature)
+    Shared by every session over one catalog, so it is safe to use from several request threads
+    """
+    def __init__(self, size=8):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        #two threads may build the same entry at once, the later one simply wins
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_city_codes = vocab.CITIES.codes
+_type_codes = vocab.LISTING_TYPES.codes
+_tenure_codes = vocab.TENURES.codes
+_style_codes = vocab.STYLES.codes
 
-@dataclass
 class Listing:
-    id: str
-    price: int
-    sqft: int
-    beds: int
-    baths: float
-    city: str
-    style: set[str]
-    listing_type: str
-    tenure: str
+    """
+    One catalog listing, slotted so it carries no per-instance dict
+    city, listing_type and tenure are kept as vocab codes and style as a vocab.STYLES bitmask;
+    the string attributes are decoded on read. style reads back as None, a string (one style, what the DB stores)
+    or a set of strings
+    """
+    __slots__ = ("id", "price", "sqft", "beds", "baths", "city_code", "type_code", "tenure_code", "style_mask")
+
+    def __init__(self, id, price, sqft, beds, baths, city, style, listing_type, tenure):
+        self.id = id
+        self.price = price
+        self.sqft = sqft
+        self.beds = beds
+        self.baths = baths
+        #plain dict hits first, catalogs only have a handful of distinct values
+        code = _city_codes.get(city)
+        self.city_code = code if code is not None else vocab.CITIES.intern(city)
+        code = _type_codes.get(listing_type)
+        self.type_code = code if code is not None else vocab.LISTING_TYPES.intern(listing_type)
+        code = _tenure_codes.get(tenure)
+        self.tenure_code = code if code is not None else vocab.TENURES.intern(tenure)
+        code = _style_codes.get(style) if isinstance(style, str) else None
+        self.style_mask = 1 << code if code is not None else vocab.STYLES.intern_mask(style)
+
+    @property
+    def city(self):
+        return vocab.CITIES.value(self.city_code)
+
+    @property
+    def listing_type(self):
+        return vocab.LISTING_TYPES.value(self.type_code)
+
+    @property
+    def tenure(self):
+        return vocab.TENURES.value(self.tenure_code)
+
+    @property
+    def style(self):
+        styles = vocab.STYLES.members(self.style_mask)
+        if not styles:
+            return None
+        return styles[0] if len(styles) == 1 else set(styles)
+
+    def _key(self):
+        return (self.id, self.price, self.sqft, self.beds, self.baths,
+                self.city_code, self.type_code, self.tenure_code, self.style_mask)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._key() == other._key()
+
+    __hash__ = None #mutable like the dataclass it replaced, listings are compared by identity in the ranking code
+
+    def __repr__(self):
+        return (f"Listing(id={self.id!r}, price={self.price!r}, sqft={self.sqft!r}, beds={self.beds!r}, "
+                f"baths={self.baths!r}, city={self.city!r}, style={self.style!r}, "
+                f"listing_type={self.listing_type!r}, tenure={self.tenure!r})")
 
 class HousingRecommender:
 
     #add __init__?
-    def __init__(self):
+    #catalog: optional columnar.ColumnarCatalog, enables batched scoring in recommend_listing
+    #index: optional listing_index.ListingIndex, lets filter_listings skip the linear scan
+    #sim_cache: SimilarityCache of similarity vectors, can be shared between recommenders over the same catalog
+    #store: optional sql_catalog.SqlCatalog, filtering is pushed down to SQLite and the matches are ranked as they stream in
+    #neighbors: optional similar.Neighbors, a like then also boosts the listings most similar to the liked one (once its index is built)
+    def __init__(self, catalog=None, index=None, sim_cache=None, store=None, neighbors=None):
         self.weights = {
             "location":    0.25,
             "home_type":   0.25,
@@ -30,6 +139,20 @@ class HousingRecommender:
         self.exclude_ids = set()
         self.top_k = 3
         self.explore_epsilon = 0.15
+        self.catalog = catalog
+        self.index = index
+        self.sim_cache = sim_cache if sim_cache is not None else SimilarityCache()
+        self.store = store
+        self.neighbors = neighbors
+        self.boosts = {} #listing id -> similarity to the closest liked listing, see _boost
+        self.neighbor_boost = 0.1 #score added at similarity 1
+        self.neighbor_count = 20 #neighbors boosted per like
+        self.max_boosts = 200 #strongest boosts kept, every ranking scores these listings once more
+        #where the stage timings and candidate counts go, background speculation records into its own series
+        self.stage_seconds = metrics.STAGE_SECONDS
+        self.candidates = metrics.CANDIDATES
+        self._plan = None
+        self._plan_prefs = None
 
     # ====== AI helpers  ======
     def _normalize_weights(self):
@@ -79,14 +202,35 @@ class HousingRecommender:
         return 0.0
 
     def _match_style(self, listing_styles, pref) -> float:
-        # tolerate strings in either field
-        if isinstance(listing_styles, str):
-            listing_styles = {listing_styles}
+        # listing styles as a Listing.style_mask, or tolerate a string / set
         if isinstance(pref, str):
             pref = {pref}
-        if isinstance(pref, set) and len(pref) > 0:
-            return 1.0 if len(listing_styles & pref) > 0 else 0.0
-        return 0.0
+        if not (isinstance(pref, set) and len(pref) > 0):
+            return 0.0
+        if isinstance(listing_styles, int):
+            return 1.0 if listing_styles & vocab.STYLES.mask(pref) else 0.0
+        if isinstance(listing_styles, str):
+            listing_styles = {listing_styles}
+        return 1.0 if len(listing_styles & pref) > 0 else 0.0
+
+    def similarity_vector(self, listing: Listing, user_preferences: UserPreferences):
+        """
+        Per-listing similarities in SIM_FIELDS order, independent of the learned weights
+        """
+        c = user_preferences.constraints
+        return (
+            self._sim_budget(listing.price, c[Constraint.BUDGET].get_preference_value()),
+            self._sim_sqft(listing.sqft, c[Constraint.SQUARE_FEET].get_preference_value()),
+            self._match_location(listing.city, c[Constraint.LOCATION].get_preference_value()),
+            self._match_home_type(listing.listing_type, c[Constraint.HOME_TYPE].get_preference_value()),
+            self._match_style(listing.style_mask, c[Constraint.STYLE].get_preference_value()),
+        )
+
+    def coefficients(self, user_preferences):
+        """
+        weight * importance per similarity, a score is the dot product of these with similarity_vector
+        """
+        return [self.weights[name] * self._imp(user_preferences, c) for name, c in SIM_FIELDS]
 
     def score_listing(self, listing: Listing, user_preferences: UserPreferences) -> float:
         budget_pref = user_preferences.constraints[Constraint.BUDGET].get_preference_value()
@@ -99,7 +243,7 @@ class HousingRecommender:
         s_sqft   = self._sim_sqft(listing.sqft, sqft_pref)
         s_loc    = self._match_location(listing.city, loc_pref)
         s_type   = self._match_home_type(listing.listing_type, type_pref)
-        s_style  = self._match_style(listing.style, style_pref)
+        s_style  = self._match_style(listing.style_mask, style_pref)
 
         i_budget = self._imp(user_preferences, Constraint.BUDGET)
         i_sqft   = self._imp(user_preferences, Constraint.SQUARE_FEET)
@@ -116,79 +260,224 @@ class HousingRecommender:
         )
         return float(score)
 
+    #compiled filter for the current preferences, rebuilt only when user_preferences.version changes
+    def filter_plan(self, user_preferences):
+        plan = self._plan
+        if plan is None or self._plan_prefs is not user_preferences or plan.version != user_preferences.version:
+            plan = FilterPlan(user_preferences)
+            self._plan = plan
+            self._plan_prefs = user_preferences
+        return plan
+
     def filter_listings(self, listings, user_preferences):
         #SRY FOR THE BAD CODING PRACTICES BUT WE CAN FIX LATER
         #BASICALLY, WE FILTER OUT LISTINGS THAT DON'T MEET USER PREFERENCES
         #EXCLUDING ANY CONSTRAINTS THAT GOT REMOVED (value = NONE)
-        filtered_listings = []
-        for listing in listings:
-
-            #does the city location match?
-            loc_val = user_preferences.constraints[Constraint.LOCATION].get_preference_value() 
-            if isinstance(loc_val, str) and loc_val != "":
-                if listing.city != loc_val:
-                    continue
-
-            #is the minimum sqFT met? or is it within reasonable flexibility?
-            sqft_val = user_preferences.constraints[Constraint.SQUARE_FEET].get_preference_value()
-            if isinstance(sqft_val, (int, float)) and sqft_val > 0:
-                differenceInFeet = abs(listing.sqft - sqft_val)
-                roomForError = 0
-                if user_preferences.is_flexible(Constraint.SQUARE_FEET):
-                    r = user_preferences.constraints[Constraint.SQUARE_FEET].rigidity
-                    roomForError = sqft_val - (sqft_val * r)
-                if not (listing.sqft >= sqft_val or
-                        (user_preferences.is_flexible(Constraint.SQUARE_FEET) and differenceInFeet <= roomForError)):
-                    #print("Listing failed square feet constraint")
-                    continue
-
-            #is the price within budget? or, is it within reasonable flexibility?
-            bud_val = user_preferences.constraints[Constraint.BUDGET].get_preference_value()
-            if isinstance(bud_val, (int, float)) and bud_val > 0:
-                differenceInPrice = abs(listing.price - bud_val)
-                roomForError = 0
-                if user_preferences.is_flexible(Constraint.BUDGET):
-                    r = user_preferences.constraints[Constraint.BUDGET].rigidity
-                    roomForError = bud_val - (bud_val * r)
-                if not (listing.price <= bud_val or
-                        (user_preferences.is_flexible(Constraint.BUDGET) and differenceInPrice <= roomForError)):
-                    #print("Listing failed budget constraint")
-                    continue
-
-            #go through all the styles we like. if none matches the constraints, dont add this property
-            pref_styles = user_preferences.constraints[Constraint.STYLE].get_preference_value()
-            if isinstance(pref_styles, set) and len(pref_styles) > 0:
-                listing_styles = listing.style if isinstance(listing.style, set) else {listing.style}
-                if listing_styles.isdisjoint(pref_styles):
-                    #print("Listing failed style constraint")
-                    continue
-
-            #TO-DO: MAYBE ADD SAME LOGIC TO BED/BATHS!!!!!
-
-            #it meets our constraints, add it to the filtered list
-            filtered_listings.append(listing)
-        return filtered_listings
+        start = time.perf_counter()
+        if self.index is not None and self.index.covers(listings):
+            out = self.index.filter(self.filter_plan(user_preferences))
+        elif self.store is not None and listings is self.store:
+            out = [l for chunk in self.store.candidates(self.filter_plan(user_preferences)) for l in chunk]
+        else:
+            #the rules (city, sqft/budget/beds/baths with rigidity slack, styles) are compiled once per preference version
+            out = self.filter_plan(user_preferences).filter(listings)
+        self.stage_seconds.observe(time.perf_counter() - start, stage="filter")
+        return out
+
+    #Returns the k best (score, listing) pairs, highest first
+    #uses the columnar catalog when one is attached, otherwise scores listing by listing
+    def rank_listings(self, listings, user_preferences, k):
+        start = time.perf_counter()
+        if self.catalog is not None and listings:
+            rows = self.catalog.rows_for(listings)
+            if rows is not None:
+                scores = self.catalog.score(self, user_preferences, rows)
+                mid = time.perf_counter()
+                best = columnar.top_positions(scores, k)
+                out = [(float(scores[i]), listings[i]) for i in best]
+                self.stage_seconds.observe(mid - start, stage="score")
+                self.stage_seconds.observe(time.perf_counter() - mid, stage="select")
+                return out
+
+        scored = [(self.score_listing(l, user_preferences), l) for l in listings]
+        mid = time.perf_counter()
+        scored.sort(key=lambda x: x[0], reverse=True)
+        out = scored[:min(k, len(scored))]
+        self.stage_seconds.observe(mid - start, stage="score")
+        self.stage_seconds.observe(time.perf_counter() - mid, stage="select")
+        return out
+
+    #===CACHED RANKING===#
+    #feedback only moves self.weights, so the similarity vectors of the filtered candidates
+    #stay valid until the constraints change. a re-rank is then a dot product plus top-k selection
+
+    def _cached_similarities(self, user_preferences):
+        #keyed on the preference values rather than the version, so sessions with equal preferences share entries
+        plan = self.filter_plan(user_preferences)
+        key = (id(self.index), plan.signature)
+        entry = self.sim_cache.get(key)
+        if entry is not None:
+            return entry
+
+        start = time.perf_counter()
+        matches = self.index.filter(plan)
+        mid = time.perf_counter()
+        rows = self.catalog.rows_for(matches) if self.catalog is not None else None
+        if rows is not None:
+            sims = self.catalog.similarities(user_preferences, rows)
+        else:
+            sims = [self.similarity_vector(l, user_preferences) for l in matches]
+        entry = (matches, sims)
+        self.stage_seconds.observe(mid - start, stage="filter")
+        self.stage_seconds.observe(time.perf_counter() - mid, stage="similarity")
 
-    #Returns the 1st matching suitable listing for the user
-    def recommend_listing(self, user_preferences, listings):
-        # --- replaced with scoring + exploration like recommender.py ---
-        candidates = [l for l in listings if l.id not in self.exclude_ids]
-        if not candidates:
-            candidates = listings
+        self.sim_cache.put(key, entry)
+        return entry
+
+    def _rank_indexed(self, user_preferences, listings, consumed, k):
+        """
+        Top k (score, listing) among indexed matches that are neither consumed nor disliked
+        Returns None when every remaining listing was disliked, so the caller can fall back
+        """
+        matches, sims = self._cached_similarities(user_preferences)
+        self.candidates.observe(len(matches))
+        start = time.perf_counter()
+        coefs = self.coefficients(user_preferences)
+
+        def alive(l):
+            return l.id not in consumed and l.id not in self.exclude_ids
+
+        if isinstance(sims, list):
+            scored = [(coefs[0] * s[0] + coefs[1] * s[1] + coefs[2] * s[2] + coefs[3] * s[3] + coefs[4] * s[4], i)
+                      for i, s in enumerate(sims) if alive(matches[i])]
+            mid = time.perf_counter()
+            out = [(score, matches[i]) for score, i in heapq.nlargest(k, scored, key=lambda x: x[0])]
+        else:
+            #dead ids can only push that many alive listings out of the top k, so select k + dead and skip them
+            scores = columnar.weighted_sum(coefs, sims)
+            mid = time.perf_counter()
+            best = columnar.top_positions(scores, k + len(consumed) + len(self.exclude_ids))
+            out = [(float(scores[i]), matches[i]) for i in best if alive(matches[i])][:k]
+        self.stage_seconds.observe(mid - start, stage="score")
+        self.stage_seconds.observe(time.perf_counter() - mid, stage="select")
+
+        if not out and self._dead_count(consumed) >= len(listings):
+            return None
+        return out
 
-        candidates = self.filter_listings(candidates, user_preferences)
+    def _dead_count(self, consumed):
+        #ids handed out or disliked, counted once; O(disliked) rather than a pass over the catalog
+        return len(consumed) + sum(1 for i in self.exclude_ids if i not in consumed)
 
-        scored = [(self.score_listing(l, user_preferences), l) for l in candidates]
-        scored.sort(key=lambda x: x[0], reverse=True)
+    #===STREAMED RANKING===#
+    #pushdown mode: SQLite does the filtering, only a running top k is kept while the chunks stream in
+    def _rank_streamed(self, user_preferences, consumed, k):
+        """
+        Top k (score, listing) among the store's matches that are neither consumed nor disliked
+        Never None: the in-memory fallback would read the whole table, an exhausted store just yields []
+        """
+        start = time.perf_counter()
+        plan = self.filter_plan(user_preferences)
+        best = []
+        matched = 0
+        scoring = 0.0
+        for chunk in self.store.candidates(plan):
+            matched += len(chunk)
+            chunk = [l for l in chunk if l.id not in consumed and l.id not in self.exclude_ids]
+            if not chunk:
+                continue
+            mid = time.perf_counter()
+            catalog = columnar.build(chunk)
+            if catalog is not None:
+                scores = catalog.score(self, user_preferences, catalog.rows_for(chunk))
+                top = [(float(scores[i]), chunk[i]) for i in columnar.top_positions(scores, k)]
+            else:
+                top = heapq.nlargest(k, ((self.score_listing(l, user_preferences), l) for l in chunk),
+                                     key=lambda x: x[0])
+            #earlier chunks come first, so ties keep catalog order like a single sort would
+            best = heapq.nlargest(k, best + top, key=lambda x: x[0])
+            scoring += time.perf_counter() - mid
+        self.candidates.observe(matched)
+        #everything outside the scoring loop is fetching and filtering
+        self.stage_seconds.observe(time.perf_counter() - start - scoring, stage="filter")
+        self.stage_seconds.observe(scoring, stage="score")
+        return best
 
-        if not scored or scored[0][0] <= 0:
-            print("No suitable homes found!")
+    #Returns the 1st matching suitable listing for the user
+    #consumed: ids already handed out that must never come back (unlike exclude_ids, which is a soft filter)
+    def recommend_listing(self, user_preferences, listings, consumed=None):
+        recs = self.recommend_n(user_preferences, listings, 1, consumed=consumed)
+        if not recs:
+            log.info("No suitable homes found!")
             return None
+        return recs[0]
 
-        pool = [l for _, l in scored[:min(self.top_k, len(scored))]]
-        if len(pool) > 1 and random.random() < self.explore_epsilon:
-            return random.choice(pool[1:])
-        return pool[0]
+    #Returns up to k distinct listings from a single ranking pass
+    #each slot gets the same exploration as recommend_listing: the best remaining listing, or sometimes a runner-up
+    def recommend_n(self, user_preferences, listings, k, consumed=None):
+        # --- replaced with scoring + exploration like recommender.py ---
+        consumed = consumed or set()
+        depth = k + self.top_k - 1 #enough ranked listings for every slot to have a full exploration pool
+        scored = None
+        if self.index is not None and self.index.covers(listings):
+            scored = self._rank_indexed(user_preferences, listings, consumed, depth)
+        elif self.store is not None and listings is self.store:
+            scored = self._rank_streamed(user_preferences, consumed, depth)
+
+        if scored is None:
+            live = [l for l in listings if l.id not in consumed] if consumed else listings
+            candidates = [l for l in live if l.id not in self.exclude_ids]
+            if not candidates:
+                candidates = live
+
+            candidates = self.filter_listings(candidates, user_preferences)
+            self.candidates.observe(len(candidates))
+            scored = self.rank_listings(candidates, user_preferences, depth)
+
+        if self.boosts and self.neighbors is not None and self.neighbors.covers(listings):
+            scored = self._boost(user_preferences, scored, consumed, depth)
+
+        picks = []
+        while len(picks) < k and scored and scored[0][0] > 0:
+            pool = [l for _, l in scored[:self.top_k]]
+            pick = pool[0]
+            if len(pool) > 1 and random.random() < self.explore_epsilon:
+                pick = random.choice(pool[1:])
+            picks.append(pick)
+            scored = [x for x in scored if x[1] is not pick]
+        return picks
+
+    #===NEIGHBOR BOOST===#
+    #listings similar to liked ones get neighbor_boost * similarity on top of their score
+
+    def _boost(self, user_preferences, scored, consumed, k):
+        """
+        Top k (score, listing) once the boosts are added to the ranked top k
+        A listing without a boost keeps its score, so it can only make the new top k if it made the old one:
+        only the boosted listings are scored on top of the ranking, however it was done
+        """
+        plan = self.filter_plan(user_preferences)
+        boosted = {}
+        for listing_id, similarity in self.boosts.items():
+            if listing_id in consumed or listing_id in self.exclude_ids:
+                continue
+            h = self.neighbors.by_id.get(listing_id)
+            if h is not None and plan(h):
+                boosted[listing_id] = (self.score_listing(h, user_preferences) + self.neighbor_boost * similarity, h)
+        if not boosted:
+            return scored
+        out = [(boosted.pop(h.id)[0], h) if h.id in boosted else (s, h) for s, h in scored]
+        out.extend(boosted.values())
+        out.sort(key=lambda x: x[0], reverse=True)
+        return out[:k]
+
+    def boost_neighbors(self, listing):
+        for similarity, listing_id in self.neighbors.similar_ids(listing.id, self.neighbor_count,
+                                                                  self.stage_seconds):
+            if similarity > self.boosts.get(listing_id, 0.0):
+                self.boosts[listing_id] = similarity
+        if len(self.boosts) > self.max_boosts:
+            self.boosts = dict(heapq.nlargest(self.max_boosts, self.boosts.items(), key=lambda x: x[1]))
 
     #drops most rigid constraint to open up options for a search
     def drop_most_rigid_constraint(self, user_preferences):
@@ -231,7 +520,7 @@ class HousingRecommender:
         s_sqft   = self._sim_sqft(listing.sqft, sqft_pref)
         s_loc    = self._match_location(listing.city, loc_pref)
         s_type   = self._match_home_type(listing.listing_type, type_pref)
-        s_style  = self._match_style(listing.style, style_pref)
+        s_style  = self._match_style(listing.style_mask, style_pref)
 
         g = self.learning_rate if liked else -self.learning_rate
 
@@ -243,6 +532,8 @@ class HousingRecommender:
 
         if not liked:
             self.exclude_ids.add(listing.id)
+        elif self.neighbors is not None:
+            self.boost_neighbors(listing)
 
         self._normalize_weights()
 
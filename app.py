@@ -8,23 +8,135 @@ from constraints import Constraint
 
 # ///Old
 # app.py
-from flask import Flask, jsonify, request
+from flask import Flask, Response, abort, g, jsonify, request
 from flask_cors import CORS
+from itertools import islice
+import atexit
+import logging
+import math
 import os
+import time
 
 import UTA
-from constraints import Constraint
+import image_cache
+import metrics
+import sessions
+import catalog_refresh
+import relaxation
+import state_store
+from constraints import Constraint, UserPreferences
+from filter_plan import FilterPlan
+
+# LOG_LEVEL=DEBUG logs every handed out listing, the default keeps the hot path quiet
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 app = Flask(__name__)
 CORS(app)
 
 # --- Boot engine (UTA.py opens "houselisting.db" in CWD) ---
-engine = UTA.UTAlgorithm()
+# loaded once per process; every client session is spawned over this read-only catalog
+# the catalog is mapped from the CATALOG_FILE snapshot while it matches the DB, otherwise loaded from the DB and
+# the snapshot rewritten (CATALOG_FILE="" always reads the DB, CATALOG_CONTENT_HASH=1 also catches in-place edits)
+catalog_engine = UTA.UTAlgorithm(
+    catalog_path=os.getenv("CATALOG_FILE", "catalog.bin"),
+    content_hash=os.getenv("CATALOG_CONTENT_HASH") == "1",
+    # CATALOG_PUSHDOWN=1 leaves the listings in SQLite and queries candidates per ranking (see sql_catalog.py)
+    pushdown=os.getenv("CATALOG_PUSHDOWN") == "1",
+)
+# the "more like this" index is built in the background, likes and /similar skip it until it is ready
+# (pushdown mode has none, the index would hold the whole table in memory)
+if catalog_engine.neighbors is not None:
+    catalog_engine.neighbors.start()
+
+# new listings written to the DB are picked up without a restart, CATALOG_REFRESH_SECONDS=0 turns it off
+refresh_interval = float(os.getenv("CATALOG_REFRESH_SECONDS", "30"))
+if refresh_interval > 0:
+    refresher = catalog_refresh.CatalogRefresher(catalog_engine, UTA.DB_PATH, refresh_interval)
+    atexit.register(refresher.close)
+
+# learned weights, constraints and feeds survive restarts (written in the background, see state_store.py)
+saved_state = state_store.SessionStateStore(
+    os.getenv("SESSION_DB", "sessions.db"),
+    flush_interval=float(os.getenv("SESSION_FLUSH_SECONDS", "2")),
+)
+atexit.register(saved_state.close)
+
+def new_session(token):
+    engine = catalog_engine.spawn()
+    state = saved_state.load(token)
+    if state:
+        engine.import_state(state)
+    return engine
+
+session_store = sessions.SessionStore(
+    new_session,
+    ttl=int(os.getenv("SESSION_TTL", "1800")),
+    max_sessions=int(os.getenv("MAX_SESSIONS", "10000")),
+    # an evicted session's unflushed state stays queued, and loading its token again reads it back first
+    on_evict=saved_state.evicted,
+)
+
+# listing photos are cached on disk and served as thumbnails from /image/<id>
+images = image_cache.ImageCache(
+    os.getenv("IMAGE_CACHE_DIR", ".image_cache"),
+    max_bytes=int(os.getenv("IMAGE_CACHE_MB", "256")) * 1024 * 1024,
+)
+THUMB_WIDTH = 640 # what the feed cards are prefetched at
+
+def current_engine():
+    # per-client recommender state, keyed by the session token header
+    # the session is locked until the request ends, so concurrent requests for one user run one at a time
+    if "session" in g:
+        return g.session[1]
+    token = request.headers.get(sessions.SESSION_HEADER) or sessions.DEFAULT_TOKEN
+    engine = session_store.get(token)
+    engine.lock.acquire()
+    engine.sync_catalog() # no-op unless the catalog was refreshed since this session's last request
+    g.session = (token, engine)
+    return engine
+
+@app.teardown_request
+def release_session(exc=None):
+    if "session" in g:
+        g.session[1].lock.release()
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    # labelled by route pattern, not path, so /image/<listing_id> stays one series
+    if "request_start" in g:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start,
+                                        route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.after_request
+def persist_session(response):
+    # queue the session for the next background flush, never written on the request path
+    if "session" in g and (request.method == "POST" or request.endpoint in ("init", "feed")):
+        saved_state.mark_dirty(*g.session)
+    return response
+
+MAX_DECK = 20 # most cards a client can prefetch in one request
+MAX_SIMILAR = 50 # most listings /similar returns
 
 # ---------- Helpers ----------
+def deck_size(default=2):
+    # ?count=N, how many cards the client wants queued up
+    try:
+        n = int(request.args.get("count", default))
+    except ValueError:
+        n = default
+    return max(2, min(MAX_DECK, n))
+
 def listing_to_dict(h):
     if h is None:
         return None
+    start = time.perf_counter()
     _id = str(getattr(h, "id", ""))
     base = {
         "id": str(getattr(h, "id", "")),
@@ -36,7 +148,9 @@ def listing_to_dict(h):
         "style": getattr(h, "style", None),
         "listing_type": getattr(h, "listing_type", None),
         "tenure": getattr(h, "tenure", None),
-        "image_url": engine.idToImg.get(_id),
+        "image_url": catalog_engine.idToImg.get(_id),
+        "thumbnail_url": f"/image/{_id}?w={THUMB_WIDTH}",
+        "detail_url": f"/listing/{_id}",
     }
     try:
         for k, v in getattr(h, "__dict__", {}).items():
@@ -44,73 +158,156 @@ def listing_to_dict(h):
                 base[k] = v
     except Exception:
         pass
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage="serialize")
     return base
 
-def try_fill_with_raw_db(target_len=2):
-    # for visual fallback: , just first DB items
-    while len(engine.feed) < target_len and len(engine.database) > 0:
-        engine.feed.append(engine.database.pop(0))
-
-def ensure_feed(target_len=2):
-    # attempt a few times via recommender
-    attempts = 0
-    while len(engine.feed) < target_len and attempts < 3 and len(engine.database) > 0:
-        engine.reccomend_2_homes()
-        attempts += 1
+def try_fill_with_raw_db(engine, target_len=2):
+    # for visual fallback: , just first DB items this session has not seen yet
+    metrics.RAW_FALLBACKS.inc()
+    added = 0
+    while len(engine.feed) < target_len:
+        h = engine.pool.next_unconsumed()
+        if h is None:
+            break
+        engine.feed.append(h)
+        added += 1
+    metrics.RAW_FALLBACK_LISTINGS.inc(added)
+
+def prefetch_images(engine):
+    # warm thumbnails for everything queued in this session's feed
+    images.prefetch((catalog_engine.idToImg.get(h.id) for h in engine.feed), THUMB_WIDTH)
+
+def ensure_feed(engine, target_len=2):
+    # one ranking pass tops the feed up; running it again would rank the same candidates
+    if len(engine.feed) < target_len and engine.remaining() > 0:
+        metrics.FEED_ATTEMPTS.inc()
+        engine.fill_feed(target_len)
+    # too few matches: drop constraints in rigidity order, straight to the first step with enough homes
+    if len(engine.feed) < target_len and engine.remaining() > 0:
+        engine.relax_feed(target_len)
     # fallback for UI to still shows something
     if len(engine.feed) < target_len:
-        try_fill_with_raw_db(target_len=target_len)
+        try_fill_with_raw_db(engine, target_len=target_len)
 
 
 
 # --- Constraints API ---
 @app.get("/constraints")
 def get_constraints():
-    #UTA returns -> convert to JSONable
-    prefs = engine.get_user_preferences()
+    #UTA returns {constraint.value: {"value", "rigidity"}} -> convert to JSONable
+    prefs = current_engine().get_user_preferences()
+    def value(constraint, default=None):
+        v = prefs[constraint.value]["value"]
+        return default if v is None else v # None once a constraint was dropped
     out = {
-        "home_type": list(prefs.get("home_type", [])),
-        "style": list(prefs.get("style", [])),
-        "location": prefs.get("location"),
-        "square_feet": prefs.get("square_feet"),
-        "budget": prefs.get("budget"),
+        "home_type": list(value(Constraint.HOME_TYPE, [])),
+        "style": list(value(Constraint.STYLE, [])),
+        "location": value(Constraint.LOCATION),
+        "square_feet": value(Constraint.SQUARE_FEET),
+        "budget": value(Constraint.BUDGET),
+        "bedrooms": value(Constraint.BEDROOMS),
+        "bathrooms": value(Constraint.BATHROOMS),
     }
     return jsonify(out)
 
+def parse_constraints(data):
+    # (constraint, value) pairs of a POST /constraints body, ValueError for anything the preferences would not take
+    # (e.g. a negative minimum), checked on a scratch copy so a bad field leaves the session untouched
+    try:
+        out = []
+        if "home_type" in data:
+            out.append((Constraint.HOME_TYPE, set(map(str, data["home_type"]))))
+        if "style" in data:
+            out.append((Constraint.STYLE, set(map(str, data["style"]))))
+        if "location" in data:
+            out.append((Constraint.LOCATION, str(data["location"])))
+        if "square_feet" in data:
+            out.append((Constraint.SQUARE_FEET, int(data["square_feet"])))
+        if "budget" in data:
+            out.append((Constraint.BUDGET, int(data["budget"])))
+        if "bedrooms" in data:
+            out.append((Constraint.BEDROOMS, int(data["bedrooms"])))
+        if "bathrooms" in data:
+            out.append((Constraint.BATHROOMS, float(data["bathrooms"])))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid constraint value: {e}")
+    if any(c == Constraint.BATHROOMS and not math.isfinite(v) for c, v in out):
+        raise ValueError("Bedrooms and bathrooms must be a positive number.")
+    scratch = UserPreferences()
+    for constraint, value in out:
+        scratch.update_constraint_value(constraint, value)
+    return out
+
 @app.post("/constraints")
 def set_constraints():
     data = request.get_json(force=True) or {}
-    # Expecting: { home_type: [..], style: [..], location: str, square_feet: int, budget: int }
-    if "home_type" in data:
-        engine.update_constraint(Constraint.HOME_TYPE, set(map(str, data["home_type"])))
-    if "style" in data:
-        engine.update_constraint(Constraint.STYLE, set(map(str, data["style"])))
-    if "location" in data:
-        engine.update_constraint(Constraint.LOCATION, str(data["location"]))
-    if "square_feet" in data:
-        engine.update_constraint(Constraint.SQUARE_FEET, int(data["square_feet"]))
-    if "budget" in data:
-        engine.update_constraint(Constraint.BUDGET, int(data["budget"]))
+    # Expecting: { home_type: [..], style: [..], location: str, square_feet: int, budget: int,
+    #              bedrooms: int, bathrooms: number } (minimums, 0 means any)
+    engine = current_engine()
+    try:
+        changes = parse_constraints(data)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    for constraint, value in changes:
+        engine.update_constraint(constraint, value)
 
     # Return the normalized preferences
     return get_constraints()
 
+def preview_preferences(prefs, args):
+    # copy of the session's constraints with the query-string values applied, the session itself is untouched
+    out = relaxation.relaxed_preferences(prefs, set())
+    if "home_type" in args:
+        out.update_constraint_value(Constraint.HOME_TYPE, {v for v in args["home_type"].split(",") if v})
+    if "style" in args:
+        out.update_constraint_value(Constraint.STYLE, {v for v in args["style"].split(",") if v})
+    if "location" in args:
+        out.update_constraint_value(Constraint.LOCATION, args["location"])
+    if "square_feet" in args:
+        out.update_constraint_value(Constraint.SQUARE_FEET, int(args["square_feet"]))
+    if "budget" in args:
+        out.update_constraint_value(Constraint.BUDGET, int(args["budget"]))
+    if "bedrooms" in args:
+        out.update_constraint_value(Constraint.BEDROOMS, int(args["bedrooms"]))
+    if "bathrooms" in args:
+        out.update_constraint_value(Constraint.BATHROOMS, float(args["bathrooms"]))
+    return out
+
+# how many homes each choice leaves: counts per city / listing_type / style / beds / baths and price / sqft histograms,
+# each conditioned on every other constraint. ?location=..&style=a,b&budget=..&bedrooms=.. previews a change before POST /constraints
+@app.get("/facets")
+def facets():
+    engine = current_engine()
+    try:
+        prefs = preview_preferences(engine.constraints, request.args)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify(catalog_engine.facet_cube().query(FilterPlan(prefs)))
+
 # ---------- Routes ----------
+@app.get("/metrics")
+def metrics_endpoint():
+    # Prometheus text format: per-stage and per-route latency histograms, candidate sizes, feed fallbacks
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+# probes are answered from the shared catalog: they never create a session or wait on a session lock
 @app.get("/health")
 def health():
     return jsonify({
         "status": "ok",
-        "database_len": len(getattr(engine, "database", [])),
-        "feed_len": len(getattr(engine, "feed", [])),
+        "database_len": catalog_engine.remaining(),
+        "sessions": len(session_store),
+        "neighbors_ready": catalog_engine.neighbors is not None and catalog_engine.neighbors.ready(),
     })
 
 @app.get("/debug")
 def debug():
     return jsonify({
         "db_exists": True,
-        "database_len": len(getattr(engine, "database", [])),
-        "feed_len": len(getattr(engine, "feed", [])),
-        "listings_len": len(getattr(engine, "listings", [])) if hasattr(engine, "listings") else None
+        "database_len": catalog_engine.remaining(),
+        "listings_len": len(catalog_engine.listings),
+        "catalog_generation": catalog_engine.generation,
+        "sessions": len(session_store),
     })
 
 # 1) raw first N items from DB (quick way to just show something)
@@ -121,38 +318,50 @@ def first_from_db():
     except ValueError:
         n = 1
     n = max(0, n)
-    db = getattr(engine, "database", [])
+    db = getattr(catalog_engine, "database", [])
     out = [listing_to_dict(h) for h in db[:n]]
     return jsonify({"count": len(out), "items": out})
 
-# 2) init: seed constraints + fill feed (GET)
+# 2) init: seed constraints + fill feed (GET), ?count=N prefetches a deck of N cards
 @app.get("/init")
 def init():
     # seed_reasonable_defaults()
-    ensure_feed(target_len=2)
+    engine = current_engine()
+    count = deck_size()
+    ensure_feed(engine, target_len=count)
+    engine.speculate(target_len=2)
+    prefetch_images(engine)
     current = engine.feed[0] if len(engine.feed) > 0 else None
     next_item = engine.feed[1] if len(engine.feed) > 1 else None
     return jsonify({
         "ok": True,
         "current": listing_to_dict(current),
         "next": listing_to_dict(next_item),
-        "feed_preview": [listing_to_dict(x) for x in engine.feed[:6]],
+        "feed_preview": [listing_to_dict(x) for x in islice(engine.feed, 6)],
+        "deck": [listing_to_dict(x) for x in islice(engine.feed, count)],
         "feed_size": len(engine.feed),
-        "database_remaining": len(engine.database),
+        "database_remaining": engine.remaining(),
+        "relaxed": engine.relaxed,
     })
 
-# 3) view feed (GET)
+# 3) view feed (GET), ?count=N like /init
 @app.get("/feed")
 def feed():
-    ensure_feed(target_len=2)
+    engine = current_engine()
+    count = deck_size()
+    ensure_feed(engine, target_len=count)
+    engine.speculate(target_len=2)
+    prefetch_images(engine)
     current = engine.feed[0] if len(engine.feed) > 0 else None
     next_item = engine.feed[1] if len(engine.feed) > 1 else None
     return jsonify({
         "current": listing_to_dict(current),
         "next": listing_to_dict(next_item),
-        "feed_preview": [listing_to_dict(x) for x in engine.feed[:6]],
+        "feed_preview": [listing_to_dict(x) for x in islice(engine.feed, 6)],
+        "deck": [listing_to_dict(x) for x in islice(engine.feed, count)],
         "feed_size": len(engine.feed),
-        "database_remaining": len(engine.database),
+        "database_remaining": engine.remaining(),
+        "relaxed": engine.relaxed,
     })
 
 # 4) feedback to advance feed (POST)
@@ -161,17 +370,17 @@ def feedback():
     data = request.get_json(force=True, silent=True) or {}
     listing_id = str(data.get("id", ""))
     liked = bool(data.get("liked", False))
+    engine = current_engine()
 
     current = engine.feed[0] if len(engine.feed) > 0 else None
     if current is None or str(getattr(current, "id", "")) != listing_id:
         return jsonify({"ok": False, "error": "Current item does not match provided id."}), 400
 
-    # update model
-    engine.algorithm.update_user_feedback(engine.constraints, current, liked)
-
-    # pop current & refill
-    engine.feed.pop(0)
-    ensure_feed(target_len=2)
+    # update model, pop current & refill (from the speculative branch when it is ready)
+    engine.give_feedback(liked, target_len=2)
+    ensure_feed(engine, target_len=2)
+    engine.speculate(target_len=2)
+    prefetch_images(engine)
 
     new_current = engine.feed[0] if len(engine.feed) > 0 else None
     new_next = engine.feed[1] if len(engine.feed) > 1 else None
@@ -184,13 +393,114 @@ def feedback():
         "current": listing_to_dict(new_current),
         "next": listing_to_dict(new_next),
         "feed_size": len(engine.feed),
-        "database_remaining": len(engine.database),
+        "database_remaining": engine.remaining(),
+        "relaxed": engine.relaxed,
     })
 
 
+# 4b) several swipes at once, e.g. a queue the client built up while offline (POST)
+# body: {"swipes": [{"id": "12", "liked": true}, ...]} in the order they happened, ?count=N for the returned deck
+@app.post("/feedback/batch")
+def feedback_batch():
+    data = request.get_json(force=True, silent=True) or {}
+    items = data if isinstance(data, list) else data.get("swipes", [])
+    if not isinstance(items, list):
+        return jsonify({"ok": False, "error": "Expected a list of {id, liked} swipes."}), 400
+    swipes = [(str(x.get("id", "")), bool(x.get("liked", False))) for x in items if isinstance(x, dict)]
+    engine = current_engine()
+    count = deck_size()
+
+    # update model for every swipe, then re-rank once
+    applied, skipped = engine.give_feedback_batch(swipes, target_len=count)
+    ensure_feed(engine, target_len=count)
+    engine.speculate(target_len=2)
+    prefetch_images(engine)
+
+    current = engine.feed[0] if len(engine.feed) > 0 else None
+    next_item = engine.feed[1] if len(engine.feed) > 1 else None
+    weights = getattr(engine.algorithm, "weights", None)
+    weights_out = {k: round(v, 3) for k, v in weights.items()} if isinstance(weights, dict) else None
+
+    return jsonify({
+        "ok": True,
+        "applied": applied,
+        "skipped": skipped,
+        "updated_weights_example": weights_out,
+        "current": listing_to_dict(current),
+        "next": listing_to_dict(next_item),
+        "deck": [listing_to_dict(x) for x in islice(engine.feed, count)],
+        "feed_size": len(engine.feed),
+        "database_remaining": engine.remaining(),
+        "relaxed": engine.relaxed,
+    })
+
+# 5) full listing: the card fields plus title, address, links and the photo gallery (read on demand, LRU cached)
+@app.get("/listing/<listing_id>")
+def listing_detail(listing_id):
+    h = catalog_engine.get_home(str(listing_id))
+    detail = catalog_engine.get_home_detail(str(listing_id)) if h is not None else None
+    if detail is None:
+        abort(404)
+    out = listing_to_dict(h)
+    out.update((k, v) for k, v in detail.items() if k != "images")
+    out["images"] = [
+        {**photo, "thumbnail_url": f"/image/{out['id']}?n={n}&w={THUMB_WIDTH}"}
+        for n, photo in enumerate(detail["images"])
+    ]
+    return jsonify(out)
+
+# 6) listing photo, ?w= picks the thumbnail width (snapped to a standard size), no w = original
+# ?n= picks the n-th photo of the gallery, the default is the card photo
+@app.get("/image/<listing_id>")
+def image(listing_id):
+    try:
+        n = int(request.args.get("n", "0"))
+    except ValueError:
+        n = 0
+    if n > 0:
+        gallery = catalog_engine.get_home_gallery(str(listing_id))
+        url = gallery[n] if n < len(gallery) else None
+    else:
+        url = catalog_engine.idToImg.get(str(listing_id))
+    if not url:
+        abort(404)
+    try:
+        width = int(request.args.get("w", "0"))
+    except ValueError:
+        width = 0
+    try:
+        data, content_type = images.get(url, width)
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Could not load image: {e}"}), 502
+    return Response(data, mimetype=content_type, headers={"Cache-Control": "public, max-age=86400"})
+
+
+# 7) "more like this": the ?n= listings closest to this one in price, size, beds / baths, city, type and style
+@app.get("/similar/<listing_id>")
+def similar_listings(listing_id):
+    try:
+        n = int(request.args.get("n", "10"))
+    except ValueError:
+        n = 10
+    if catalog_engine.neighbors is None:
+        return jsonify({"ok": False, "error": "Similar listings are not available in pushdown mode."}), 501
+    if catalog_engine.get_home(str(listing_id)) is None:
+        abort(404)
+    # empty with "ready": false while the index is still being built
+    ready = catalog_engine.neighbors.ready()
+    out = []
+    for similarity, h in catalog_engine.get_similar_homes(str(listing_id), max(1, min(MAX_SIMILAR, n))):
+        item = listing_to_dict(h)
+        item["similarity"] = round(similarity, 4)
+        out.append(item)
+    return jsonify({"id": str(listing_id), "similar": out, "ready": ready})
+
+
 # ---------- Main ----------
+# development server only, for serving use wsgi.py (e.g. gunicorn --threads 8 wsgi:application)
 if __name__ == "__main__":
     #  auto-seed preferences:
     # seed_reasonable_defaults()
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", "5001")), debug=True)
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", "5001")),
+            debug=os.getenv("FLASK_DEBUG") == "1", threaded=True)
 
@@ -0,0 +1,179 @@
+"""
+Micro-benchmarks for the ranking path at several catalog sizes
+For each size a seeded synthetic houselisting.db is written (see synthetic.py) and the stages below are timed:
+    startup            UTA.UTAlgorithm() reading and indexing the DB
+    startup_snapshot   UTA.UTAlgorithm() mapping an up to date catalog snapshot instead
+    filter_indexed     filter_listings through ListingIndex
+    filter_linear      filter_listings over a plain list (no index)
+    score_scalar       score_listing for every listing (skipped above --scalar-limit)
+    score_batched      columnar scoring of every listing
+    recommend_cold     recommend_listing right after a constraint change
+    recommend_warm     recommend_listing with cached similarities
+    feedback           update_user_feedback
+
+    python benchmark.py --sizes 1000 10000 100000 --out bench.json
+    python benchmark.py --sizes 1000 10000 --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import algorithm
+import columnar
+import synthetic
+import UTA
+from constraints import Constraint, UserPreferences
+
+
+def bench_preferences():
+    prefs = UserPreferences()
+    prefs.update_constraint_value(Constraint.LOCATION, "San Jose")
+    prefs.update_constraint_value(Constraint.HOME_TYPE, {"single family", "condo"})
+    prefs.update_constraint_value(Constraint.STYLE, {"modern", "spanish", "craftsman"})
+    prefs.update_constraint_value(Constraint.SQUARE_FEET, 1200)
+    prefs.update_constraint_rigidity(Constraint.SQUARE_FEET, 0.1)
+    prefs.update_constraint_value(Constraint.BUDGET, 1500000)
+    prefs.update_constraint_rigidity(Constraint.BUDGET, 0.2)
+    return prefs
+
+
+def timed(fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "runs": repeat,
+        "min_ms": round(samples[0], 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "p90_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.9))], 4),
+    }
+
+
+def load_engine(db_dir, catalog_path=None):
+    #UTAlgorithm opens houselisting.db in the working directory
+    cwd = os.getcwd()
+    os.chdir(db_dir)
+    try:
+        return UTA.UTAlgorithm(catalog_path=catalog_path)
+    finally:
+        os.chdir(cwd)
+
+
+def run_size(n, seed, repeat, scalar_limit):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic.write_db(os.path.join(tmp, "houselisting.db"), n, seed)
+
+        engine = None
+        def start():
+            nonlocal engine
+            engine = load_engine(tmp)
+        results["startup"] = timed(start, max(1, min(repeat, 3)))
+
+        load_engine(tmp, "catalog.bin") #writes the snapshot
+        results["startup_snapshot"] = timed(lambda: load_engine(tmp, "catalog.bin"), repeat)
+
+    listings = engine.listings
+    prefs = bench_preferences()
+    rec = engine.algorithm
+    plain = algorithm.HousingRecommender()
+
+    results["filter_indexed"] = timed(lambda: rec.filter_listings(listings, prefs), repeat)
+    results["filter_linear"] = timed(lambda: plain.filter_listings(list(listings), prefs), repeat)
+    candidates = rec.filter_listings(listings, prefs)
+
+    if n <= scalar_limit:
+        results["score_scalar"] = timed(lambda: [plain.score_listing(l, prefs) for l in listings], max(1, repeat // 2))
+    if engine.catalog is not None:
+        rows = engine.catalog.rows_for(listings)
+        results["score_batched"] = timed(lambda: engine.catalog.score(rec, prefs, rows), repeat)
+
+    budgets = iter(range(1_500_001, 1_500_001 + repeat * 2))
+    def change_constraints():
+        prefs.update_constraint_value(Constraint.BUDGET, next(budgets))
+    consumed = set()
+    results["recommend_cold"] = timed(lambda: rec.recommend_listing(prefs, listings, consumed), repeat,
+                                      setup=change_constraints)
+    results["recommend_warm"] = timed(lambda: rec.recommend_listing(prefs, listings, consumed), repeat)
+
+    sample = candidates[0] if candidates else listings[0]
+    liked = iter([True, False] * repeat)
+    results["feedback"] = timed(lambda: rec.update_user_feedback(prefs, sample, next(liked)), repeat)
+
+    results["candidates"] = len(candidates)
+    return results
+
+
+def compare(report, baseline, threshold):
+    """
+    Prints median ratios against a previous report, returns the stages that got slower than threshold
+    """
+    regressions = []
+    for size, stages in report["results"].items():
+        old = baseline.get("results", {}).get(size, {})
+        for stage, r in stages.items():
+            if not isinstance(r, dict) or stage not in old:
+                continue
+            ratio = r["median_ms"] / max(old[stage]["median_ms"], 1e-6)
+            flag = "  <-- slower" if ratio > threshold else ""
+            print(f"{size:>10} {stage:<16} {old[stage]['median_ms']:>10.3f} -> {r['median_ms']:>10.3f} ms  x{ratio:.2f}{flag}")
+            if ratio > threshold:
+                regressions.append((size, stage, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the HousingRecommender ranking path")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--scalar-limit", type=int, default=100000, help="largest size to run score_scalar at")
+    parser.add_argument("--out", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="previous JSON report to diff against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio that counts as a regression")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": columnar.np.__version__ if columnar.available() else None,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+    for n in args.sizes:
+        print(f"benchmarking {n} listings...", file=sys.stderr)
+        report["results"][str(n)] = run_size(n, args.seed, args.repeat, args.scalar_limit)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    elif not args.compare:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""
+Per-session view over the shared, read-only listing catalog
+Handing a listing out tombstones its id instead of removing it from a list, so lookups,
+removal and the raw-catalog fallback are all O(1) (amortized) no matter the catalog size
+"""
+
+
+class CandidatePool:
+    def __init__(self, listings, by_id):
+        self.listings = listings #shared catalog, never modified
+        self.by_id = by_id       #shared id -> listing
+        self.consumed = set()    #tombstones, ids this session already handed out
+        self._cursor = 0         #raw fallback scan position, only moves forward
+
+    def __len__(self):
+        return len(self.listings) - len(self.consumed)
+
+    def __contains__(self, listing_id):
+        return listing_id in self.by_id and listing_id not in self.consumed
+
+    def __iter__(self):
+        return (h for h in self.listings if h.id not in self.consumed)
+
+    def get(self, listing_id):
+        return self.by_id.get(listing_id)
+
+    def consume(self, listing):
+        self.consumed.add(listing.id)
+
+    def next_unconsumed(self):
+        """
+        Next listing in catalog order that was never handed out, or None when the pool is empty
+        """
+        while self._cursor < len(self.listings):
+            h = self.listings[self._cursor]
+            self._cursor += 1
+            if h.id not in self.consumed:
+                self.consumed.add(h.id)
+                return h
+        return None
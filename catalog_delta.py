@@ -0,0 +1,246 @@
+"""
+Delta segment over a loaded catalog, so a hot reload costs the rows that changed instead of the whole catalog
+The base catalog (a list of Listings or a catalog_file mapping) keeps its listings, index, columns and images;
+re-stamped listings are patched over their base row and new ones are appended after the last row, so row
+numbers (and candidate pool cursors) stay valid. Every refresh folds its rows into one delta over the same base;
+once the delta outgrows COMPACT_FRACTION of the base, apply returns None and UTAlgorithm.refresh_catalog
+rebuilds (and re-exports) the whole catalog instead.
+Rows deleted from the DB are not noticed: they stay in the catalog until the next full load.
+"""
+
+from itertools import chain
+
+import algorithm
+import catalog_file
+import columnar
+import similar
+
+np = columnar.np
+
+COMPACT_FRACTION = 0.05 #delta rows per base row before the catalog is rebuilt
+
+
+class DeltaListings:
+    """
+    Sequence of the catalog: base rows (the replaced ones swapped for their new version), then the appended rows
+    """
+    def __init__(self, base_parts, replaced, appended):
+        self.base_parts = base_parts #UTAlgorithm catalog parts of the base, see apply
+        self.base_listings = base_parts["listings"]
+        self.replaced = replaced     #base row -> Listing
+        self.appended = appended     #[Listing], rows len(base_listings) onwards
+        self.split = len(self.base_listings)
+        self._base_row = _row_lookup(base_parts)
+        self._rows = {h.id: r for r, h in self.delta_items()}
+
+    def __len__(self):
+        return self.split + len(self.appended)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i >= self.split:
+            return self.appended[i - self.split]
+        h = self.replaced.get(i)
+        return h if h is not None else self.base_listings[i]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __contains__(self, listing):
+        return self.row_of(getattr(listing, "id", None)) is not None
+
+    def row_of(self, listing_id):
+        row = self._rows.get(listing_id)
+        return row if row is not None else self._base_row(listing_id)
+
+    def delta_items(self):
+        """
+        (row, Listing) of every patched or appended row
+        """
+        return chain(self.replaced.items(), enumerate(self.appended, self.split))
+
+    def delta(self):
+        return list(self.replaced.values()) + self.appended
+
+
+class DeltaIds:
+    """
+    listing id -> Listing, the delta's listings first
+    """
+    def __init__(self, base, fresh):
+        self.base = base
+        self.fresh = fresh
+
+    def __len__(self):
+        return len(self.base) + sum(1 for i in self.fresh if i not in self.base)
+
+    def get(self, listing_id, default=None):
+        h = self.fresh.get(listing_id)
+        return h if h is not None else self.base.get(listing_id, default)
+
+    def __getitem__(self, listing_id):
+        h = self.get(listing_id)
+        if h is None:
+            raise KeyError(listing_id)
+        return h
+
+    def __contains__(self, listing_id):
+        return listing_id in self.fresh or listing_id in self.base
+
+
+class DeltaImages(DeltaIds):
+    """
+    listing id -> first image url, like UTAlgorithm.idToImg; a listing keeps the first image it was loaded with
+    """
+    def items(self):
+        return chain(self.base.items(), self.fresh.items())
+
+
+class DeltaIndex:
+    """
+    The base ListingIndex (or catalog_file.MappedIndex) for the base rows, a linear filter over the delta rows
+    """
+    def __init__(self, base, listings):
+        self.base = base
+        self.listings = listings
+
+    def __len__(self):
+        return len(self.listings)
+
+    def covers(self, listings):
+        return listings is self.listings
+
+    def rows_of(self, listing_ids):
+        rows = (self.listings.row_of(i) for i in listing_ids)
+        return [r for r in rows if r is not None]
+
+    def filter_rows(self, plan):
+        replaced = self.listings.replaced
+        rows = [r for r in self.base.filter_rows(plan) if r not in replaced]
+        rows += [r for r, h in self.listings.delta_items() if plan(h)]
+        rows.sort()
+        return rows
+
+    def filter(self, plan):
+        return catalog_file.RowView(self.listings, self.filter_rows(plan))
+
+
+def _row_lookup(parts):
+    listings = parts["listings"]
+    if isinstance(listings, catalog_file.MappedListings):
+        return listings.catalog.row_of
+    return parts["index"].row_of.get
+
+
+class DeltaCatalog:
+    """
+    The base ColumnarCatalog for the base rows, a small side catalog over the delta rows
+    The base columns (views into a shared catalog_file mapping in mapped mode) are never copied or written,
+    so a refresh costs the rows that changed and workers keep sharing the mapping
+    """
+    def __init__(self, base, listings, side):
+        self.base = base
+        self.listings = listings
+        self.side = side #ColumnarCatalog over the delta rows, in row order
+        self.side_rows = np.array(sorted(r for r, _ in listings.delta_items()), dtype=np.intp)
+
+    def __len__(self):
+        return len(self.listings)
+
+    def rows_for(self, listings):
+        """
+        Map a list of listings onto catalog rows, or None if any of them is not in the catalog
+        """
+        if listings is self.listings:
+            return np.arange(len(self.listings))
+        if getattr(listings, "base", None) is self.listings: #a row view over the catalog, see catalog_file.RowView
+            return np.asarray(listings.rows, dtype=np.intp)
+        rows = np.empty(len(listings), dtype=np.intp)
+        for i, l in enumerate(listings):
+            r = self.listings.row_of(l.id)
+            if r is None or self.listings[r] is not l:
+                return None
+            rows[i] = r
+        return rows
+
+    def similarities(self, user_preferences, rows):
+        #replaced base rows still hold their old values in the base columns, they are read from the side catalog
+        rows = np.asarray(rows, dtype=np.intp)
+        at = np.searchsorted(self.side_rows, rows)
+        patched = at < len(self.side_rows)
+        patched[patched] = self.side_rows[at[patched]] == rows[patched]
+        out = np.empty((5, len(rows)))
+        out[:, ~patched] = self.base.similarities(user_preferences, rows[~patched])
+        if patched.any():
+            out[:, patched] = self.side.similarities(user_preferences, at[patched])
+        return out
+
+    def score(self, recommender, user_preferences, rows):
+        return columnar.weighted_sum(recommender.coefficients(user_preferences), self.similarities(user_preferences, rows))
+
+
+def _catalog(base, listings):
+    #None (scoring listing by listing) without a base catalog; raises ValueError when the side catalog can't be built
+    if base is None:
+        return None
+    side = columnar.build([listings[r] for r in sorted(r for r, _ in listings.delta_items())])
+    if side is None:
+        raise ValueError("delta styles do not fit the style column")
+    return DeltaCatalog(base, listings, side)
+
+
+def apply(parts, fresh, images):
+    """
+    Catalog parts (the attributes UTAlgorithm._memory_parts returns) with the fresh Listings patched in and
+    images, (listing id, url) pairs in DB order, added where a listing had none
+    None when the catalog should be rebuilt instead: the delta outgrew COMPACT_FRACTION of the base,
+    or its styles no longer fit a style column
+    """
+    listings = parts["listings"]
+    if isinstance(listings, DeltaListings):
+        base = listings.base_parts
+        replaced, appended = dict(listings.replaced), list(listings.appended)
+        added_images = dict(parts["idToImg"].fresh)
+    else:
+        base = parts
+        replaced, appended, added_images = {}, [], {}
+
+    base_row = _row_lookup(base)
+    appended_at = {h.id: j for j, h in enumerate(appended)}
+    for h in fresh:
+        j = appended_at.get(h.id)
+        row = base_row(h.id) if j is None else None
+        if j is not None:
+            appended[j] = h
+        elif row is not None:
+            replaced[row] = h
+        else:
+            appended_at[h.id] = len(appended)
+            appended.append(h)
+    if len(replaced) + len(appended) > COMPACT_FRACTION * len(base["listings"]):
+        return None
+
+    for listing_id, url in images:
+        if listing_id not in added_images and listing_id not in base["idToImg"]:
+            added_images[listing_id] = url
+
+    delta = DeltaListings(base, replaced, appended)
+    try:
+        catalog = _catalog(base["catalog"], delta)
+    except ValueError:
+        return None
+    by_id = DeltaIds(base["by_id"], {h.id: h for h in delta.delta()})
+    return {
+        "listings": delta,
+        "database": delta,
+        "by_id": by_id,
+        "index": DeltaIndex(base["index"], delta),
+        "idToImg": DeltaImages(base["idToImg"], added_images),
+        "catalog": catalog,
+        "sim_cache": algorithm.SimilarityCache(),
+        #"more like this" keeps the base's index, patched and appended rows are re-indexed at the next rebuild
+        "neighbors": similar.Neighbors(delta, by_id, base=base["neighbors"]),
+    }
@@ -0,0 +1,512 @@
+"""
+Memory-mapped columnar catalog file, written once and mapped read-only by every worker process
+Listings are kept as fixed-width columns plus a string table, with the secondary indexes
+(per-city / per-type / per-style postings, sorted numeric columns) precomputed, so a worker
+maps the file in milliseconds and the OS shares the pages between processes.
+Listing objects are only built for rows a worker actually touches.
+The file doubles as the startup snapshot: meta["source"] is the DB fingerprint it was built from,
+and open_snapshot only maps it while the DB still has that fingerprint.
+
+    python catalog_file.py houselisting.db catalog.bin
+
+Layout: 8 byte magic, 8 byte header length, JSON header, then 8-byte aligned sections
+    header = {"format": FORMAT, "rows": n, "columns": {name: [typecode, offset, count]}, "meta": {...}}
+typecodes are array / memoryview formats: q int64, d float64, i int32, Q uint64, B uint8
+"""
+
+from array import array
+from bisect import bisect_left
+import hashlib
+import heapq
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+
+import algorithm
+import columnar
+import vocab
+from listing_index import ListingIndex
+
+MAGIC = b"HFCAT\0\0\1"
+FORMAT = 2 #bump whenever the layout or the meaning of a column changes, old files are then rebuilt
+
+log = logging.getLogger("housefindr")
+
+NUMERIC = ("price", "sqft", "beds", "baths") #float64 columns, bit i of "nulls" marks a missing NUMERIC[i]
+CATEGORICAL = ("city", "listing_type", "tenure") #int32 codes into a per-column dictionary, -1 for None
+
+
+#===WRITING===#
+
+class _StringTable:
+    def __init__(self):
+        self.codes = {}
+        self.blob = bytearray()
+        self.offsets = array("q", [0])
+
+    def add(self, s):
+        code = self.codes.get(s)
+        if code is None:
+            code = self.codes[s] = len(self.offsets) - 1
+            self.blob += s.encode("utf-8")
+            self.offsets.append(len(self.blob))
+        return code
+
+
+def _postings(codes, k):
+    """
+    Rows grouped by code (catalog order inside a group) and the start of each group, k groups
+    """
+    counts = [0] * (k + 1)
+    for c in codes:
+        if c >= 0:
+            counts[c + 1] += 1
+    starts = array("i", counts)
+    for j in range(1, k + 1):
+        starts[j] += starts[j - 1]
+    fill = list(starts[:k])
+    rows = array("i", bytes(4 * starts[k]))
+    for i, c in enumerate(codes):
+        if c >= 0:
+            rows[fill[c]] = i
+            fill[c] += 1
+    return rows, starts
+
+
+def build_columns(listings, images):
+    """
+    name -> array for every column of the file
+    listings: algorithm.Listing objects with integer ids, images: listing id -> first image url
+    """
+    n = len(listings)
+    strings = _StringTable()
+    cols = {"ids": array("q", (int(l.id) for l in listings)), "nulls": array("B", bytes(n))}
+    nulls = cols["nulls"]
+
+    for bit, field in enumerate(NUMERIC):
+        values = array("d", bytes(8 * n))
+        for i, l in enumerate(listings):
+            v = getattr(l, field)
+            if v is None:
+                nulls[i] |= 1 << bit
+            else:
+                values[i] = v
+        cols[field] = values
+
+        #same order as ListingIndex._sorted_column: rows without a value are left out
+        rows = sorted((i for i in range(n) if not nulls[i] >> bit & 1), key=values.__getitem__)
+        rank = array("i", [-1]) * n
+        for pos, i in enumerate(rows):
+            rank[i] = pos
+        cols[field + "_sorted_rows"] = array("i", rows)
+        cols[field + "_sorted_values"] = array("d", (values[i] for i in rows))
+        cols[field + "_rank"] = rank
+
+    for field in CATEGORICAL:
+        local = vocab.Vocabulary()
+        codes = array("i", (local.intern(getattr(l, field)) for l in listings))
+        cols[field] = codes
+        cols[field + "_dict"] = array("i", (strings.add(v) for v in local.values))
+        cols[field + "_postings"], cols[field + "_starts"] = _postings(codes, len(local))
+
+    style_bits = vocab.Vocabulary()
+    masks = array("Q", bytes(8 * n))
+    for i, l in enumerate(listings):
+        mask = style_bits.intern_mask(columnar.style_set(l.style))
+        if len(style_bits) > columnar.MAX_STYLES:
+            raise ValueError(f"Catalog has more than {columnar.MAX_STYLES} distinct styles.")
+        masks[i] = mask
+    cols["style"] = masks
+    cols["style_dict"] = array("i", (strings.add(s) for s in style_bits.values))
+    style_rows, style_starts = array("i"), array("i", [0])
+    for bit in range(len(style_bits)):
+        style_rows.extend(i for i in range(n) if masks[i] >> bit & 1)
+        style_starts.append(len(style_rows))
+    cols["style_postings"], cols["style_starts"] = style_rows, style_starts
+
+    keyed = sorted((int(k), url) for k, url in images.items() if url is not None)
+    cols["image_keys"] = array("q", (k for k, _ in keyed))
+    cols["image_urls"] = array("i", (strings.add(url) for _, url in keyed))
+
+    cols["string_offsets"] = strings.offsets
+    cols["string_blob"] = array("B", bytes(strings.blob))
+    cols["id_order"] = array("i", sorted(range(n), key=cols["ids"].__getitem__))
+    return cols
+
+
+def write_catalog(path, listings, images, meta=None):
+    """
+    Writes the catalog file atomically, readers mapping the old file keep their pages
+    """
+    cols = build_columns(listings, images)
+
+    sections, offset = {}, 0
+    for name, values in cols.items():
+        sections[name] = [values.typecode, offset, len(values)]
+        offset += -(-len(values) * values.itemsize // 8) * 8
+    header = json.dumps({"format": FORMAT, "rows": len(listings), "columns": sections, "meta": meta or {}}).encode()
+    header += b" " * (-len(header) % 8)
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, values in cols.items():
+            data = values.tobytes()
+            f.write(data)
+            f.write(b"\0" * (-len(data) % 8))
+    os.replace(tmp, path)
+    return path
+
+
+#===READING===#
+
+def _number(value, missing):
+    if missing:
+        return None
+    return int(value) if value.is_integer() else value
+
+
+class MappedCatalog:
+    """
+    Read-only view of a catalog file
+    Columns are memoryviews into the mapping (numpy arrays in .arrays when numpy is installed)
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != MAGIC:
+            raise ValueError(f"{path} is not a catalog file.")
+        (header_len,) = struct.unpack_from("<Q", self._mm, 8)
+        header = json.loads(self._mm[16:16 + header_len])
+        if header.get("format") != FORMAT:
+            raise ValueError(f"{path} has catalog format {header.get('format')}, expected {FORMAT}.")
+        self.rows = header["rows"]
+        self.meta = header["meta"]
+
+        base = 16 + header_len
+        view = memoryview(self._mm)
+        self.cols = {}
+        self.arrays = {}
+        for name, (typecode, offset, count) in header["columns"].items():
+            size = array(typecode).itemsize
+            start = base + offset
+            self.cols[name] = view[start:start + count * size].cast(typecode)
+            if columnar.available():
+                self.arrays[name] = columnar.np.frombuffer(self._mm, dtype=typecode, count=count, offset=start)
+
+        #per-column dictionaries are small (distinct cities, types, styles), decode them once
+        self.dicts = {f: [self.string(c) for c in self.cols[f + "_dict"]] for f in CATEGORICAL + ("style",)}
+        self.codes = {f: {v: j for j, v in enumerate(values)} for f, values in self.dicts.items()}
+
+        self.listings = MappedListings(self)
+        self.by_id = IdLookup(self)
+        self.images = MappedImages(self)
+
+    def __len__(self):
+        return self.rows
+
+    def string(self, code):
+        offsets = self.cols["string_offsets"]
+        return bytes(self.cols["string_blob"][offsets[code]:offsets[code + 1]]).decode("utf-8")
+
+    def listing(self, i):
+        """
+        Builds the Listing for row i, callers go through MappedListings so each row is built once
+        """
+        c = self.cols
+        missing = c["nulls"][i]
+        values = {f: _number(c[f][i], missing >> bit & 1) for bit, f in enumerate(NUMERIC)}
+        for f in CATEGORICAL:
+            code = c[f][i]
+            values[f] = self.dicts[f][code] if code >= 0 else None
+        mask = c["style"][i]
+        styles = [s for bit, s in enumerate(self.dicts["style"]) if mask >> bit & 1]
+        #the DB stores one style per listing as a string
+        style = None if not styles else styles[0] if len(styles) == 1 else set(styles)
+        return algorithm.Listing(id=str(c["ids"][i]), style=style, **values)
+
+    def row_of(self, listing_id):
+        try:
+            key = int(listing_id)
+        except (TypeError, ValueError):
+            return None
+        ids, order = self.cols["ids"], self.cols["id_order"]
+        j = bisect_left(order, key, key=ids.__getitem__)
+        if j < len(order) and ids[order[j]] == key:
+            return order[j]
+        return None
+
+    def columnar(self):
+        """
+        ColumnarCatalog over the mapped columns, None without numpy
+        """
+        if not columnar.available():
+            return None
+        a = self.arrays
+        return columnar.ColumnarCatalog.from_columns(
+            self.listings, self.by_id,
+            a["price"], a["sqft"],
+            a["city"], self.codes["city"],
+            a["listing_type"], self.codes["listing_type"],
+            a["style"], self.codes["style"],
+        )
+
+    def index(self):
+        return MappedIndex(self)
+
+
+#===SNAPSHOT VALIDATION===#
+
+def db_fingerprint(db_path, content_hash=False):
+    """
+    What a snapshot is built from: the largest listing rowid and created_at and the largest image rowid,
+    index lookups so this stays O(log n) on any catalog size (created_at is indexed by ingest.py).
+    Importers append rows and ingest.py re-stamps the rows it upserts, so both move the fingerprint;
+    with content_hash a hash of the DB file also catches rows edited without a new created_at or deleted
+    None when the DB can't be read, which never matches a snapshot
+    """
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            newest = conn.execute("SELECT MAX(rowid), MAX(created_at) FROM listings").fetchone()
+            images = conn.execute("SELECT MAX(rowid) FROM images").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+    source = {"format": FORMAT, "listings": list(newest or ()), "images": images[0]}
+    if content_hash:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(db_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        source["hash"] = digest.hexdigest()
+    return source
+
+
+def db_watermark(db_path):
+    """
+    [max listing id, max listing created_at, max image id]; a catalog loaded at this watermark is missing exactly
+    the rows with a larger id or created_at. Cheap once listings(created_at) is indexed (see catalog_refresh.py)
+    """
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            max_id, max_created = conn.execute("SELECT MAX(id), MAX(created_at) FROM listings").fetchone()
+            (max_image,) = conn.execute("SELECT MAX(id) FROM images").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return [max_id or 0, max_created or "", max_image or 0]
+
+
+def open_snapshot(path, source):
+    """
+    MappedCatalog of the snapshot at path if it was built from a DB with this fingerprint, None otherwise
+    """
+    if source is None or not os.path.exists(path):
+        return None
+    try:
+        mapped = MappedCatalog(path)
+    except (OSError, ValueError) as e:
+        log.warning("Ignoring catalog snapshot %s: %s", path, e)
+        return None
+    if mapped.meta.get("source") != source or "watermark" not in mapped.meta:
+        log.info("Catalog snapshot %s is stale, rebuilding from the DB", path)
+        return None
+    return mapped
+
+
+class MappedListings:
+    """
+    Sequence of the catalog's listings, each built on first access and then reused
+    so identity checks (ListingIndex.covers, ColumnarCatalog.rows_for) keep working
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._built = {} #row -> Listing, grows with the rows this process has touched
+
+    def __len__(self):
+        return self.catalog.rows
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("listing index out of range")
+        h = self._built.get(i)
+        if h is None:
+            h = self._built.setdefault(i, self.catalog.listing(i)) #another thread may have built it first
+        return h
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __contains__(self, listing):
+        return self.catalog.row_of(getattr(listing, "id", None)) is not None
+
+
+class RowView:
+    """
+    Listings at some catalog rows, built only when read
+    """
+    def __init__(self, base, rows):
+        self.base = base
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.base[r] for r in self.rows[i]]
+        return self.base[self.rows[i]]
+
+    def __iter__(self):
+        return (self.base[r] for r in self.rows)
+
+    def __bool__(self):
+        return len(self.rows) > 0
+
+
+class IdLookup:
+    """
+    listing id -> Listing without a per-process dict, binary search over the id column
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __len__(self):
+        return self.catalog.rows
+
+    def get(self, listing_id, default=None):
+        row = self.catalog.row_of(listing_id)
+        return default if row is None else self.catalog.listings[row]
+
+    def __getitem__(self, listing_id):
+        h = self.get(listing_id)
+        if h is None:
+            raise KeyError(listing_id)
+        return h
+
+    def __contains__(self, listing_id):
+        return self.catalog.row_of(listing_id) is not None
+
+
+class MappedImages:
+    """
+    listing id -> first image url, like UTAlgorithm.idToImg
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.keys = catalog.cols["image_keys"]
+        self.urls = catalog.cols["image_urls"]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key, default=None):
+        try:
+            key = int(key)
+        except (TypeError, ValueError):
+            return default
+        j = bisect_left(self.keys, key)
+        if j < len(self.keys) and self.keys[j] == key:
+            return self.catalog.string(self.urls[j])
+        return default
+
+    def __getitem__(self, key):
+        url = self.get(key)
+        if url is None:
+            raise KeyError(key)
+        return url
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def items(self):
+        return ((str(k), self.catalog.string(u)) for k, u in zip(self.keys, self.urls))
+
+
+def _unique(sorted_rows):
+    last = -1
+    for r in sorted_rows:
+        if r != last:
+            yield r
+            last = r
+
+
+class MappedIndex(ListingIndex):
+    """
+    ListingIndex answered from the file's postings and sorted columns, nothing is built per process
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.listings = catalog.listings
+        c = catalog.cols
+        self.sorted_cols = {f: (c[f + "_sorted_rows"], c[f + "_sorted_values"], c[f + "_rank"]) for f in NUMERIC}
+
+    def rows_of(self, listing_ids):
+        rows = (self.catalog.row_of(i) for i in listing_ids)
+        return [r for r in rows if r is not None]
+
+    def _group(self, field, j):
+        starts = self.catalog.cols[field + "_starts"]
+        return self.catalog.cols[field + "_postings"][starts[j]:starts[j + 1]]
+
+    def city_rows(self, city):
+        j = self.catalog.codes["city"].get(city)
+        if j is None:
+            return 0, (), lambda i: False
+        col = self.catalog.cols["city"]
+        rows = self._group("city", j)
+        return len(rows), rows, lambda i: col[i] == j
+
+    def style_rows(self, styles):
+        bits = [self.catalog.codes["style"][s] for s in styles if s in self.catalog.codes["style"]]
+        if not bits:
+            return 0, (), lambda i: False
+        mask = 0
+        for b in bits:
+            mask |= 1 << b
+        col = self.catalog.cols["style"]
+        groups = [self._group("style", b) for b in bits]
+        rows = groups[0] if len(groups) == 1 else _unique(heapq.merge(*groups))
+        return sum(map(len, groups)), rows, lambda i: col[i] & mask != 0
+
+    def filter(self, plan):
+        return RowView(self.listings, self.filter_rows(plan))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import sql_catalog
+
+    parser = argparse.ArgumentParser(description="Export houselisting.db to a memory-mapped catalog file")
+    parser.add_argument("db")
+    parser.add_argument("out")
+    parser.add_argument("--content-hash", action="store_true", help="validate against a hash of the DB file")
+    args = parser.parse_args()
+
+    source = db_fingerprint(args.db, args.content_hash)
+    watermark = db_watermark(args.db)
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True) #read-only, like UTAlgorithm._load_catalog
+    listings = [sql_catalog.listing_from_row(row)
+                for row in conn.execute(f"SELECT {sql_catalog.COLUMNS} FROM listings")]
+    images = {}
+    for listing_id, url in conn.execute("SELECT listing_id, url FROM images ORDER BY id"):
+        images.setdefault(str(listing_id), url) #first image per listing, like UTAlgorithm.idToImg
+    conn.close()
+    write_catalog(args.out, listings, images, meta={"source": source, "watermark": watermark})
+    print(f"Wrote {len(listings)} listings to {args.out}")
@@ -0,0 +1,58 @@
+"""
+Hot reload of the listing catalog
+A background thread asks the catalog engine every interval seconds whether the DB moved past the
+watermark its catalog was loaded at; only the new (or re-stamped) rows are read, and sessions move onto
+the new catalog at their next request (UTAlgorithm.sync_catalog) without losing their feed or weights
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+
+import metrics
+
+log = logging.getLogger("housefindr")
+
+#MAX(created_at) is a full scan without it; created by ingest.py, the server never writes the DB
+WATERMARK_INDEX = "CREATE INDEX IF NOT EXISTS idx_listings_created_at ON listings(created_at)"
+
+
+class CatalogRefresher:
+    def __init__(self, engine, db_path, interval=30.0):
+        self.engine = engine
+        self.db_path = db_path
+        self.interval = interval
+        self._start()
+        #same as the session flush thread, forked workers (gunicorn --preload) need their own
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="catalog-refresh", daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        with metrics.RELOAD_SECONDS.time():
+            changed = self.engine.refresh_catalog()
+        if changed:
+            metrics.RELOADED_LISTINGS.inc(changed)
+            log.info("Catalog refreshed: %d new or changed listings (generation %d)", changed, self.engine.generation)
+        return changed
+
+    def _run(self):
+        while not self._stop:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop:
+                break
+            try:
+                self.refresh()
+            except (sqlite3.Error, OSError, ValueError) as e:
+                log.warning("Catalog refresh failed: %s", e)
+
+    def close(self):
+        self._stop = True
+        self._wake.set()
+        self._thread.join(timeout=5)
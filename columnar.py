@@ -0,0 +1,231 @@
+"""
+Column-oriented view of the listing catalog, used by HousingRecommender to score
+every candidate in one batched pass instead of calling score_listing per listing.
+NumPy is optional: without it the recommender keeps using the scalar path.
+"""
+
+import logging
+
+try:
+    import numpy as np
+except ImportError:  #optional dependency, scalar scoring still works
+    np = None
+
+from constraints import Constraint
+import vocab
+
+MAX_STYLES = 64 #style bitmask is a uint64
+
+log = logging.getLogger("housefindr")
+
+_narrow_warned = False
+
+
+def available():
+    return np is not None
+
+
+def styles_fit(count=None):
+    """
+    Whether count distinct styles (default: every style seen so far) fit the uint64 style columns
+    """
+    return (len(vocab.STYLES) if count is None else count) <= MAX_STYLES
+
+
+def build(listings):
+    """
+    ColumnarCatalog over the listings, or None (the scalar path) without numpy or with more styles than
+    the style column holds; free-text styles in imported files can easily exceed that, it must never stop a load
+    """
+    global _narrow_warned
+    if np is None:
+        return None
+    if not styles_fit():
+        if not _narrow_warned:
+            _narrow_warned = True
+            log.warning("%d distinct styles exceed the %d-bit style column, scoring listing by listing",
+                        len(vocab.STYLES), MAX_STYLES)
+        return None
+    return ColumnarCatalog(listings)
+
+
+def style_set(style):
+    """
+    Listing styles arrive either as a set or as a plain string from SQLite
+    """
+    if isinstance(style, str):
+        return {style}
+    if isinstance(style, (set, frozenset, list, tuple)):
+        return set(style)
+    return set()
+
+
+class ColumnarCatalog:
+    """
+    Holds the catalog as parallel arrays (price, sqft, city code, type code, style bitmask)
+    Row i of every column describes self.listings[i]
+    """
+    def __init__(self, listings):
+        if np is None:
+            raise RuntimeError("ColumnarCatalog requires numpy.")
+
+        self.listings = list(listings)
+        self.row_of = {l.id: i for i, l in enumerate(self.listings)}
+
+        #listings already carry vocab codes and style bitmasks, the columns are copies of those
+        self.city_codes = vocab.CITIES.codes
+        self.type_codes = vocab.LISTING_TYPES.codes
+        self.style_bits = vocab.STYLES.codes
+        if len(vocab.STYLES) > MAX_STYLES:
+            raise ValueError(f"Catalog has more than {MAX_STYLES} distinct styles.")
+
+        n = len(self.listings)
+        ls = self.listings
+        self.price = np.fromiter((l.price if l.price is not None else 0 for l in ls), dtype=np.float64, count=n)
+        self.sqft = np.fromiter((l.sqft if l.sqft is not None else 0 for l in ls), dtype=np.float64, count=n)
+        self.city = np.fromiter((l.city_code for l in ls), dtype=np.int32, count=n)
+        self.listing_type = np.fromiter((l.type_code for l in ls), dtype=np.int32, count=n)
+        self.style = np.fromiter((l.style_mask for l in ls), dtype=np.uint64, count=n)
+
+    @classmethod
+    def from_columns(cls, listings, row_of, price, sqft, city, city_codes, listing_type, type_codes, style, style_bits):
+        """
+        Wraps arrays that already exist (e.g. views into a catalog_file mapping) without copying them
+        row_of only needs a .get(listing_id) method
+        """
+        if np is None:
+            raise RuntimeError("ColumnarCatalog requires numpy.")
+        self = cls.__new__(cls)
+        self.listings = listings
+        self.row_of = row_of
+        self.price, self.sqft = price, sqft
+        self.city, self.city_codes = city, city_codes
+        self.listing_type, self.type_codes = listing_type, type_codes
+        self.style, self.style_bits = style, style_bits
+        return self
+
+    def __len__(self):
+        return len(self.listings)
+
+    #===ROW LOOKUP===#
+
+    def rows_for(self, listings):
+        """
+        Map a list of listings onto catalog rows, or None if any of them is not in the catalog
+        """
+        if listings is self.listings:
+            return np.arange(len(self.listings))
+        if getattr(listings, "base", None) is self.listings: #a row view over the catalog, see catalog_file.RowView
+            return np.asarray(listings.rows, dtype=np.intp)
+        rows = np.empty(len(listings), dtype=np.intp)
+        for i, l in enumerate(listings):
+            r = self.row_of.get(l.id)
+            if r is None or self.listings[r] is not l:
+                return None
+            rows[i] = r
+        return rows
+
+    def style_mask(self, styles):
+        #styles first seen after this catalog was built can have codes past the column, no row has them
+        mask = 0
+        for s in style_set(styles):
+            bit = self.style_bits.get(s)
+            if bit is not None and bit < MAX_STYLES:
+                mask |= 1 << bit
+        return np.uint64(mask)
+
+    #===BATCHED SIMILARITIES===#
+    #each mirrors the scalar helper of the same name in algorithm.HousingRecommender
+
+    def sim_budget(self, rows, max_budget):
+        if not (isinstance(max_budget, (int, float)) and max_budget > 0):
+            return np.zeros(len(rows))
+        p = self.price[rows]
+        under = 1.0 - (max_budget - p) / (max_budget + 1e-9) * 0.15
+        over = np.maximum(0.0, 1.0 - 1.25 * ((p - max_budget) / (max_budget + 1e-9)))
+        return np.where(p <= max_budget, under, over)
+
+    def sim_sqft(self, rows, min_sqft):
+        if not (isinstance(min_sqft, (int, float)) and min_sqft > 0):
+            return np.zeros(len(rows))
+        s = self.sqft[rows]
+        surplus = (s - min_sqft) / (min_sqft + 1e-9)
+        above = np.minimum(1.0, 0.7 + 0.3 * np.minimum(1.0, surplus))
+        below = np.maximum(0.0, 1.0 - 1.5 * ((min_sqft - s) / (min_sqft + 1e-9)))
+        return np.where(s >= min_sqft, above, below)
+
+    def match_location(self, rows, wanted_city):
+        if not isinstance(wanted_city, str) or not wanted_city:
+            return np.zeros(len(rows))
+        code = self.city_codes.get(wanted_city)
+        if code is None:
+            return np.zeros(len(rows))
+        return (self.city[rows] == code).astype(np.float64)
+
+    def match_home_type(self, rows, pref):
+        if isinstance(pref, set):
+            codes = [self.type_codes[t] for t in pref if t in self.type_codes]
+        elif isinstance(pref, str) and pref:
+            codes = [self.type_codes[pref]] if pref in self.type_codes else []
+        else:
+            codes = []
+        if not codes:
+            return np.zeros(len(rows))
+        return np.isin(self.listing_type[rows], codes).astype(np.float64)
+
+    def match_style(self, rows, pref):
+        if isinstance(pref, str):
+            pref = {pref}
+        if not (isinstance(pref, set) and len(pref) > 0):
+            return np.zeros(len(rows))
+        return ((self.style[rows] & self.style_mask(pref)) != 0).astype(np.float64)
+
+    #===SCORING===#
+
+    def similarities(self, user_preferences, rows):
+        """
+        5 x len(rows) matrix of per-listing similarities (budget, sqft, location, home type, style)
+        Only depends on the constraints, so it can be cached while the weights keep moving
+        """
+        c = user_preferences.constraints
+        return np.vstack((
+            self.sim_budget(rows, c[Constraint.BUDGET].get_preference_value()),
+            self.sim_sqft(rows, c[Constraint.SQUARE_FEET].get_preference_value()),
+            self.match_location(rows, c[Constraint.LOCATION].get_preference_value()),
+            self.match_home_type(rows, c[Constraint.HOME_TYPE].get_preference_value()),
+            self.match_style(rows, c[Constraint.STYLE].get_preference_value()),
+        ))
+
+    def score(self, recommender, user_preferences, rows):
+        """
+        Same result as recommender.score_listing for every row, computed in one pass
+        """
+        return weighted_sum(recommender.coefficients(user_preferences), self.similarities(user_preferences, rows))
+
+
+def weighted_sum(coefs, sims):
+    """
+    coefs . sims column by column, summed in the same order as score_listing so results match exactly
+    """
+    out = coefs[0] * sims[0]
+    for j in range(1, len(coefs)):
+        out = out + coefs[j] * sims[j]
+    return out
+
+
+def top_positions(scores, k):
+    """
+    Positions of the k best scores, highest first, ties kept in input order
+    (matches a stable sort with reverse=True)
+    """
+    n = len(scores)
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.intp)
+    k = min(k, n)
+    if k < n:
+        kth = np.partition(scores, n - k)[n - k]
+        cand = np.flatnonzero(scores >= kth)
+    else:
+        cand = np.arange(n)
+    order = np.argsort(-scores[cand], kind="stable")
+    return cand[order[:k]]
@@ -5,7 +5,12 @@ Data class of user preferences for searching for homes via a Tinder like real es
 
 
 from enum import Enum
-from unittest import case
+from itertools import count
+import logging
+
+log = logging.getLogger("housefindr")
+
+_versions = count(1) #shared by every UserPreferences, so two of them (e.g. a relaxed copy) never hold the same version
 
 class PurchaseType(Enum):
     BUY = "buy"
@@ -18,11 +23,15 @@ class Constraint(Enum):
     BUDGET = "max_price"
     STYLE = "style"
     BUY_OR_RENT = "tenure"
+    BEDROOMS = "min_beds"
+    BATHROOMS = "min_baths"
 
 class UserPreferences:
     """
     Data class to store and manage user preferences
     User preferences are stored in a dict, with the values as Preferences
+    version changes on every change and is never shared with other preferences, so anything derived from
+    the preferences can be cached against it
     """
     def __init__(self):
         self.constraints = {
@@ -31,8 +40,11 @@ class UserPreferences:
             Constraint.SQUARE_FEET: Preference(0.0, 0.01),
             Constraint.BUDGET: Preference(0, 0),
             Constraint.STYLE: Preference(set(), 0), #rigidity always 0
-            Constraint.BUY_OR_RENT: Preference(PurchaseType.BUY, 0) #rigidity always 0, cant be removed
+            Constraint.BUY_OR_RENT: Preference(PurchaseType.BUY, 0), #rigidity always 0, cant be removed
+            Constraint.BEDROOMS: Preference(0, 0), #minimum, 0 means any
+            Constraint.BATHROOMS: Preference(0, 0), #minimum, 0 means any
         }
+        self.version = next(_versions)
 
 
     #===SETTERS===#
@@ -64,8 +76,12 @@ class UserPreferences:
             case Constraint.BUY_OR_RENT:
                 if not isinstance(value, PurchaseType):
                     raise ValueError("Buy or rent must be a PurchaseType enum.")
+            case Constraint.BEDROOMS | Constraint.BATHROOMS:
+                if not isinstance(value, (int, float)) or value < 0:
+                    raise ValueError("Bedrooms and bathrooms must be a positive number.")
 
         self.constraints[constraint].update_user_preference(value)
+        self.version = next(_versions)
 
 
 
@@ -88,6 +104,7 @@ class UserPreferences:
         if rigidity < 0 or rigidity > 1:
             raise ValueError("Rigidity must be between 0 and 1.")
         self.constraints[constraint].update_preference_rigidity(rigidity)
+        self.version = next(_versions)
 
 
 
@@ -123,6 +140,40 @@ class UserPreferences:
 
 
 
+    #===SAVE/RESTORE===#
+
+    def export_preferences(self):
+        """
+        JSON-friendly copy of every constraint (sets become sorted lists, enums their value)
+        """
+        out = {}
+        for key, pref in self.constraints.items():
+            value = pref.value
+            if isinstance(value, set):
+                value = {"set": sorted(value)}
+            elif isinstance(value, PurchaseType):
+                value = {"tenure": value.value}
+            out[key.name] = {"value": value, "rigidity": pref.rigidity}
+        return out
+
+    def load_preferences(self, data):
+        """
+        Restore constraints saved by export_preferences, unknown names are ignored
+        """
+        for name, saved in data.items():
+            if name not in Constraint.__members__:
+                continue
+            value = saved["value"]
+            if isinstance(value, dict) and "set" in value:
+                value = set(value["set"])
+            elif isinstance(value, dict) and "tenure" in value:
+                value = PurchaseType(value["tenure"])
+            self.constraints[Constraint[name]] = Preference(value, saved["rigidity"])
+        self.version = next(_versions)
+
+
+
+
     #===RE-ADD/REMOVE A CONSTRAINT===#
 
 
@@ -131,20 +182,21 @@ class UserPreferences:
         Remove a user constraint
         CONDITIONS: Cannot remove 'buy_or_rent'
         """
-        print(constraint)
+        log.debug("Removing %s", constraint)
         if constraint not in self.constraints:
             raise ValueError(f"Constraint '{constraint.value}' does not exist.")
         
         if constraint == Constraint.BUY_OR_RENT:
             raise ValueError("Cannot remove 'buy_or_rent' constraints.")
         self.constraints[constraint] = Preference(None, -1) #none object w/ -1 rigidity, it is no longer a constraint
+        self.version = next(_versions)
 
     def reAdd_constraint(self, constraint: Constraint, value: any, rigidity: float):
         """
         Re-add a user constraint
         CONDITIONS: Rigidity must be -1
         """
-        print(constraint)
+        log.debug("Re-adding %s", constraint)
         if constraint not in self.constraints:
             raise ValueError(f"Constraint '{constraint.value}' does not exist.")
 
@@ -152,7 +204,7 @@ class UserPreferences:
             raise ValueError(f"Constraint '{constraint.value}' must have rigidity -1 to be re-added.")
 
         self.update_constraint_value(constraint, value)
-        self.update_constraint_rigidity(constraint, rigidity)
+        self.update_constraint_rigidity(constraint, rigidity) #both bump self.version
 
     #===PRINTS===#
 
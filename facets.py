@@ -0,0 +1,270 @@
+"""
+Facet counts for the onboarding screen, answered from a precomputed aggregate instead of the listings
+The catalog is collapsed once into cells: (city, listing type, style mask, price bin, sqft bin, beds, baths) -> count.
+A query only walks the cells, a few thousand to a few hundred thousand however big the catalog is,
+and every facet is conditioned on all the current filters except its own (the usual faceted-search rule).
+beds and baths are counted per value, so a client can show how many homes each minimum leaves.
+Price and sqft bounds are applied at histogram-bin resolution, so counts right at a slider edge are approximate;
+city, style, beds and baths are exact.
+"""
+
+from bisect import bisect_right
+from collections import Counter
+import math
+
+import columnar
+import vocab
+
+np = columnar.np
+
+#log-spaced edges, covering monthly rents and sale prices alike (about 19% wide bins)
+PRICE_EDGES = tuple(round(10 ** (2 + i / 13)) for i in range(6 * 13 + 1)) #100 .. 100M
+SQFT_EDGES = tuple(round(10 ** (2 + i / 16)) for i in range(3 * 16 + 1))  #100 .. 100k
+
+MISSING = -1 #beds / baths without a value, and the bin of a missing price / sqft
+
+
+def _bin(edges, value):
+    #values outside the edges land in the first / last bin
+    if value is None or value != value:
+        return MISSING
+    return min(max(bisect_right(edges, value) - 1, 0), len(edges) - 2)
+
+
+def _small(value):
+    #beds / baths are kept exactly, 1.5 baths is a value of its own
+    if value is None or value != value:
+        return MISSING
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def _cell(row):
+    city, kind, style, price, sqft, beds, baths = row
+    return city, kind, style, _bin(PRICE_EDGES, price), _bin(SQFT_EDGES, sqft), _small(beds), _small(baths)
+
+
+def _centers(edges):
+    return [math.sqrt(lo * hi) for lo, hi in zip(edges, edges[1:])]
+
+
+class FacetCube:
+    """
+    Built from rows of (city code, listing type code, style bitmask, price, sqft, beds, baths), the codes
+    indexing city_values / type_values and the mask bits style_values; missing numbers are None or NaN
+    """
+    def __init__(self, rows, city_values, type_values, style_values):
+        cells = Counter(map(_cell, rows))
+        #read after the rows, a source may still be adding values while they stream in
+        self._fill(cells, city_values, type_values, style_values)
+
+    def _fill(self, cells, city_values, type_values, style_values):
+        self.city_values = list(city_values)
+        self.type_values = list(type_values)
+        self.style_values = list(style_values)
+        self.city_codes = {v: j for j, v in enumerate(self.city_values)}
+        self.type_codes = {v: j for j, v in enumerate(self.type_values)}
+        self.style_bits = {v: j for j, v in enumerate(self.style_values)}
+        self.price_centers = _centers(PRICE_EDGES)
+        self.sqft_centers = _centers(SQFT_EDGES)
+        self.rows = sum(cells.values())
+        self.cells = list(cells.items())
+        self.arrays = None
+        if columnar.available() and columnar.styles_fit(len(self.style_values)): #style masks as uint64
+            names = ("city", "type", "style", "price", "sqft", "beds", "baths")
+            dtypes = {"style": np.uint64, "beds": np.float64, "baths": np.float64}
+            self.arrays = {name: np.array([k[j] for k, _ in self.cells], dtype=dtypes.get(name, np.int64))
+                           for j, name in enumerate(names)}
+            self.arrays["count"] = np.array([n for _, n in self.cells], dtype=np.int64)
+            self.distinct = {f: np.unique(self.arrays[f]).tolist() for f in ("city", "price", "sqft", "beds", "baths")}
+
+    def __len__(self):
+        return len(self.cells)
+
+    def patched(self, removed, added):
+        """
+        Copy of the cube without the removed listings and with the added ones, for a catalog_delta refresh
+        Values the cube has not seen get the next free code / style bit
+        """
+        cells = Counter(dict(self.cells))
+        cities = vocab.Vocabulary(self.city_values)
+        types = vocab.Vocabulary(self.type_values)
+        styles = vocab.Vocabulary(self.style_values)
+
+        def cell(h):
+            return _cell((cities.intern(h.city), types.intern(h.listing_type), styles.intern_mask(h.style),
+                          h.price, h.sqft, h.beds, h.baths))
+
+        cells.subtract(map(cell, removed))
+        cells.update(map(cell, added))
+        cube = FacetCube.__new__(FacetCube)
+        cube._fill(+cells, cities.values, types.values, styles.values)
+        return cube
+
+    #===PASS TABLES===#
+    #every filter becomes a predicate over one cell field, styles a bitmask
+
+    def _passes(self, plan):
+        """
+        (style mask or None, {field: predicate over that field's cell values}) for the filters in the plan
+        """
+        preds = {}
+        if plan.city is not None:
+            code = self.city_codes.get(plan.city)
+            preds["city"] = lambda c: c == code
+        style_mask = None
+        if plan.styles is not None:
+            style_mask = 0
+            for s in plan.styles:
+                bit = self.style_bits.get(s)
+                if bit is not None:
+                    style_mask |= 1 << bit
+        for bound in plan.bounds:
+            if bound.field in ("price", "sqft"):
+                centers = self.price_centers if bound.field == "price" else self.sqft_centers
+                ok = [bound.passes(c) for c in centers]
+                preds[bound.field] = lambda b, ok=ok: b != MISSING and ok[b]
+            else:
+                preds[bound.field] = lambda v, bound=bound: v != MISSING and bound.passes(v)
+        return style_mask, preds
+
+    def query(self, plan):
+        """
+        {"total", "city", "listing_type", "style", "price", "sqft", "beds", "baths"} for a filter_plan.FilterPlan
+        """
+        style_mask, preds = self._passes(plan)
+        if self.arrays is not None:
+            return self._query_arrays(style_mask, preds)
+        return self._query_cells(style_mask, preds)
+
+    #===NUMPY===#
+
+    def _query_arrays(self, style_mask, preds):
+        a = self.arrays
+        masks = {}
+        for field, ok in preds.items():
+            #predicates run once per distinct value, the cells are matched with isin
+            masks[field] = np.isin(a[field], [v for v in self.distinct[field] if ok(v)])
+        if style_mask is not None:
+            masks["style"] = (a["style"] & np.uint64(style_mask)) != 0
+
+        def without(field=None):
+            m = np.ones(len(self.cells), dtype=bool)
+            for f, fm in masks.items():
+                if f != field:
+                    m &= fm
+            return m
+
+        count = a["count"]
+        everything = without()
+        out = {"total": int(count[everything].sum())}
+        m = without("city")
+        out["city"] = self._named(np.bincount(a["city"][m] + 1, weights=count[m],
+                                              minlength=len(self.city_values) + 1)[1:], self.city_values)
+        out["listing_type"] = self._named(np.bincount(a["type"][everything] + 1, weights=count[everything],
+                                                      minlength=len(self.type_values) + 1)[1:], self.type_values)
+        m = without("style")
+        styles, weights = a["style"][m], count[m]
+        out["style"] = self._named([int(weights[(styles >> np.uint64(bit)) & np.uint64(1) == 1].sum())
+                                    for bit in range(len(self.style_values))], self.style_values)
+        for field, edges in (("price", PRICE_EDGES), ("sqft", SQFT_EDGES)):
+            m = without(field) & (a[field] != MISSING)
+            out[field] = self._histogram(np.bincount(a[field][m], weights=count[m], minlength=len(edges) - 1), edges)
+        for field in ("beds", "baths"):
+            m = without(field)
+            out[field] = self._values({v: count[m & (a[field] == v)].sum() for v in self.distinct[field] if v != MISSING})
+        return out
+
+    #===PLAIN PYTHON===#
+
+    def _query_cells(self, style_mask, preds):
+        fields = ("city", "type", "style", "price", "sqft", "beds", "baths")
+        city = [0] * len(self.city_values)
+        types = [0] * len(self.type_values)
+        style = [0] * len(self.style_values)
+        price = [0] * (len(PRICE_EDGES) - 1)
+        sqft = [0] * (len(SQFT_EDGES) - 1)
+        beds, baths = Counter(), Counter()
+        total = 0
+        for key, n in self.cells:
+            failed = [f for f, v in zip(fields, key) if f in preds and not preds[f](v)]
+            if style_mask is not None and not key[2] & style_mask:
+                failed.append("style")
+            if len(failed) > 1:
+                continue
+            c, t, s, p, q, b, h = key
+            if not failed:
+                total += n
+                if t >= 0:
+                    types[t] += n
+            only = failed[0] if failed else None
+            if only in (None, "city") and c >= 0:
+                city[c] += n
+            if only in (None, "style"):
+                for bit in range(len(style)):
+                    if s >> bit & 1:
+                        style[bit] += n
+            if only in (None, "price") and p != MISSING:
+                price[p] += n
+            if only in (None, "sqft") and q != MISSING:
+                sqft[q] += n
+            if only in (None, "beds") and b != MISSING:
+                beds[b] += n
+            if only in (None, "baths") and h != MISSING:
+                baths[h] += n
+        return {
+            "total": total,
+            "city": self._named(city, self.city_values),
+            "listing_type": self._named(types, self.type_values),
+            "style": self._named(style, self.style_values),
+            "price": self._histogram(price, PRICE_EDGES),
+            "sqft": self._histogram(sqft, SQFT_EDGES),
+            "beds": self._values(beds),
+            "baths": self._values(baths),
+        }
+
+    @staticmethod
+    def _named(counts, values):
+        return {v: int(n) for v, n in zip(values, counts) if n and v is not None}
+
+    @staticmethod
+    def _values(counts):
+        return [{"value": _small(v), "count": int(n)} for v, n in sorted(counts.items()) if n]
+
+    @staticmethod
+    def _histogram(counts, edges):
+        #only the span between the first and last non-empty bin
+        counts = [int(n) for n in counts]
+        used = [i for i, n in enumerate(counts) if n]
+        if not used:
+            return []
+        return [{"lo": edges[i], "hi": edges[i + 1], "count": counts[i]} for i in range(used[0], used[-1] + 1)]
+
+
+#===SOURCES===#
+#one per way UTAlgorithm holds its catalog, none of them builds Listing objects it doesn't already have
+
+def from_listings(listings):
+    rows = ((l.city_code, l.type_code, l.style_mask, l.price, l.sqft, l.beds, l.baths) for l in listings)
+    return FacetCube(rows, vocab.CITIES.values, vocab.LISTING_TYPES.values, vocab.STYLES.values)
+
+
+def from_mapped(mapped):
+    #catalog_file.MappedCatalog columns, nulls bit i marks a missing catalog_file.NUMERIC[i]
+    c = mapped.cols
+    numbers = [(None if n >> bit & 1 else v for v, n in zip(c[f], c["nulls"]))
+               for bit, f in enumerate(("price", "sqft", "beds", "baths"))]
+    rows = zip(c["city"], c["listing_type"], c["style"], *numbers)
+    return FacetCube(rows, mapped.dicts["city"], mapped.dicts["listing_type"], mapped.dicts["style"])
+
+
+def from_sql(store):
+    #sql_catalog.SqlCatalog, one streamed pass over the columns the cube needs
+    cities, types, styles = vocab.Vocabulary(), vocab.Vocabulary(), vocab.Vocabulary()
+
+    def rows():
+        cursor = store.connection().execute(
+            "SELECT city, property_type, style, price, square_feet, bedrooms, bathrooms FROM listings")
+        for city, kind, style, *numbers in cursor:
+            yield (cities.intern(city), types.intern(kind), styles.intern_mask(style), *numbers)
+
+    return FacetCube(rows(), cities.values, types.values, styles.values)
@@ -0,0 +1,125 @@
+"""
+Compiled form of the rules in HousingRecommender.filter_listings
+UserPreferences is read once per preference version instead of once per listing per call,
+the resulting FilterPlan is a predicate for linear scans and a recipe for ListingIndex lookups
+"""
+
+from operator import attrgetter
+
+from constraints import Constraint
+import vocab
+
+#numeric constraints: (constraint, listing field, "min" = at least the value, "max" = at most the value)
+NUMERIC_BOUNDS = (
+    (Constraint.SQUARE_FEET, "sqft",  "min"),
+    (Constraint.BUDGET,      "price", "max"),
+    (Constraint.BEDROOMS,    "beds",  "min"),
+    (Constraint.BATHROOMS,   "baths", "min"),
+)
+
+
+def preference_signature(user_preferences):
+    """
+    Hashable snapshot of every constraint value and rigidity
+    Two preference objects with the same signature filter and score identically
+    """
+    sig = []
+    for c, pref in user_preferences.constraints.items():
+        value = pref.get_preference_value()
+        if isinstance(value, (set, list)):
+            value = frozenset(value)
+        sig.append((c, value, pref.rigidity))
+    return tuple(sig)
+
+
+class NumericBound:
+    """
+    Pass/fail rule for one numeric constraint
+    A listing passes when it meets the value, or when the constraint is flexible and it is
+    within value - value * rigidity of it (same tolerance band as the original filter)
+    """
+    def __init__(self, field, kind, value, flexible, roomForError):
+        self.field = field
+        self.kind = kind
+        self.value = value
+        self.flexible = flexible
+        self.roomForError = roomForError
+        self.get = attrgetter(field)
+
+        if kind == "min":
+            def passes(x):
+                return x >= value or (flexible and abs(x - value) <= roomForError)
+        else:
+            def passes(x):
+                return x <= value or (flexible and abs(x - value) <= roomForError)
+        self.passes = passes
+
+    def __call__(self, listing):
+        #a listing without the value never passes, same as the indexes that leave it out
+        x = self.get(listing)
+        return x is not None and self.passes(x)
+
+
+class FilterPlan:
+    def __init__(self, user_preferences):
+        self.version = user_preferences.version
+        self.signature = preference_signature(user_preferences)
+        c = user_preferences.constraints
+
+        #does the city location match?
+        loc_val = c[Constraint.LOCATION].get_preference_value()
+        self.city = loc_val if isinstance(loc_val, str) and loc_val != "" else None
+
+        #minimums/maximums, optionally within reasonable flexibility
+        self.bounds = []
+        for constraint, field, kind in NUMERIC_BOUNDS:
+            value = c[constraint].get_preference_value()
+            if not (isinstance(value, (int, float)) and value > 0):
+                continue
+            flexible = user_preferences.is_flexible(constraint)
+            roomForError = 0
+            if flexible:
+                r = c[constraint].rigidity
+                roomForError = value - (value * r)
+            self.bounds.append(NumericBound(field, kind, value, flexible, roomForError))
+
+        #at least one of the styles we like
+        pref_styles = c[Constraint.STYLE].get_preference_value()
+        self.styles = pref_styles if isinstance(pref_styles, set) and len(pref_styles) > 0 else None
+
+        self.checks = self._compile()
+
+    def _compile(self):
+        checks = []
+        #categorical fields compare vocab codes; a value the vocab has not seen yet can only
+        #show up on listings loaded later, so those fall back to looking it up per listing
+        if self.city is not None:
+            city = self.city
+            code = vocab.CITIES.code(city)
+            if code is not None:
+                checks.append(lambda l: l.city_code == code)
+            else:
+                checks.append(lambda l: l.city == city)
+        checks.extend(self.bounds)
+        if self.styles is not None:
+            styles = self.styles
+            if all(s in vocab.STYLES.codes for s in styles):
+                mask = vocab.STYLES.mask(styles)
+                checks.append(lambda l: l.style_mask & mask)
+            else:
+                checks.append(lambda l: l.style_mask & vocab.STYLES.mask(styles))
+        return tuple(checks)
+
+    def __call__(self, listing):
+        for check in self.checks:
+            if not check(listing):
+                return False
+        return True
+
+    def is_trivial(self):
+        return not self.checks
+
+    def filter(self, listings):
+        if not self.checks:
+            return list(listings)
+        return [l for l in listings if self(l)]
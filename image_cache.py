@@ -0,0 +1,201 @@
+"""
+On-disk image cache and thumbnail service for listing photos
+Originals are fetched once, thumbnails are generated at a few standard widths with Pillow,
+and the whole directory is kept under max_bytes by evicting the least recently used files
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import hashlib
+import os
+import threading
+
+THUMB_WIDTHS = (160, 320, 640, 1280)
+FETCH_TIMEOUT = 10 #seconds
+
+
+class HttpFetcher:
+    """
+    Default fetcher: one pooled requests.Session with a timeout
+    Anything callable as fetcher(url) -> bytes can replace it (tests use a local stub server)
+    """
+    def __init__(self, timeout=FETCH_TIMEOUT):
+        import requests
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def __call__(self, url):
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+
+def snap_width(width):
+    """
+    Smallest standard width that is at least the requested one, None means the original
+    """
+    if not width:
+        return None
+    for w in THUMB_WIDTHS:
+        if w >= width:
+            return w
+    return THUMB_WIDTHS[-1]
+
+
+def sniff_type(data):
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "application/octet-stream"
+
+
+def make_thumbnail(data, width):
+    from PIL import Image #only needed once a thumbnail is actually generated
+
+    image = Image.open(BytesIO(data))
+    if image.width > width:
+        image.thumbnail((width, image.height)) #keeps the aspect ratio
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    out = BytesIO()
+    image.save(out, format="JPEG", quality=85, optimize=True)
+    return out.getvalue()
+
+
+class ImageCache:
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, fetcher=None, workers=4):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fetcher = fetcher
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._key_locks = {}         #one in-flight fetch/resize per file
+        self._files = OrderedDict()  #file name -> size, least recently used first
+        self._total = 0
+        self._executor = None
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self):
+        #pick up what a previous process left behind, oldest access first
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            st = os.stat(path)
+            entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self._total += size
+        self._evict()
+
+    #===LOOKUP===#
+
+    @staticmethod
+    def file_name(url, width):
+        digest = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return f"{digest}_{width}.jpg" if width else f"{digest}_orig"
+
+    def get(self, url, width=None):
+        """
+        (bytes, content type) for an image url, resized to the snapped standard width if one is given
+        """
+        width = snap_width(width)
+        name = self.file_name(url, width)
+        data = self._read(name)
+        if data is None:
+            lock = self._key_lock(name)
+            try:
+                with lock:
+                    data = self._read(name)
+                    if data is None:
+                        if width is None:
+                            data = self._fetch(url)
+                        else:
+                            data = make_thumbnail(self.get(url)[0], width)
+                        self._write(name, data)
+            finally:
+                #dropped whether or not the fetch worked, failing urls must not pile up locks
+                with self._lock:
+                    if self._key_locks.get(name) is lock:
+                        del self._key_locks[name]
+        return data, ("image/jpeg" if width else sniff_type(data))
+
+    def _fetch(self, url):
+        if self.fetcher is None:
+            self.fetcher = HttpFetcher()
+        return self.fetcher(url)
+
+    def _key_lock(self, name):
+        with self._lock:
+            lock = self._key_locks.get(name)
+            if lock is None:
+                lock = self._key_locks[name] = threading.Lock()
+            return lock
+
+    #===STORAGE===#
+
+    def _read(self, name):
+        with self._lock:
+            if name not in self._files:
+                return None
+            self._files.move_to_end(name)
+        try:
+            with open(os.path.join(self.cache_dir, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._files.pop(name, 0)
+            return None
+
+    def _write(self, name, data):
+        path = os.path.join(self.cache_dir, name)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path) #readers never see a half written file
+        with self._lock:
+            self._total += len(data) - self._files.pop(name, 0)
+            self._files[name] = len(data)
+            self._evict()
+
+    def _evict(self):
+        #caller holds self._lock (or is the constructor)
+        while self._total > self.max_bytes and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def size_bytes(self):
+        return self._total
+
+    #===PREFETCH===#
+
+    def prefetch(self, urls, width=None):
+        """
+        Warm the cache for these urls in the background, errors are ignored (the request path retries)
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-prefetch")
+        for url in urls:
+            if url and self.file_name(url, snap_width(width)) not in self._files:
+                self._executor.submit(self._prefetch_one, url, width)
+
+    def _prefetch_one(self, url, width):
+        try:
+            self.get(url, width)
+        except Exception:
+            pass
@@ -0,0 +1,310 @@
+"""
+Streaming bulk loader for the listings and images tables
+CSV or JSONL rows are read lazily and written in batches: one executemany and one transaction per batch,
+in WAL mode so a running server keeps reading while the load goes on. Listings are upserted by sheet_id
+(the spreadsheet 'ID'), so re-running an export updates rows instead of duplicating them; an updated row
+gets a new created_at, which is what hot reload (catalog_refresh.py) looks for. Every batch is stamped strictly
+later than the one before (and than any row already in the DB), so a reload that runs between two batches
+still finds the second batch's updates. The secondary indexes the recommender queries are kept up to date
+while rows go in, so a live server's watermark polls and pushdown queries stay indexed; with --offline (no
+server reading the DB) they are dropped for the load and rebuilt once at the end, which loads faster.
+
+    python ingest.py listings.csv
+    python ingest.py listings.jsonl --images images.csv --db houselisting.db --batch 20000
+    python ingest.py listings.csv --offline
+
+Listing columns are matched by name, case-insensitively, either the listings table names or the sheet headers
+(ID, TYPE, STYLE, BEDS, BATHS, SQFT, LINK, ...); an IMAGE / IMAGE_URL column adds that photo to the listing.
+The images file needs sheet_id (or ID), url and optionally caption.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+import catalog_refresh
+import listing_details
+import sql_catalog
+import synthetic
+
+log = logging.getLogger("housefindr")
+
+#listings columns written by the loader, id is assigned by SQLite and kept on update
+LISTING_COLUMNS = ("sheet_id", "title", "status", "price", "currency", "bedrooms", "bathrooms", "square_feet",
+                   "address", "city", "state", "zip", "source_link", "property_type", "style", "created_at")
+INTEGER_COLUMNS = ("price", "bedrooms", "bathrooms", "square_feet")
+STAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ" #fixed width, so created_at strings sort like the times
+
+#normalized header -> column, on top of the column names themselves
+ALIASES = {
+    "id": "sheet_id",
+    "type": "property_type",
+    "listing_type": "property_type",
+    "tenure": "status",
+    "beds": "bedrooms",
+    "baths": "bathrooms",
+    "sqft": "square_feet",
+    "link": "source_link",
+    "zillow_link": "source_link",
+    "zipcode": "zip",
+    "image": "image_url",
+    "photo": "image_url",
+    "url": "image_url", #images file
+    "listing_id": "sheet_id", #images file, listings are referenced by their sheet id
+}
+
+UNIQUE_INDEXES = (
+    #the upsert target, it has to exist while loading
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_listings_sheet_id ON listings(sheet_id)",
+    #the same photo is never attached twice, doubles as the listing -> images lookup
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_images_listing_url ON images(listing_id, url)",
+)
+#created if missing; dropped for an --offline load and rebuilt after it
+RECOMMENDER_INDEXES = sql_catalog.INDEXES + (catalog_refresh.WATERMARK_INDEX, listing_details.IMAGES_INDEX)
+
+_updates = ", ".join(f"{c} = excluded.{c}" for c in LISTING_COLUMNS[1:])
+_changed = (f"({', '.join(LISTING_COLUMNS[1:-1])}) IS NOT "
+            f"({', '.join('excluded.' + c for c in LISTING_COLUMNS[1:-1])})")
+#an identical row is left alone, so re-loading the same export doesn't make every listing look new
+UPSERT_LISTING = (f"INSERT INTO listings ({', '.join(LISTING_COLUMNS)}) VALUES ({', '.join('?' * len(LISTING_COLUMNS))}) "
+                  f"ON CONFLICT(sheet_id) DO UPDATE SET {_updates} WHERE {_changed}")
+INSERT_IMAGE = ("INSERT OR IGNORE INTO images (listing_id, url, caption) "
+                "SELECT id, ?, ? FROM listings WHERE sheet_id = ?")
+
+
+class IngestError(Exception):
+    pass
+
+
+#===READING===#
+
+def _normalize(key):
+    key = str(key).strip().lower().replace(" ", "_").replace("-", "_")
+    return ALIASES.get(key, key)
+
+
+def read_rows(path):
+    """
+    Lazily yields one dict per record with normalized keys, from a .csv or a .jsonl / .ndjson file
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if ext in (".jsonl", ".ndjson", ".json"):
+            for n, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    raise IngestError(f"{path}:{n}: {e}") from None
+                yield {_normalize(k): v for k, v in record.items()}
+        else:
+            reader = csv.reader(f)
+            header = [_normalize(k) for k in next(reader, [])]
+            for values in reader:
+                yield dict(zip(header, values))
+
+
+def _text(value):
+    if value.__class__ is not str:
+        if value is None:
+            return None
+        value = str(value)
+    value = value.strip()
+    return value or None
+
+
+def _integer(value):
+    #"$1,250,000", "1816.0" and 3 all load; anything else is NULL
+    if value is None or value.__class__ is int:
+        return value
+    text = str(value).strip()
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    text = text.replace(",", "").replace("$", "")
+    if not text:
+        return None
+    try:
+        return int(float(text))
+    except ValueError:
+        return None
+
+
+#(column, converter) for every column read from a record, created_at is stamped by the loader
+_FIELDS = tuple((c, _integer if c in INTEGER_COLUMNS else _text) for c in LISTING_COLUMNS[:-1])
+_STATUS = LISTING_COLUMNS.index("status")
+_CURRENCY = LISTING_COLUMNS.index("currency")
+
+
+def listing_row(record, created_at):
+    """
+    Parameter tuple for UPSERT_LISTING, or None if the record can't be stored (no sheet id, unknown status)
+    """
+    get = record.get
+    row = [convert(get(c)) for c, convert in _FIELDS]
+    status = (row[_STATUS] or "").lower()
+    if row[0] is None or status not in ("buy", "rent"):
+        return None
+    row[_STATUS] = status
+    row[_CURRENCY] = row[_CURRENCY] or "USD"
+    row.append(created_at)
+    return tuple(row)
+
+
+def stamp(after=""):
+    """
+    created_at for the next batch: now in UTC, moved past after (the previous batch's, or the newest in the DB)
+    when the clock has not got beyond it; compared as strings, like the refresher's created_at > ?
+    """
+    now = datetime.now(timezone.utc)
+    previous = _parse_stamp(after)
+    if previous is not None and now <= previous:
+        now = previous + timedelta(microseconds=1)
+    out = now.strftime(STAMP_FORMAT)
+    if out <= after: #the same second written without fractions, ...:00Z sorts after ...:00.000001Z
+        out = (now + timedelta(seconds=1)).strftime(STAMP_FORMAT)
+    return out
+
+
+def _parse_stamp(value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+#===WRITING===#
+
+def _index_name(sql):
+    return sql.split(" EXISTS ", 1)[1].split()[0]
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL") #WAL + NORMAL: a crash can lose the last batch, never corrupt the DB
+    conn.execute("PRAGMA cache_size=-65536") #64MB, index pages of a million rows stay cached
+    conn.execute(synthetic.LISTINGS_SCHEMA)
+    conn.execute(synthetic.IMAGES_SCHEMA)
+    try:
+        for sql in UNIQUE_INDEXES:
+            conn.execute(sql)
+    except sqlite3.IntegrityError as e:
+        conn.close()
+        raise IngestError(f"{db_path} already has duplicate sheet ids or images, can't upsert: {e}") from None
+    conn.commit()
+    return conn
+
+
+def ingest_listings(conn, path, batch_size, stats, after=""):
+    for batch in batches(read_rows(path), batch_size):
+        created_at = after = stamp(after)
+        rows, images = [], []
+        for record in batch:
+            row = listing_row(record, created_at)
+            if row is None:
+                stats["rejected"] += 1
+                continue
+            rows.append(row)
+            url = _text(record.get("image_url"))
+            if url:
+                images.append((url, _text(record.get("caption")), row[0]))
+        with conn: #one transaction per batch
+            before = conn.total_changes
+            conn.executemany(UPSERT_LISTING, rows)
+            stats["listings"] += conn.total_changes - before
+            before = conn.total_changes
+            conn.executemany(INSERT_IMAGE, images)
+            stats["images"] += conn.total_changes - before
+        stats["read"] += len(batch)
+        log.debug("%d listing records read", stats["read"])
+
+
+def ingest_images(conn, path, batch_size, stats):
+    for batch in batches(read_rows(path), batch_size):
+        images = []
+        for record in batch:
+            url, sheet_id = _text(record.get("image_url")), _text(record.get("sheet_id"))
+            if url is None or sheet_id is None:
+                stats["rejected"] += 1
+                continue
+            images.append((url, _text(record.get("caption")), sheet_id))
+        with conn:
+            before = conn.total_changes
+            conn.executemany(INSERT_IMAGE, images)
+            stats["images"] += conn.total_changes - before
+
+
+def ingest(db_path, listings_path=None, images_path=None, batch_size=10000, offline=False):
+    """
+    Loads the files into db_path, returns counts of records read and rejected and of rows written
+    offline: no server reads the DB during the load, its indexes can be dropped until the end
+    """
+    stats = {"read": 0, "rejected": 0, "listings": 0, "images": 0}
+    conn = connect(db_path)
+    try:
+        (newest,) = conn.execute("SELECT MAX(created_at) FROM listings").fetchone()
+        for sql in RECOMMENDER_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {_index_name(sql)}" if offline else sql)
+        conn.commit()
+        if listings_path:
+            ingest_listings(conn, listings_path, batch_size, stats, newest or "")
+        if images_path:
+            ingest_images(conn, images_path, batch_size, stats)
+    finally:
+        #rebuilt even after a failed batch, the committed ones are served
+        for sql in RECOMMENDER_INDEXES:
+            conn.execute(sql)
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.close()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load listings and images into houselisting.db")
+    parser.add_argument("listings", nargs="?", help="listings .csv or .jsonl")
+    parser.add_argument("--images", help="images .csv or .jsonl (sheet_id, url, caption)")
+    parser.add_argument("--db", default="houselisting.db")
+    parser.add_argument("--batch", type=int, default=10000, help="rows per transaction")
+    parser.add_argument("--offline", action="store_true",
+                        help="drop the recommender indexes during the load, only when no server reads the DB")
+    args = parser.parse_args(argv)
+    if not args.listings and not args.images:
+        parser.error("nothing to load")
+
+    start = time.perf_counter()
+    try:
+        stats = ingest(args.db, args.listings, args.images, args.batch, args.offline)
+    except (IngestError, OSError) as e:
+        print(f"Ingest failed: {e}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    print(f"Read {stats['read']} listing records in {elapsed:.1f}s ({stats['read'] / max(elapsed, 1e-9):.0f}/s): "
+          f"{stats['listings']} listings inserted or updated, {stats['images']} images added, "
+          f"{stats['rejected']} records rejected")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+On-demand listing detail: the columns ranking never reads (title, address, link, ...) and the full photo gallery
+The in-memory catalog only keeps what ranking needs plus one photo per listing for the cards;
+everything else is read from houselisting.db when a listing is opened and kept in a bounded LRU
+"""
+
+from collections import OrderedDict
+import os
+import sqlite3
+import threading
+
+import metrics
+
+DETAIL_COLUMNS = ("title", "address", "city", "state", "zip", "currency", "source_link", "created_at")
+
+#galleries are looked up by listing, without it every lookup scans the images table
+#created by ingest.py and `python sql_catalog.py`, the server only ever opens the DB read-only
+IMAGES_INDEX = "CREATE INDEX IF NOT EXISTS idx_images_listing_id ON images(listing_id)"
+
+
+class ListingDetails:
+    """
+    listing id -> detail dict, LRU of the size most recently opened listings
+    Shared by every session, safe to use from several request threads
+    """
+    def __init__(self, db_path, size=4096):
+        self.db_path = db_path
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def connection(self):
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid(): #a connection must not cross a fork
+            local.conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            local.pid = os.getpid()
+        return local.conn
+
+    def get(self, listing_id):
+        """
+        {column: value, ..., "images": [{"url", "caption"}, ...]} or None for an unknown listing
+        """
+        key = str(listing_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            metrics.DETAIL_LOOKUPS.inc(result="hit")
+            return entry
+
+        metrics.DETAIL_LOOKUPS.inc(result="miss")
+        entry = self._fetch(key)
+        if entry is None:
+            return None
+        #two threads may fetch the same listing at once, the later one simply wins
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _fetch(self, key):
+        try:
+            listing_id = int(key)
+        except ValueError:
+            return None
+        conn = self.connection()
+        row = conn.execute(f"SELECT {', '.join(DETAIL_COLUMNS)} FROM listings WHERE id = ?", (listing_id,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(DETAIL_COLUMNS, row))
+        entry["images"] = [{"url": url, "caption": caption} for url, caption in
+                           conn.execute("SELECT url, caption FROM images WHERE listing_id = ? ORDER BY id", (listing_id,))]
+        return entry
+
+    def gallery(self, listing_id):
+        entry = self.get(listing_id)
+        return [] if entry is None else [image["url"] for image in entry["images"]]
+
+    def invalidate(self, listing_ids):
+        #hot reload drops the listings it re-read, the rest of the cache stays warm
+        with self._lock:
+            for listing_id in listing_ids:
+                self._entries.pop(str(listing_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,116 @@
+"""
+Secondary indexes over the listing catalog so filter_listings does not have to scan every listing
+    city, listing_type       -> hash index (value -> rows)
+    style                    -> inverted index (style -> rows)
+    price, sqft, beds, baths -> sorted arrays, tolerance bands become range lookups
+Rows are positions in self.listings, results come back in catalog order like the linear filter
+"""
+
+from bisect import bisect_left
+
+from columnar import style_set
+
+
+class ListingIndex:
+    def __init__(self, listings):
+        self.listings = listings
+        self.row_of = {l.id: i for i, l in enumerate(listings)}
+
+        self.by_city = {}
+        self.by_type = {}
+        self.by_style = {}
+        for i, l in enumerate(listings):
+            self.by_city.setdefault(l.city, set()).add(i)
+            self.by_type.setdefault(l.listing_type, set()).add(i)
+            for s in style_set(l.style):
+                self.by_style.setdefault(s, set()).add(i)
+
+        #field -> (rows sorted by value, sorted values, rank of each row in that order)
+        self.sorted_cols = {f: self._sorted_column(listings, f) for f in ("price", "sqft", "beds", "baths")}
+
+    def __len__(self):
+        return len(self.listings)
+
+    @staticmethod
+    def _sorted_column(listings, field):
+        #listings without a value never satisfy a numeric constraint, so they are left out
+        rows = sorted((i for i, l in enumerate(listings) if getattr(l, field) is not None),
+                      key=lambda i: getattr(listings[i], field))
+        values = [getattr(listings[i], field) for i in rows]
+        rank = [-1] * len(listings)
+        for pos, i in enumerate(rows):
+            rank[i] = pos
+        return rows, values, rank
+
+    def covers(self, listings):
+        return listings is self.listings
+
+    def rows_of(self, listing_ids):
+        """
+        Rows of the listings with these ids, ids not in the catalog are skipped
+        """
+        rows = (self.row_of.get(i) for i in listing_ids)
+        return [r for r in rows if r is not None]
+
+    #===RANGE LOOKUPS===#
+
+    def bound_range(self, bound):
+        """
+        [lo, hi) slice of the sorted column passing a filter_plan.NumericBound
+        The rules are monotone in the value, so the edge is found by bisecting with the same predicate
+        """
+        values = self.sorted_cols[bound.field][1]
+        if bound.kind == "min":
+            return bisect_left(values, True, key=bound.passes), len(values)
+        return 0, bisect_left(values, True, key=lambda x: not bound.passes(x))
+
+    #===CATEGORY LOOKUPS===#
+    #(size, rows, membership test) for the rows matching a city / any of a set of styles
+
+    def city_rows(self, city):
+        rows = self.by_city.get(city, set())
+        return len(rows), rows, rows.__contains__
+
+    def style_rows(self, styles):
+        rows = set()
+        for s in styles:
+            rows |= self.by_style.get(s, set())
+        return len(rows), rows, rows.__contains__
+
+    #===FILTER===#
+
+    def filter_rows(self, plan):
+        """
+        Rows passing a FilterPlan, in catalog order
+        Cost is driven by the smallest matching index rather than the catalog size
+        """
+        sets = []   #(size, rows) candidate row collections
+        checks = [] #membership tests applied to the smallest collection
+
+        if plan.city is not None:
+            size, rows, contains = self.city_rows(plan.city)
+            sets.append((size, rows))
+            checks.append(contains)
+
+        if plan.styles is not None:
+            size, rows, contains = self.style_rows(plan.styles)
+            sets.append((size, rows))
+            checks.append(contains)
+
+        for bound in plan.bounds:
+            sorted_rows, _, rank = self.sorted_cols[bound.field]
+            lo, hi = self.bound_range(bound)
+            sets.append((hi - lo, map(sorted_rows.__getitem__, range(lo, hi)))) #lazy, only walked if smallest
+            checks.append(lambda i, lo=lo, hi=hi, rank=rank: lo <= rank[i] < hi)
+
+        if not sets:
+            return list(range(len(self.listings)))
+
+        smallest = min(range(len(sets)), key=lambda j: sets[j][0])
+        others = [c for j, c in enumerate(checks) if j != smallest]
+        out = [i for i in sets[smallest][1] if all(c(i) for c in others)]
+        out.sort()
+        return out
+
+    def filter(self, plan):
+        return [self.listings[i] for i in self.filter_rows(plan)]
@@ -0,0 +1,150 @@
+"""
+Minimal Prometheus-style metrics for the recommendation pipeline, rendered by the /metrics route
+Only counters and histograms, which is all the pipeline needs; no extra dependency
+"""
+
+from bisect import bisect_left
+import threading
+import time
+
+#seconds, from 10us to 5s
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(x):
+    if x == float("inf"):
+        return "+Inf"
+    return repr(float(x)) if isinstance(x, float) else str(x)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0)]
+        for key, value in items:
+            lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_num(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {} #labels -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._series.items())
+        for key, (counts, total, count) in items:
+            running = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                running += c
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, (('le', _num(le)),))} {running}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {_num(total)}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        m = Counter(name, help, labelnames)
+        self.metrics.append(m)
+        return m
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        m = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(m)
+        return m
+
+    def render(self):
+        lines = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+#===PIPELINE METRICS===#
+STAGE_SECONDS = REGISTRY.histogram(
+    "housefindr_stage_seconds", "Time spent per recommendation stage (filter, similarity, score, select, serialize, neighbors).", ("stage",))
+CANDIDATES = REGISTRY.histogram(
+    "housefindr_candidates", "Candidate listings left after filtering, per ranking.", buckets=SIZE_BUCKETS)
+SPECULATIVE_STAGE_SECONDS = REGISTRY.histogram(
+    "housefindr_speculative_stage_seconds", "Time spent per stage by background speculation, off the request path.", ("stage",))
+SPECULATIVE_CANDIDATES = REGISTRY.histogram(
+    "housefindr_speculative_candidates", "Candidate listings left after filtering, per speculative ranking.", buckets=SIZE_BUCKETS)
+SPECULATIONS = REGISTRY.counter(
+    "housefindr_speculations_total", "Speculative refills by outcome (used, not_ready, stale, error).", ("result",))
+FEED_ATTEMPTS = REGISTRY.counter(
+    "housefindr_ensure_feed_attempts_total", "Recommender passes run by ensure_feed to top up a feed.")
+RAW_FALLBACKS = REGISTRY.counter(
+    "housefindr_raw_fallback_total", "Times ensure_feed fell back to unranked catalog listings.")
+RAW_FALLBACK_LISTINGS = REGISTRY.counter(
+    "housefindr_raw_fallback_listings_total", "Unranked catalog listings pushed into feeds by the fallback.")
+REQUEST_SECONDS = REGISTRY.histogram(
+    "housefindr_request_seconds", "HTTP request latency per route.", ("route", "method", "status"))
+RELOAD_SECONDS = REGISTRY.histogram(
+    "housefindr_catalog_reload_seconds", "Time spent per catalog hot-reload check, including the swap when the DB moved.")
+RELOADED_LISTINGS = REGISTRY.counter(
+    "housefindr_catalog_reloaded_listings_total", "New or changed listings swapped into the catalog by hot reload.")
+DETAIL_LOOKUPS = REGISTRY.counter(
+    "housefindr_listing_detail_lookups_total", "Listing detail lookups by cache result (hit, miss).", ("result",))
+RELAXED_CONSTRAINTS = REGISTRY.counter(
+    "housefindr_relaxed_constraints_total", "Constraints dropped by the relaxation ladder to fill a feed.", ("constraint",))
@@ -0,0 +1,124 @@
+"""
+Relaxation ladder for preferences that leave too few listings
+Constraints are dropped in the order drop_most_rigid_constraint drops them (highest rigidity first);
+the candidates left at every step of that ladder are counted up front, and the recommender jumps
+straight to the first step that can fill the deck instead of re-ranking blindly after each drop.
+The user's own preferences are never modified, the chosen step is ranked on a relaxed copy.
+"""
+
+from bisect import bisect_left
+
+from constraints import Constraint, Preference, UserPreferences
+from filter_plan import FilterPlan
+
+
+def filters_on(user_preferences, constraint):
+    """
+    Whether FilterPlan drops listings for this constraint; the others only affect scores, dropping them can't add candidates
+    """
+    value = user_preferences.constraints[constraint].get_preference_value()
+    if constraint == Constraint.LOCATION:
+        return isinstance(value, str) and value != ""
+    if constraint == Constraint.STYLE:
+        return isinstance(value, set) and len(value) > 0
+    if constraint in (Constraint.SQUARE_FEET, Constraint.BUDGET, Constraint.BEDROOMS, Constraint.BATHROOMS):
+        return isinstance(value, (int, float)) and value > 0
+    return False
+
+
+def ladder(user_preferences):
+    """
+    Filtering constraints in drop order: highest rigidity first, ties in declaration order like drop_most_rigid_constraint
+    """
+    active = [c for c, pref in user_preferences.constraints.items()
+              if c != Constraint.BUY_OR_RENT and pref.rigidity != -1 and filters_on(user_preferences, c)]
+    return sorted(active, key=lambda c: -user_preferences.constraints[c].rigidity)
+
+
+def relaxed_preferences(user_preferences, dropped):
+    """
+    Copy of the preferences with the dropped constraints removed, same as remove_constraint on each of them
+    """
+    out = UserPreferences()
+    for c, pref in user_preferences.constraints.items():
+        value = pref.value
+        if isinstance(value, set):
+            value = set(value)
+        out.constraints[c] = Preference(None, -1) if c in dropped else Preference(value, pref.rigidity)
+    return out #with a version of its own, nothing cached for the unrelaxed preferences applies to it
+
+
+class Relaxation:
+    """
+    The ladder for one set of preferences: step i drops the first i constraints of self.steps
+    counts holds, from step 1 up to the chosen step, how many listings that were not handed out or disliked pass it
+    version and generation tell a session whether the chosen step still applies (see UTAlgorithm.relax_feed)
+    """
+    def __init__(self, user_preferences, generation=0):
+        self.preferences = user_preferences
+        self.version = user_preferences.version
+        self.generation = generation
+        self.steps = ladder(user_preferences)
+        self.counts = []
+        self.level = None
+        self.dry = False #the chosen step could not fill the feed, the next choose starts one step further
+
+    def plan(self, level):
+        return FilterPlan(relaxed_preferences(self.preferences, set(self.steps[:level])))
+
+    def dropped(self, level=None):
+        return self.steps[:self.level if level is None else level]
+
+    def choose(self, recommender, listings, consumed, need, start=1):
+        """
+        First step (start..len(steps)) leaving at least need listings, or the last one when none does;
+        None if there is nothing to relax. Every step is one indexed count, none of them ranks anything
+        """
+        if not self.steps:
+            return None
+        start = min(start, len(self.steps))
+        plans = [self.plan(level) for level in range(start, len(self.steps) + 1)]
+        dead = set(consumed) | recommender.exclude_ids
+
+        self.counts = self.counts[:start - 1]
+        self.dry = False
+        for level, alive in enumerate(count_alive(recommender, listings, plans, dead), start):
+            self.counts.append(alive)
+            if alive >= need:
+                self.level = level
+                return level
+        self.level = len(self.steps)
+        return self.level
+
+    def describe(self):
+        return [c.value for c in self.dropped()]
+
+
+def count_alive(recommender, listings, plans, dead):
+    """
+    Lazily yields how many listings pass each plan and are not in dead (handed out or disliked ids),
+    through the SQL store, the index or a linear filter
+    """
+    store = recommender.store
+    if store is not None and listings is store:
+        yield from store.count_matching(plans, exclude=dead)
+        return
+    index = recommender.index
+    if index is not None and index.covers(listings):
+        #the dead ids are turned into rows once and found in each plan's sorted rows, no listing is looked up
+        dead_rows = sorted(index.rows_of(dead))
+        for plan in plans:
+            rows = index.filter_rows(plan)
+            if len(dead_rows) < len(rows):
+                gone = sum(1 for r in dead_rows if _has(rows, r))
+            else:
+                gone = len(set(rows).intersection(dead_rows))
+            yield len(rows) - gone
+        return
+    for plan in plans:
+        yield sum(1 for h in plan.filter(listings) if h.id not in dead)
+
+
+def _has(sorted_rows, row):
+    i = bisect_left(sorted_rows, row)
+    return i < len(sorted_rows) and sorted_rows[i] == row
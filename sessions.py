@@ -0,0 +1,77 @@
+"""
+Per-user recommender sessions for the API
+Each session is a UTAlgorithm spawned from one read-only catalog engine, so it only owns
+its preferences, weights, exclude_ids, feed and consumed ids
+The store is shared by all request threads; requests for the same session are serialized on session.lock by app.py
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+SESSION_HEADER = "X-Session-Token"
+DEFAULT_TOKEN = "default" #clients that send no token share this session, like before
+
+
+class SessionStore:
+    """
+    token -> session, evicted once idle for longer than ttl seconds or when over max_sessions (least recently used first)
+    factory(token) builds the session the first time a token is seen, on_evict(token, session) runs for every
+    session that is evicted or dropped, before a new session can be built for its token
+    """
+    def __init__(self, factory, ttl=1800, max_sessions=10000, clock=time.monotonic, on_evict=None):
+        self.factory = factory
+        self.on_evict = on_evict
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self._sessions = OrderedDict() #token -> [session, last_seen], oldest access first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, token):
+        return token in self._sessions
+
+    def get(self, token=None):
+        """
+        Session for a token, created on first use
+        """
+        token = token or DEFAULT_TOKEN
+        with self._lock:
+            now = self.clock()
+            self._evict_idle(now)
+
+            entry = self._sessions.get(token)
+            if entry is None:
+                #built under the lock so two first requests with one token can't end up with two sessions
+                entry = [self.factory(token), now]
+                self._sessions[token] = entry
+                while len(self._sessions) > self.max_sessions:
+                    self._evicted(*self._sessions.popitem(last=False))
+            else:
+                entry[1] = now
+                self._sessions.move_to_end(token)
+            return entry[0]
+
+    def drop(self, token):
+        token = token or DEFAULT_TOKEN
+        with self._lock:
+            entry = self._sessions.pop(token, None)
+            if entry is not None:
+                self._evicted(token, entry)
+
+    def _evict_idle(self, now):
+        #entries are kept in access order, so the expired ones are all at the front
+        while self._sessions:
+            token, entry = next(iter(self._sessions.items()))
+            if now - entry[1] <= self.ttl:
+                break
+            del self._sessions[token]
+            self._evicted(token, entry)
+
+    def _evicted(self, token, entry):
+        #under the lock, so the token can't be recreated before on_evict has seen its session
+        if self.on_evict is not None:
+            self.on_evict(token, entry[0])
@@ -0,0 +1,410 @@
+"""
+"More like this": listings as normalized feature vectors and a nearest-neighbor index over them
+A listing's vector is its log price, log sqft, beds and baths as z-scores over the catalog, then its city and
+listing type one-hot and its styles multi-hot (scaled to unit length), every block weighted by WEIGHTS.
+Listings are compared by squared distance, reported as similarity 1 / (1 + distance), 1 for identical features.
+
+Up to EXACT_MAX listings every query scans all the vectors, block by block; above that the catalog is split into
+about sqrt(n) k-means partitions and a query only scans the PROBES partitions with the closest centroids.
+The index keeps the compact columns (numbers, codes, style masks) instead of the vectors and computes distances
+from them directly, so a million listings cost tens of MB rather than a dense float matrix; vectors are only
+expanded to train the partitions.
+Without numpy the index is a plain linear scan over per-listing vectors, fine for the catalogs such a setup serves.
+"""
+
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+
+import catalog_file
+import columnar
+import metrics
+import vocab
+
+np = columnar.np
+log = logging.getLogger("housefindr")
+
+NUMERIC = ("price", "sqft", "beds", "baths")
+LOG_SCALED = ("price", "sqft") #compared by ratio, $100k means more between condos than between mansions
+CATEGORICAL = ("city", "listing_type")
+
+#one standard deviation of log price counts as much as a different city
+WEIGHTS = {"price": 1.0, "sqft": 0.8, "beds": 0.5, "baths": 0.5, "city": 1.0, "listing_type": 0.7, "style": 0.7}
+
+EXACT_MAX = 20_000    #catalogs up to this size are searched exactly
+BLOCK_ROWS = 16_384   #rows per block in the exact scan
+PROBES = 8            #partitions scanned per query in the partitioned index
+KMEANS_SAMPLE = 64    #training rows per partition
+KMEANS_ITERATIONS = 8
+ASSIGN_CELLS = 4_000_000 #rows x centroids per distance matrix while partitioning
+
+
+def _mean_std(values):
+    present = [v for v in values if v is not None and v == v]
+    if not present:
+        return 0.0, 1.0
+    mean = math.fsum(present) / len(present)
+    std = math.sqrt(math.fsum((v - mean) ** 2 for v in present) / len(present))
+    return mean, std or 1.0
+
+
+class FeatureSpace:
+    """
+    Layout and scaling of the vectors, fitted to one catalog:
+    [price, sqft, beds, baths | city one-hot | listing type one-hot | styles]
+    columns holds ids, the NUMERIC fields (None or NaN when missing), CATEGORICAL codes (-1 when missing)
+    and style bitmasks; sizes the number of cities, listing types and styles the codes index
+    """
+    def __init__(self, columns, sizes):
+        self.sizes = sizes
+        self.offsets = {"city": len(NUMERIC)}
+        self.offsets["listing_type"] = self.offsets["city"] + sizes["city"]
+        self.offsets["style"] = self.offsets["listing_type"] + sizes["listing_type"]
+        self.dim = self.offsets["style"] + sizes["style"]
+        self.scale = {}
+        for f in NUMERIC:
+            if columnar.available():
+                x = self._transform(f, np.asarray(columns[f], dtype=np.float64))
+                x = x[~np.isnan(x)]
+                self.scale[f] = (float(x.mean()), float(x.std()) or 1.0) if len(x) else (0.0, 1.0)
+            else:
+                self.scale[f] = _mean_std([self._transform_value(f, v) for v in columns[f]])
+
+    @staticmethod
+    def _transform(f, x):
+        return np.log1p(np.maximum(x, 0)) if f in LOG_SCALED else x
+
+    @staticmethod
+    def _transform_value(f, v):
+        if v is None or v != v:
+            return None
+        return math.log1p(max(v, 0)) if f in LOG_SCALED else v
+
+    #===SCALAR===#
+
+    def vector(self, price, sqft, beds, baths, city, listing_type, style):
+        out = [0.0] * self.dim
+        for j, (f, v) in enumerate(zip(NUMERIC, (price, sqft, beds, baths))):
+            v = self._transform_value(f, v)
+            if v is not None: #missing is the catalog mean
+                mean, std = self.scale[f]
+                out[j] = (v - mean) / std * WEIGHTS[f]
+        for f, code in zip(CATEGORICAL, (city, listing_type)):
+            if code >= 0:
+                out[self.offsets[f] + code] = WEIGHTS[f]
+        bits = [b for b in range(self.sizes["style"]) if style >> b & 1]
+        for b in bits:
+            out[self.offsets["style"] + b] = WEIGHTS["style"] / math.sqrt(len(bits))
+        return out
+
+    #===NUMPY===#
+
+    def compact(self, columns):
+        """
+        The columns as arrays, numbers already scaled: what the index keeps instead of the vectors
+        """
+        numeric = np.empty((len(columns["ids"]), len(NUMERIC)), dtype=np.float32)
+        for j, f in enumerate(NUMERIC):
+            mean, std = self.scale[f]
+            x = (self._transform(f, np.asarray(columns[f], dtype=np.float64)) - mean) / std * WEIGHTS[f]
+            numeric[:, j] = np.nan_to_num(x, nan=0.0)
+        out = {"numeric": numeric, "style": np.asarray(columns["style"], dtype=np.uint64)}
+        for f in CATEGORICAL:
+            out[f] = np.asarray(columns[f], dtype=np.int32)
+        count = np.zeros(len(numeric), dtype=np.float32)
+        for b in range(self.sizes["style"]):
+            count += (out["style"] >> np.uint64(b)) & np.uint64(1)
+        #every style of a listing weighs style_scale in its vector
+        out["style_scale"] = (WEIGHTS["style"] / np.sqrt(np.maximum(count, 1))) * (count > 0)
+        return out
+
+    def dense(self, compact, rows=slice(None)):
+        """
+        float32 vectors of the compact rows (a slice or an array of row numbers)
+        """
+        numeric = compact["numeric"][rows]
+        n = len(numeric)
+        out = np.zeros((n, self.dim), dtype=np.float32)
+        out[:, :len(NUMERIC)] = numeric
+        at = np.arange(n)
+        for f in CATEGORICAL:
+            codes = compact[f][rows]
+            known = codes >= 0
+            out[at[known], self.offsets[f] + codes[known]] = WEIGHTS[f]
+        bits = (compact["style"][rows][:, None] >> np.arange(self.sizes["style"], dtype=np.uint64)) & np.uint64(1)
+        out[:, self.offsets["style"]:] = bits.astype(np.float32) * compact["style_scale"][rows][:, None]
+        return out
+
+    def distances(self, compact, row, rows):
+        """
+        Squared distances between the vector of compact row row and those of rows, without building the vectors:
+        the one-hot blocks only differ by whether the codes match, the style block by the styles shared
+        """
+        numeric = compact["numeric"][rows] - compact["numeric"][row]
+        d = np.einsum("ij,ij->i", numeric, numeric)
+        for f in CATEGORICAL:
+            codes, code = compact[f][rows], compact[f][row]
+            known = codes >= 0
+            d += WEIGHTS[f] ** 2 * (known.astype(np.float32) + (code >= 0) - 2 * (known & (codes == code)))
+        scales, scale = compact["style_scale"][rows], compact["style_scale"][row]
+        mask = int(compact["style"][row])
+        shared = np.zeros(len(d), dtype=np.float32)
+        if mask:
+            styles = compact["style"][rows]
+            for b in range(mask.bit_length()):
+                if mask >> b & 1:
+                    shared += (styles >> np.uint64(b)) & np.uint64(1)
+        #|a|^2 + |b|^2 - 2 a.b, a listing's style block has length style weight (or 0 without a style)
+        w2 = WEIGHTS["style"] ** 2
+        d += w2 * (scales > 0) + w2 * (scale > 0) - 2 * scales * scale * shared
+        return np.maximum(d, 0)
+
+
+def _nearest_centroid(x, centroids):
+    #argmin |x - c|^2 = argmax x.c - |c|^2 / 2, one matrix product per block of rows
+    lifted = np.hstack([centroids, -0.5 * np.einsum("ij,ij->i", centroids, centroids)[:, None]])
+    out = np.empty(len(x), dtype=np.int32)
+    step = max(1, ASSIGN_CELLS // len(centroids))
+    for lo in range(0, len(x), step):
+        block = x[lo:lo + step]
+        out[lo:lo + len(block)] = np.argmax(np.hstack([block, np.ones((len(block), 1), np.float32)]) @ lifted.T, axis=1)
+    return out
+
+
+def _kmeans(x, k, rng):
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        labels = _nearest_centroid(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        for j in range(x.shape[1]):
+            centroids[:, j] = np.bincount(labels, weights=x[:, j], minlength=k) / np.maximum(counts, 1)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty): #restart an empty partition on a random row
+            centroids[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+    return centroids
+
+
+class NeighborIndex:
+    """
+    Exact scan in blocks of rows up to exact_max listings, k-means partitions above that (numpy)
+    Row i is listing ids[i]; a partitioned index stores its rows partition by partition
+    """
+    def __init__(self, space, ids, compact, exact_max=EXACT_MAX, probes=PROBES, seed=0):
+        self.space = space
+        self.probes = probes
+        self.centroids = None
+        self.ids, self.compact = ids, compact
+        if len(ids) > exact_max:
+            self._partition(np.random.default_rng(seed))
+        self.id_order = np.argsort(self.ids, kind="stable")
+        self.sorted_ids = self.ids[self.id_order]
+
+    def _partition(self, rng):
+        n, space = len(self.ids), self.space
+        k = int(math.sqrt(n))
+        sample = space.dense(self.compact, np.sort(rng.choice(n, min(n, k * KMEANS_SAMPLE), replace=False)))
+        centroids = _kmeans(sample, k, rng)
+        step = max(1, ASSIGN_CELLS // k)
+        labels = np.concatenate([_nearest_centroid(space.dense(self.compact, slice(lo, lo + step)), centroids)
+                                 for lo in range(0, n, step)])
+        order = np.argsort(labels, kind="stable")
+        self.ids = self.ids[order]
+        self.compact = {f: column[order] for f, column in self.compact.items()}
+        self.starts = np.searchsorted(labels[order], np.arange(k + 1))
+        self.centroids = centroids
+        self.centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, listing_id):
+        try:
+            key = int(listing_id)
+        except (TypeError, ValueError):
+            return None
+        j = int(np.searchsorted(self.sorted_ids, key))
+        if j < len(self.sorted_ids) and self.sorted_ids[j] == key:
+            return int(self.id_order[j])
+        return None
+
+    def vector(self, row):
+        return self.space.dense(self.compact, np.array([row]))[0]
+
+    def _candidates(self, row):
+        #every row in blocks, or the rows of the partitions closest to this one
+        if self.centroids is None:
+            return [np.arange(lo, min(lo + BLOCK_ROWS, len(self.ids))) for lo in range(0, len(self.ids), BLOCK_ROWS)]
+        q = self.vector(row)
+        probes = columnar.top_positions(2 * (self.centroids @ q) - self.centroid_norms, self.probes)
+        return [np.concatenate([np.arange(self.starts[p], self.starts[p + 1]) for p in probes])]
+
+    def similar(self, listing_id, k):
+        """
+        [(similarity, listing id)] of the k listings closest to this one, closest first; [] for an unknown id
+        """
+        row = self.row_of(listing_id)
+        if row is None:
+            return []
+        found_rows, found = [], []
+        for rows in self._candidates(row):
+            d = self.space.distances(self.compact, row, rows)
+            d[rows == row] = np.inf
+            best = columnar.top_positions(-d, k) #closest first, ties in row order
+            found_rows.append(rows[best])
+            found.append(d[best])
+        rows, d = np.concatenate(found_rows), np.concatenate(found)
+        return [(1.0 / (1.0 + float(d[i])), str(self.ids[rows[i]])) for i in columnar.top_positions(-d, k)
+                if d[i] != np.inf]
+
+
+class ScanIndex:
+    """
+    Linear scan over per-listing vectors, without numpy
+    """
+    def __init__(self, space, ids, vectors):
+        self.space = space
+        self.ids = ids
+        self.vectors = vectors
+        self.rows = {listing_id: row for row, listing_id in enumerate(ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, listing_id):
+        try:
+            return self.rows.get(int(listing_id))
+        except (TypeError, ValueError):
+            return None
+
+    def vector(self, row):
+        return self.vectors[row]
+
+    def similar(self, listing_id, k):
+        row = self.row_of(listing_id)
+        if row is None:
+            return []
+        q = self.vectors[row]
+        best = heapq.nsmallest(k, ((sum((a - b) ** 2 for a, b in zip(v, q)), r)
+                                   for r, v in enumerate(self.vectors) if r != row))
+        return [(1.0 / (1.0 + d), str(self.ids[r])) for d, r in best]
+
+
+def build_index(columns, sizes):
+    space = FeatureSpace(columns, sizes)
+    if columnar.available() and columnar.styles_fit(sizes["style"]): #the compact style column is a uint64 mask
+        return NeighborIndex(space, np.asarray(columns["ids"], dtype=np.int64), space.compact(columns))
+    fields = NUMERIC + CATEGORICAL + ("style",)
+    vectors = [space.vector(*values) for values in zip(*(columns[f] for f in fields))]
+    return ScanIndex(space, list(columns["ids"]), vectors)
+
+
+#===SOURCES===#
+#(columns, sizes) from each way UTAlgorithm holds its catalog in memory, like facets.py; pushdown has no index
+
+def from_listings(listings):
+    columns = {
+        "ids": [int(l.id) for l in listings],
+        "price": [l.price for l in listings],
+        "sqft": [l.sqft for l in listings],
+        "beds": [l.beds for l in listings],
+        "baths": [l.baths for l in listings],
+        "city": [l.city_code for l in listings],
+        "listing_type": [l.type_code for l in listings],
+        "style": [l.style_mask for l in listings],
+    }
+    return columns, {"city": len(vocab.CITIES), "listing_type": len(vocab.LISTING_TYPES), "style": len(vocab.STYLES)}
+
+
+def from_mapped(mapped):
+    #catalog_file.MappedCatalog columns, nulls bit i marks a missing catalog_file.NUMERIC[i]
+    c = mapped.cols
+    columns = {"ids": c["ids"], "city": c["city"], "listing_type": c["listing_type"], "style": c["style"]}
+    for bit, f in enumerate(catalog_file.NUMERIC):
+        if columnar.available():
+            a = mapped.arrays
+            columns[f] = np.where((a["nulls"] >> bit) & 1, np.nan, a[f])
+        else:
+            columns[f] = [None if n >> bit & 1 else v for v, n in zip(c[f], c["nulls"])]
+    return columns, {f: len(mapped.dicts[f]) for f in CATEGORICAL + ("style",)}
+
+
+class Neighbors:
+    """
+    The index of one catalog, shared by every session over that catalog
+    It is built in a background thread (see start) and queries find nothing until it is ready, so no request
+    waits seconds for it; index() builds it in the calling thread instead
+    listings is what UTAlgorithm holds (a list of Listings or catalog_file.MappedListings; a pushdown catalog has none),
+    by_id turns the ids found back into listings
+    base: Neighbors of the catalog this one patches (see catalog_delta.py), whose index is used as it is
+    """
+    def __init__(self, listings, by_id, base=None):
+        self.listings = listings
+        self.by_id = by_id
+        self.base = base
+        self._index = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = os.getpid()
+
+    def covers(self, listings):
+        return listings is self.listings
+
+    def ready(self):
+        return self._index is not None or (self.base is not None and self.base.ready())
+
+    def started(self):
+        return self._thread is not None or self.ready()
+
+    def start(self):
+        """
+        Builds the index in a daemon thread, once per process
+        """
+        if self._pid != os.getpid(): #forked (gunicorn --preload) mid-build, the build thread and its lock stayed behind
+            self._lock, self._thread, self._pid = threading.Lock(), None, os.getpid()
+        with self._lock:
+            if self._thread is None and self._index is None:
+                self._thread = threading.Thread(target=self._build, name="neighbor-index", daemon=True)
+                self._thread.start()
+        return self
+
+    def _build(self):
+        try:
+            self.index()
+        except Exception:
+            log.exception("Could not build the neighbor index")
+
+    def index(self):
+        if self._index is None:
+            with self._lock: #built once even when the first likes arrive together
+                if self._index is None and self.base is not None:
+                    self._index = self.base.index()
+                if self._index is None:
+                    start = time.perf_counter()
+                    listings = self.listings
+                    if isinstance(listings, catalog_file.MappedListings):
+                        source = from_mapped(listings.catalog)
+                    else:
+                        source = from_listings(listings)
+                    self._index = build_index(*source)
+                    metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage="neighbor_index")
+        return self._index
+
+    def similar_ids(self, listing_id, n, stage_seconds=metrics.STAGE_SECONDS):
+        """
+        [(similarity, listing id)] of the n closest listings, closest first; [] while the index is being built
+        """
+        if not self.ready():
+            self.start()
+            return []
+        index = self.index()
+        start = time.perf_counter()
+        out = index.similar(listing_id, n)
+        stage_seconds.observe(time.perf_counter() - start, stage="neighbors")
+        return out
+
+    def similar(self, listing_id, n):
+        found = ((s, self.by_id.get(i)) for s, i in self.similar_ids(listing_id, n))
+        return [(s, h) for s, h in found if h is not None]
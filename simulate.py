@@ -0,0 +1,295 @@
+"""
+Offline user simulation: how many swipes HousingRecommender needs to find what a user wants, and how many
+sessions a core sustains
+Every simulated user has hidden ground-truth preferences drawn around a random catalog listing, states some of
+them (noisily) up front like the onboarding screen, then answers recommend_listing with likes / dislikes
+(flipped with probability --noise) that go back through update_user_feedback. Sessions run across a process
+pool over one catalog loaded per worker; session i of a run always gets the same user and the same random
+draws, whichever worker runs it, so every policy is compared on identical users.
+
+    swipes_to_first_like   swipes until the user first liked a home (sessions that never did are counted apart)
+    precision_at_k         share of truly matching homes among swipes 1..k, k+1..2k, ... of every session
+    ran_dry                share of sessions where recommend_listing had nothing left before the last swipe
+    sessions_per_second    wall clock throughput of the pool, also per worker
+
+    python simulate.py --listings 100000 --sessions 5000 --workers 4
+    python simulate.py --db houselisting.db --policy default:0.15:3 --policy greedy:0:1 --policy wide:0.3:5
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import benchmark
+import columnar
+import synthetic
+from constraints import Constraint
+
+CHUNK = 50 #sessions per pool task
+
+_engine = None #catalog engine of this process, see _init_worker
+
+
+class Policy:
+    """
+    Exploration settings for a simulated session's recommender: recommend_n picks a runner-up among the
+    top_k best with probability explore_epsilon. None keeps the recommender's default; subclasses can also
+    change the settings as the session goes on through before_swipe
+    """
+    def __init__(self, name, explore_epsilon=None, top_k=None):
+        self.name = name
+        self.explore_epsilon = explore_epsilon
+        self.top_k = top_k
+
+    @classmethod
+    def parse(cls, spec):
+        #name:epsilon:top_k, left out numbers keep the recommender's own
+        name, *values = spec.split(":")
+        try:
+            epsilon = float(values[0]) if len(values) > 0 and values[0] else None
+            top_k = int(values[1]) if len(values) > 1 and values[1] else None
+        except ValueError:
+            raise ValueError(f"Bad policy {spec!r}, expected name:epsilon:top_k") from None
+        return cls(name, epsilon, top_k)
+
+    def apply(self, recommender):
+        if self.explore_epsilon is not None:
+            recommender.explore_epsilon = self.explore_epsilon
+        if self.top_k is not None:
+            recommender.top_k = self.top_k
+
+    def before_swipe(self, recommender, swipe):
+        pass
+
+    def describe(self, recommender):
+        return {"explore_epsilon": recommender.explore_epsilon, "top_k": recommender.top_k}
+
+
+def _styles(h):
+    style = h.style
+    if style is None:
+        return set()
+    return set(style) if isinstance(style, set) else {style}
+
+
+class SyntheticUser:
+    """
+    Hidden preferences built around one catalog listing, so at least that listing matches them
+    """
+    def __init__(self, anchor, rng, catalog_types, catalog_styles):
+        #half the users are also fine with one more listing type / style, picked from the catalog's
+        self.city = anchor.city
+        self.types = {anchor.listing_type} | ({rng.choice(catalog_types)} if rng.random() < 0.5 else set())
+        self.types.discard(None)
+        self.styles = _styles(anchor) | ({rng.choice(catalog_styles)} if rng.random() < 0.5 else set())
+        self.budget = (anchor.price or 0) * rng.uniform(1.0, 1.5)
+        self.min_sqft = (anchor.sqft or 0) * rng.uniform(0.6, 1.0)
+
+    def matches(self, h):
+        return (h.city == self.city
+                and (not self.types or h.listing_type in self.types)
+                and (not self.styles or bool(_styles(h) & self.styles))
+                and h.price is not None and h.price <= self.budget
+                and (h.sqft or 0) >= self.min_sqft)
+
+    def state(self, prefs, rng, stated):
+        """
+        What the user tells onboarding: each preference with probability stated, the budget off by up to 20%
+        """
+        if rng.random() < stated:
+            prefs.update_constraint_value(Constraint.LOCATION, self.city)
+        if rng.random() < stated and self.types:
+            prefs.update_constraint_value(Constraint.HOME_TYPE, set(self.types))
+        if rng.random() < stated and self.styles:
+            prefs.update_constraint_value(Constraint.STYLE, set(self.styles))
+        if rng.random() < stated and self.budget > 0:
+            prefs.update_constraint_value(Constraint.BUDGET, int(self.budget * rng.uniform(0.8, 1.2)))
+        if rng.random() < stated and self.min_sqft > 0:
+            prefs.update_constraint_value(Constraint.SQUARE_FEET, int(self.min_sqft))
+
+
+#===WORKERS===#
+
+def _init_worker(db_dir):
+    #forked workers inherit the parent's loaded catalog, spawned ones load their own
+    global _engine
+    if _engine is None:
+        _engine = benchmark.load_engine(db_dir)
+
+
+_vocabularies = {}
+
+def _vocabulary(engine):
+    #(listing types, styles) of the catalog, collected once per process
+    key = id(engine.listings)
+    if key not in _vocabularies:
+        types, styles = set(), set()
+        for h in engine.listings:
+            types.add(h.listing_type)
+            styles |= _styles(h)
+        types.discard(None)
+        _vocabularies[key] = (sorted(types), sorted(styles))
+    return _vocabularies[key]
+
+
+def run_session(engine, policy, seed, index, swipes, stated, noise, vocabulary):
+    """
+    One simulated user, returns (swipe of the first like or None, [whether each recommendation truly matched])
+    """
+    rng = random.Random(f"{seed}:{index}")
+    random.seed(f"{seed}:{index}:explore") #recommend_n explores through the random module
+    session = engine.spawn()
+    rec, prefs, listings = session.algorithm, session.constraints, session.listings
+    user = SyntheticUser(listings[rng.randrange(len(listings))], rng, *vocabulary)
+    user.state(prefs, rng, stated)
+    policy.apply(rec)
+
+    consumed = set()
+    first_like = None
+    relevant = []
+    for swipe in range(1, swipes + 1):
+        policy.before_swipe(rec, swipe)
+        h = rec.recommend_listing(prefs, listings, consumed)
+        if h is None:
+            break
+        consumed.add(h.id)
+        match = user.matches(h)
+        liked = match != (rng.random() < noise)
+        relevant.append(match)
+        if liked and first_like is None:
+            first_like = swipe
+        rec.update_user_feedback(prefs, h, liked)
+    return first_like, relevant
+
+
+def _run_chunk(policy, seed, indices, swipes, stated, noise):
+    vocabulary = _vocabulary(_engine)
+    return [run_session(_engine, policy, seed, i, swipes, stated, noise, vocabulary) for i in indices]
+
+
+#===REPORT===#
+
+def summarize(results, swipes, k, seconds, workers):
+    firsts = sorted(f for f, _ in results if f is not None)
+    windows = []
+    for lo in range(0, swipes, k):
+        shown = hits = 0
+        for _, relevant in results:
+            window = relevant[lo:lo + k]
+            shown += len(window)
+            hits += sum(window)
+        if shown:
+            windows.append({"swipes": f"{lo + 1}-{min(lo + k, swipes)}", "precision": round(hits / shown, 4),
+                            "sessions": sum(1 for _, relevant in results if len(relevant) > lo)})
+    total_swipes = sum(len(relevant) for _, relevant in results)
+    return {
+        "sessions": len(results),
+        "swipes_to_first_like": {
+            "mean": round(statistics.fmean(firsts), 3) if firsts else None,
+            "median": statistics.median(firsts) if firsts else None,
+            "p90": firsts[min(len(firsts) - 1, int(len(firsts) * 0.9))] if firsts else None,
+            "never_liked": round(1 - len(firsts) / max(len(results), 1), 4),
+        },
+        "precision_at_k": windows,
+        "ran_dry": round(sum(1 for _, relevant in results if len(relevant) < swipes) / max(len(results), 1), 4),
+        "seconds": round(seconds, 3),
+        "sessions_per_second": round(len(results) / seconds, 2),
+        "sessions_per_second_per_worker": round(len(results) / seconds / workers, 2),
+        "swipes_per_second": round(total_swipes / seconds, 1),
+    }
+
+
+def simulate(engine, db_dir, policies, sessions, swipes=30, k=5, seed=0, workers=None, stated=0.6, noise=0.05):
+    """
+    Runs the same sessions under every policy, {policy name: summary}
+    """
+    global _engine
+    workers = workers or os.cpu_count() or 1
+    _engine = engine
+    if engine.neighbors is not None:
+        engine.neighbors.index() #built once here and inherited, not once per worker inside the timings
+    _vocabulary(engine)
+    #fork shares the loaded catalog copy-on-write, elsewhere every worker loads it in _init_worker
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+
+    report = {}
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(db_dir,)) as pool:
+        list(pool.map(_init_worker, [db_dir] * workers)) #start the workers before any clock does
+        for policy in policies:
+            start = time.perf_counter()
+            chunks = [range(lo, min(lo + CHUNK, sessions)) for lo in range(0, sessions, CHUNK)]
+            futures = [pool.submit(_run_chunk, policy, seed, chunk, swipes, stated, noise) for chunk in chunks]
+            results = [r for f in futures for r in f.result()]
+            probe = engine.spawn().algorithm
+            policy.apply(probe)
+            report[policy.name] = {"policy": policy.describe(probe),
+                                   **summarize(results, swipes, k, time.perf_counter() - start, workers)}
+            print(f"{policy.name}: {report[policy.name]['sessions_per_second']} sessions/s", file=sys.stderr)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate users swiping through recommendations")
+    parser.add_argument("--db", help="houselisting.db to simulate on (default: a synthetic one, see --listings)")
+    parser.add_argument("--listings", type=int, default=20000, help="size of the synthetic catalog")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--swipes", type=int, default=30, help="swipes per session")
+    parser.add_argument("--k", type=int, default=5, help="window of the precision@k curve")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stated", type=float, default=0.6, help="probability a user states each preference")
+    parser.add_argument("--noise", type=float, default=0.05, help="probability a user answers the wrong way")
+    parser.add_argument("--policy", action="append", default=[], help="name:epsilon:top_k, repeat to compare")
+    parser.add_argument("--out", help="write the JSON report here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    try:
+        policies = [Policy.parse(spec) for spec in args.policy] or [Policy("default")]
+    except ValueError as e:
+        parser.error(str(e))
+
+    meta = {
+        "python": platform.python_version(),
+        "numpy": columnar.np.__version__ if columnar.available() else None,
+        "seed": args.seed,
+        "sessions": args.sessions,
+        "swipes": args.swipes,
+        "k": args.k,
+        "workers": args.workers,
+        "stated": args.stated,
+        "noise": args.noise,
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.db:
+            db_dir = os.path.dirname(os.path.abspath(args.db))
+            if os.path.basename(args.db) != "houselisting.db":
+                parser.error("--db must point at a file named houselisting.db") #UTAlgorithm opens it by name
+        else:
+            db_dir = tmp
+            print(f"writing {args.listings} synthetic listings...", file=sys.stderr)
+            synthetic.write_db(os.path.join(tmp, "houselisting.db"), args.listings, args.seed)
+        engine = benchmark.load_engine(db_dir)
+        meta["listings"] = len(engine.listings)
+        results = simulate(engine, db_dir, policies, args.sessions, args.swipes, args.k, args.seed,
+                           args.workers, args.stated, args.noise)
+
+    text = json.dumps({"meta": meta, "results": results}, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
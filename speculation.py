@@ -0,0 +1,100 @@
+"""
+Speculative refill for the card the user is looking at
+While the client shows feed[0], both possible answers (like / dislike) are played out on a copy of
+the recommender in the background, so /feedback can answer from the finished branch.
+A branch that has not finished by then is dropped and the request ranks inline: waiting for it would make
+the swipe slower than not speculating at all
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import logging
+import os
+import threading
+
+import metrics
+
+log = logging.getLogger("housefindr")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="speculate")
+    return _executor
+
+
+def state_key(engine, listing):
+    """
+    Everything the next recommendations depend on, taken before the feedback is applied
+    exclude_ids and consumed only ever grow, so their sizes are enough to spot a change
+    """
+    return (
+        listing.id,
+        id(engine.constraints),
+        engine.constraints.version,
+        tuple(engine.algorithm.weights.items()),
+        len(engine.algorithm.exclude_ids),
+        len(engine.consumed),
+        len(engine.feed),
+    )
+
+
+def _fork(recommender):
+    #weights, exclude_ids and boosts are the only state feedback touches
+    rec = copy.copy(recommender)
+    rec.weights = dict(recommender.weights)
+    rec.exclude_ids = set(recommender.exclude_ids)
+    rec.boosts = dict(recommender.boosts)
+    #background rankings must not skew the request-path stage latencies
+    rec.stage_seconds = metrics.SPECULATIVE_STAGE_SECONDS
+    rec.candidates = metrics.SPECULATIVE_CANDIDATES
+    return rec
+
+
+def _both_branches(branches, prefs, listings, listing, need, consumed):
+    out = {}
+    for liked, rec in branches.items():
+        rec.update_user_feedback(prefs, listing, liked)
+        out[liked] = rec.recommend_n(prefs, listings, need, consumed=consumed)
+    return out
+
+
+class Speculation:
+    def __init__(self, engine, listing, need):
+        self.key = state_key(engine, listing)
+        self.need = need
+        #snapshot on the request thread, the worker never reads live session state
+        branches = {True: _fork(engine.algorithm), False: _fork(engine.algorithm)}
+        self.future = executor().submit(_both_branches, branches, copy.deepcopy(engine.constraints), engine.listings,
+                                        listing, need, set(engine.consumed))
+
+    def take(self, engine, listing, liked):
+        """
+        Precomputed picks for this answer, or None if the engine moved on since the speculation started
+        Must be called before the feedback is applied to the engine
+        """
+        if self.key != state_key(engine, listing):
+            self.future.cancel()
+            metrics.SPECULATIONS.inc(result="stale")
+            return None
+        if not self.future.done(): #still queued or running, ranking inline is quicker than waiting
+            self.future.cancel()
+            metrics.SPECULATIONS.inc(result="not_ready")
+            return None
+        try:
+            picks = self.future.result()[liked]
+        except Exception: #the request ranks inline, but a failing background ranking must not go unnoticed
+            log.exception("Speculative ranking failed")
+            metrics.SPECULATIONS.inc(result="error")
+            return None
+        if any(h.id in engine.consumed for h in picks):
+            metrics.SPECULATIONS.inc(result="stale")
+            return None
+        metrics.SPECULATIONS.inc(result="used")
+        return picks
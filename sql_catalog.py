@@ -0,0 +1,251 @@
+"""
+SQL pushdown catalog: the listings stay in houselisting.db and are queried instead of loaded
+A FilterPlan is translated into one parameterized WHERE on the listings table, and the matching rows
+are pulled in chunks through a generator, so memory follows the result set instead of the catalog.
+HousingRecommender ranks the chunks as they arrive (see HousingRecommender._rank_streamed).
+
+    python sql_catalog.py houselisting.db     #creates the indexes below and ANALYZEs the table
+
+The server never creates them itself; ingest.py builds them after every load.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+import algorithm
+
+log = logging.getLogger("housefindr")
+
+#only the columns a Listing is built from, in algorithm.Listing argument order
+COLUMNS = "id, price, square_feet, bedrooms, bathrooms, city, style, property_type, status"
+
+#filter_plan.NUMERIC_BOUNDS field -> listings column
+BOUND_COLUMNS = {
+    "sqft": "square_feet",
+    "price": "price",
+    "beds": "bedrooms",
+    "baths": "bathrooms",
+}
+
+#city + style + price range is the common query, the single-column ones serve plans without a city
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_listings_city_style_price ON listings(city, style, price)",
+    "CREATE INDEX IF NOT EXISTS idx_listings_price ON listings(price)",
+    "CREATE INDEX IF NOT EXISTS idx_listings_square_feet ON listings(square_feet)",
+)
+
+
+def ensure_indexes(db_path, indexes=INDEXES):
+    """
+    Creates the pushdown indexes and gathers planner statistics once; False if the DB can't be written
+    """
+    try:
+        conn = sqlite3.connect(db_path, timeout=5)
+        try:
+            for sql in indexes:
+                conn.execute(sql)
+            #without statistics SQLite may pick the price index over city + style
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+                conn.execute("ANALYZE listings")
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        log.warning("Could not index %s for SQL pushdown: %s", db_path, e)
+        return False
+    return True
+
+
+def listing_from_row(row):
+    return algorithm.Listing(str(row[0]), *row[1:])
+
+
+def where_clause(plan):
+    """
+    (sql, params) selecting exactly the listings a filter_plan.FilterPlan passes
+    A flexible bound keeps values within roomForError of the preference, so the slack folds into the limit
+    """
+    terms, params = [], []
+    if plan.city is not None:
+        terms.append("city = ?")
+        params.append(plan.city)
+    for bound in plan.bounds:
+        column = BOUND_COLUMNS[bound.field]
+        slack = bound.roomForError if bound.flexible and bound.roomForError > 0 else 0
+        if bound.kind == "min":
+            terms.append(f"{column} >= ?")
+            params.append(bound.value - slack)
+        else:
+            terms.append(f"{column} <= ?")
+            params.append(bound.value + slack)
+    if plan.styles is not None:
+        styles = sorted(plan.styles)
+        terms.append(f"style IN ({', '.join('?' * len(styles))})")
+        params.extend(styles)
+    return (" AND ".join(terms) if terms else "1"), params
+
+
+class SqlCatalog:
+    """
+    Sequence-like view of the listings table, stands in for UTAlgorithm.listings in pushdown mode
+    Every thread (and every forked worker) reads through its own read-only connection
+    """
+    def __init__(self, db_path, chunk_size=5000):
+        self.db_path = db_path
+        self.chunk_size = chunk_size
+        self._local = threading.local()
+        self.by_id = SqlIdLookup(self)
+        self.images = SqlImages(self)
+        self._len = None #row count, read once and then again by recount
+
+    def connection(self):
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid(): #a connection must not cross a fork
+            local.conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            local.pid = os.getpid()
+        return local.conn
+
+    def __len__(self):
+        if self._len is None:
+            self.recount()
+        return self._len
+
+    def recount(self):
+        """
+        Reads the row count again, UTAlgorithm.refresh_catalog calls it when the DB moved
+        """
+        (self._len,) = self.connection().execute("SELECT COUNT(*) FROM listings").fetchone()
+        return self._len
+
+    def __getitem__(self, i):
+        #catalog order is id order; slices serve /listings, ints the raw fallback cursor
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            rows = self.connection().execute(f"SELECT {COLUMNS} FROM listings ORDER BY id LIMIT ? OFFSET ?",
+                                             (max(0, stop - start), start)).fetchall()
+            return [listing_from_row(r) for r in rows][::step]
+        if i < 0:
+            i += len(self)
+        row = self.connection().execute(f"SELECT {COLUMNS} FROM listings ORDER BY id LIMIT 1 OFFSET ?",
+                                        (i,)).fetchone()
+        if row is None:
+            raise IndexError(i)
+        return listing_from_row(row)
+
+    def __iter__(self):
+        for chunk in self._chunks(f"SELECT {COLUMNS} FROM listings ORDER BY id", ()):
+            yield from chunk
+
+    def candidates(self, plan):
+        """
+        Generator of lists of at most chunk_size listings passing the plan, in catalog order
+        """
+        where, params = where_clause(plan)
+        return self._chunks(f"SELECT {COLUMNS} FROM listings WHERE {where} ORDER BY id", params)
+
+    def count_matching(self, plans, exclude=()):
+        """
+        How many listings pass each plan, in one pass over the rows the loosest plan selects
+        The plans must be nested (each one passes everything the previous one does), like a relaxation ladder
+        exclude: listing ids left out of every count, sent as one JSON array parameter however many there are
+        """
+        clauses = [where_clause(plan) for plan in plans]
+        where, params = clauses[-1]
+        ids = [int(i) for i in exclude if str(i).isdigit()]
+        if ids:
+            where = f"{where} AND id NOT IN (SELECT value FROM json_each(?))"
+            params = params + [json.dumps(ids)]
+        sums = ", ".join(f"COALESCE(SUM({w}), 0)" for w, _ in clauses[:-1])
+        sql = f"SELECT {sums + ', ' if sums else ''}COUNT(*) FROM listings WHERE {where}"
+        args = [p for _, ps in clauses[:-1] for p in ps] + params
+        return list(self.connection().execute(sql, args).fetchone())
+
+    def _chunks(self, sql, params):
+        cursor = self.connection().cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                yield [listing_from_row(r) for r in rows]
+        finally:
+            cursor.close()
+
+
+class SqlIdLookup:
+    """
+    listing id -> Listing, one primary key lookup per call
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def get(self, listing_id, default=None):
+        try:
+            key = int(listing_id)
+        except (TypeError, ValueError):
+            return default
+        row = self.catalog.connection().execute(f"SELECT {COLUMNS} FROM listings WHERE id = ?", (key,)).fetchone()
+        return default if row is None else listing_from_row(row)
+
+    def __getitem__(self, listing_id):
+        h = self.get(listing_id)
+        if h is None:
+            raise KeyError(listing_id)
+        return h
+
+    def __contains__(self, listing_id):
+        return self.get(listing_id) is not None
+
+
+class SqlImages:
+    """
+    listing id -> first image url, like UTAlgorithm.idToImg
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __len__(self):
+        (n,) = self.catalog.connection().execute("SELECT COUNT(DISTINCT listing_id) FROM images").fetchone()
+        return n
+
+    def get(self, key, default=None):
+        try:
+            key = int(key)
+        except (TypeError, ValueError):
+            return default
+        row = self.catalog.connection().execute("SELECT url FROM images WHERE listing_id = ? ORDER BY id LIMIT 1",
+                                                (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def __getitem__(self, key):
+        url = self.get(key)
+        if url is None:
+            raise KeyError(key)
+        return url
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def items(self):
+        #with MIN() SQLite takes the bare url column from the listing's first image
+        for key, url, _ in self.catalog.connection().execute(
+                "SELECT listing_id, url, MIN(id) FROM images GROUP BY listing_id ORDER BY listing_id"):
+            yield str(key), url
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python sql_catalog.py houselisting.db")
+    import catalog_refresh
+    import listing_details
+
+    extra = (catalog_refresh.WATERMARK_INDEX, listing_details.IMAGES_INDEX)
+    sys.exit(0 if ensure_indexes(sys.argv[1], INDEXES + extra) else 1)
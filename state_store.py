@@ -0,0 +1,182 @@
+"""
+Durable per-user recommender state in a sidecar SQLite database
+Requests only mark a session dirty; a background thread serializes dirty sessions and
+writes them with one executemany per flush, every flush_interval seconds or once batch_size
+sessions are waiting. State is read back lazily the first time a token shows up after a restart
+(or after its session was evicted, whose pending state is read back before the saved row, see evicted)
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger("housefindr")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_state (
+    token TEXT PRIMARY KEY,
+    state TEXT NOT NULL,               -- json from UTAlgorithm.export_state
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class SessionStateStore:
+    def __init__(self, path="sessions.db", flush_interval=2.0, batch_size=500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._start()
+        #a WSGI server that forks workers after import (gunicorn --preload) leaves them without the flush thread
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        #WAL lets several worker processes write the same file
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+
+        self._dirty = {} #token -> engine, or the state snapshot of an evicted one; latest state wins
+        self._flushing = {} #the batch being written, still newer than what the DB holds
+        self._dirty_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="state-flush", daemon=True)
+        self._thread.start()
+
+    #===REQUEST PATH===#
+
+    def load(self, token):
+        """
+        Saved state for a token, or None for a new user
+        State still waiting for the flush thread wins over the saved row
+        """
+        with self._dirty_lock:
+            pending = self._dirty.get(token)
+            if pending is None:
+                pending = self._flushing.get(token)
+        if pending is not None:
+            state = pending if isinstance(pending, dict) else self._snapshot(pending, blocking=True)
+            return json.loads(json.dumps(state)) #a copy, the pending state is still written as it was
+        with self._db_lock:
+            row = self._conn.execute("SELECT state FROM session_state WHERE token = ?", (token,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def mark_dirty(self, token, engine):
+        """
+        O(1), nothing is serialized or written here
+        """
+        with self._dirty_lock:
+            self._dirty[token] = engine
+            if len(self._dirty) >= self.batch_size:
+                self._wake.set()
+
+    def pending(self):
+        return len(self._dirty)
+
+    def evicted(self, token, engine):
+        """
+        A session is leaving memory: its pending state is queued as a snapshot, so the engine can go,
+        and load hands it to a request that recreates the session before the flush thread has written it
+        Runs under SessionStore's lock, so nothing is written or waited for here: a session in the middle of
+        a request stays queued as it is and is snapshotted by load or the next flush
+        """
+        with self._dirty_lock:
+            if self._dirty.get(token) is not engine:
+                return False
+        state = self._snapshot(engine, blocking=False)
+        if state is None:
+            return False
+        with self._dirty_lock:
+            if self._dirty.get(token) is engine:
+                self._dirty[token] = state
+        return True
+
+    @staticmethod
+    def _snapshot(engine, blocking):
+        #export_state under the session lock, None when it is held and blocking is False
+        lock = getattr(engine, "lock", None)
+        if lock is not None and not lock.acquire(blocking=blocking):
+            return None
+        try:
+            return engine.export_state()
+        finally:
+            if lock is not None:
+                lock.release()
+
+    #===WRITE BEHIND===#
+
+    def flush(self):
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, {}
+            self._flushing = dirty
+        try:
+            return self._write(dirty)
+        finally:
+            with self._dirty_lock:
+                if self._flushing is dirty:
+                    self._flushing = {}
+
+    def _write(self, dirty):
+        if not dirty:
+            return 0
+
+        rows, retry = [], {}
+        now = time.time()
+        for token, engine in dirty.items():
+            if isinstance(engine, dict): #snapshot of an evicted session
+                rows.append((token, json.dumps(engine), now))
+                continue
+            #a session in the middle of a request is picked up next flush rather than waited for
+            lock = getattr(engine, "lock", None)
+            if lock is not None and not lock.acquire(blocking=False):
+                retry[token] = engine
+                continue
+            try:
+                rows.append((token, json.dumps(engine.export_state()), now))
+            except RuntimeError:
+                retry[token] = engine #changed while we read it, pick it up next flush
+            finally:
+                if lock is not None:
+                    lock.release()
+
+        try:
+            with self._db_lock:
+                self._conn.executemany(
+                    "INSERT INTO session_state (token, state, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(token) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    rows,
+                )
+                self._conn.commit()
+        except sqlite3.Error:
+            retry.update(dirty)
+            raise
+        finally:
+            if retry:
+                with self._dirty_lock:
+                    for token, engine in retry.items():
+                        self._dirty.setdefault(token, engine)
+        return len(rows)
+
+    def _run(self):
+        while not self._stop:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                log.warning("Session state flush failed: %s", e)
+
+    def close(self):
+        self._stop = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
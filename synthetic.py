@@ -0,0 +1,157 @@
+"""
+Seeded synthetic catalog generator
+Produces rows with the same columns as the listings / images tables in houselisting.db,
+so anything that reads the real DB (UTA.UTAlgorithm included) can run against 10^3..10^7 listings
+
+    python synthetic.py out.db 100000 --seed 1
+"""
+
+import argparse
+import math
+import os
+import random
+import sqlite3
+
+LISTINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sheet_id TEXT,
+    title TEXT,
+    status TEXT CHECK(status IN ('rent','buy')) NOT NULL,
+    price INTEGER,
+    currency TEXT NOT NULL DEFAULT 'USD',
+    bedrooms INTEGER,
+    bathrooms INTEGER,
+    square_feet INTEGER,
+    address TEXT,
+    city TEXT,
+    state TEXT,
+    zip TEXT,
+    source_link TEXT,
+    property_type TEXT,
+    style TEXT,
+    created_at TEXT NOT NULL
+)
+"""
+
+IMAGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    listing_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    caption TEXT,
+    FOREIGN KEY(listing_id) REFERENCES listings(id) ON DELETE CASCADE
+)
+"""
+
+#(city, zip prefix, relative frequency, median buy price)
+CITIES = (
+    ("San Jose",      "951", 30, 1_400_000),
+    ("Santa Cruz",    "950", 10, 1_300_000),
+    ("San Francisco", "941", 20, 1_500_000),
+    ("Oakland",       "946", 12,   900_000),
+    ("Los Angeles",   "900", 25, 1_100_000),
+    ("Sacramento",    "958",  8,   550_000),
+    ("Fresno",        "937",  5,   400_000),
+)
+PROPERTY_TYPES = (("single family", 45), ("condo", 20), ("townhouse", 12), ("apartment", 15), ("single", 8))
+STYLES = (("modern", 30), ("spanish", 15), ("victorian", 10), ("craftsman", 12), ("ranch", 10),
+          ("contemporary", 10), ("cabin", 3), ("colonial", 5), ("apartment", 5))
+STREETS = ("Warren Dr", "Arnold Way", "S 10th St", "Oak Ave", "Park Blvd", "Main St", "Lincoln Ave", "Bascom Ave")
+
+
+def _pick(rng, table, weights):
+    return rng.choices(table, weights=weights)[0]
+
+
+def generate_listing_rows(n, seed=0, start_id=1):
+    """
+    Yields n tuples in listings column order (id first), deterministic for a given seed
+    """
+    rng = random.Random(seed)
+    city_w = [c[2] for c in CITIES]
+    type_names, type_w = zip(*PROPERTY_TYPES)
+    style_names, style_w = zip(*STYLES)
+
+    for i in range(start_id, start_id + n):
+        city, zip_prefix, _, median = _pick(rng, CITIES, city_w)
+        ptype = _pick(rng, type_names, type_w)
+        style = _pick(rng, style_names, style_w)
+        status = "rent" if rng.random() < 0.25 else "buy"
+
+        sqft = int(min(12000, max(300, rng.lognormvariate(math.log(1700), 0.4))))
+        if ptype in ("condo", "apartment"):
+            sqft = int(sqft * 0.65)
+        beds = max(0, min(8, round(sqft / 550 + rng.gauss(0, 0.7))))
+        baths = max(1, min(6, round(beds * 0.7 + rng.gauss(0, 0.5))))
+
+        size_factor = (sqft / 1700) ** 0.8
+        if status == "buy":
+            price = int(rng.lognormvariate(math.log(median * size_factor), 0.3) // 1000 * 1000)
+        else:
+            price = int(rng.lognormvariate(math.log(median / 350 * size_factor), 0.25) // 25 * 25)
+
+        number = rng.randint(100, 9999)
+        street = rng.choice(STREETS)
+        created_at = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00Z"
+        yield (
+            i, str(i), None, status, price, "USD", beds, baths, sqft,
+            f"{number} {street}", city, "CA", f"{zip_prefix}{rng.randint(0, 99):02d}",
+            f"https://example.com/homedetails/{i}", ptype, style, created_at,
+        )
+
+
+def generate_image_rows(n, seed=0, start_id=1, per_listing=1):
+    """
+    Yields image tuples (id, listing_id, url, caption) for listings start_id .. start_id + n - 1
+    """
+    rng = random.Random(seed + 1)
+    image_id = start_id
+    for listing_id in range(start_id, start_id + n):
+        for k in range(per_listing):
+            digest = "%032x" % rng.getrandbits(128)
+            caption = "Primary image" if k == 0 else f"Photo {k + 1}"
+            yield (image_id, listing_id, f"https://photos.example.com/fp/{digest}-sc_1920_1280.webp", caption)
+            image_id += 1
+
+
+def write_db(path, n, seed=0, images_per_listing=1, chunk=50_000):
+    """
+    Creates (or replaces) a houselisting.db style database with n synthetic listings
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(LISTINGS_SCHEMA)
+    conn.execute(IMAGES_SCHEMA)
+
+    def chunks(rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    for batch in chunks(generate_listing_rows(n, seed)):
+        conn.executemany("INSERT INTO listings VALUES (" + ",".join("?" * 17) + ")", batch)
+    for batch in chunks(generate_image_rows(n, seed, per_listing=images_per_listing)):
+        conn.executemany("INSERT INTO images VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic houselisting.db")
+    parser.add_argument("path")
+    parser.add_argument("n", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--images-per-listing", type=int, default=1)
+    args = parser.parse_args()
+    write_db(args.path, args.n, args.seed, args.images_per_listing)
+    print(f"Wrote {args.n} listings to {args.path}")
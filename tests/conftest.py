@@ -0,0 +1,76 @@
+import os
+import random
+import shutil
+import sys
+
+import pytest
+
+#the modules live at the repository root, next to app.py
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import algorithm
+import synthetic
+import UTA
+
+CITIES = ["Los Angeles", "New York", "Chicago", "San Jose", "Austin"]
+HOME_TYPES = ["House", "Apartment", "Condo", "Townhouse"]
+STYLES = ["Modern", "Traditional", "Contemporary", "Craftsman", "Victorian", "Ranch"]
+
+
+def make_listings(n, seed=0):
+    """
+    Random listings over a few cities, types and styles; prices and sizes are rounded so scores tie
+    ids are numeric strings like the DB's, the catalog file stores them as integers
+    """
+    rng = random.Random(seed)
+    return [algorithm.Listing(id=str(i + 1),
+                              price=rng.randrange(100_000, 1_500_000, 25_000),
+                              sqft=rng.randrange(400, 4000, 100),
+                              beds=rng.randint(1, 5),
+                              baths=rng.choice([1, 1.5, 2, 2.5, 3]),
+                              city=rng.choice(CITIES),
+                              style=set(rng.sample(STYLES, rng.randint(1, 2))),
+                              listing_type=rng.choice(HOME_TYPES),
+                              tenure=rng.choice(["buy", "rent"]))
+            for i in range(n)]
+
+
+@pytest.fixture(scope="session")
+def listings():
+    return make_listings(2000, seed=1)
+
+
+@pytest.fixture(scope="module")
+def db_dir(tmp_path_factory):
+    """
+    Directory holding a copy of the checked-in houselisting.db, UTA opens it relative to the working directory
+    """
+    path = tmp_path_factory.mktemp("catalog")
+    shutil.copy(os.path.join(REPO, "houselisting.db"), path)
+    return path
+
+
+@pytest.fixture(scope="module")
+def engine(db_dir):
+    """
+    Catalog engine over db_dir, sessions come from engine.spawn()
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(db_dir)
+        yield UTA.UTAlgorithm()
+
+
+@pytest.fixture
+def synthetic_engine(tmp_path, monkeypatch):
+    """
+    Factory for catalog engines over a synthetic houselisting.db in tmp_path, written on the first call
+    later calls reload the same DB, e.g. after the test edited it; keyword arguments go to UTAlgorithm
+    """
+    db = tmp_path / "houselisting.db"
+    def load(n=300, seed=7, images_per_listing=1, **kwargs):
+        if not db.exists():
+            synthetic.write_db(str(db), n, seed, images_per_listing)
+        monkeypatch.chdir(tmp_path)
+        return UTA.UTAlgorithm(**kwargs)
+    return load
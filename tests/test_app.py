@@ -0,0 +1,57 @@
+"""
+API routes through the Flask test client, over a copy of the checked-in catalog
+"""
+
+import importlib
+import sys
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def client(db_dir):
+    #app.py boots its engine from houselisting.db in the working directory when it is imported
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(db_dir)
+        sys.modules.pop("app", None)
+        app = importlib.import_module("app")
+        app.images.fetcher = offline #feed prefetches must not reach the listing photo hosts
+        yield app.app.test_client()
+        sys.modules.pop("app", None)
+
+
+def offline(url):
+    raise OSError("no network in tests")
+
+
+def headers(token):
+    return {"X-Session-Token": token}
+
+
+def test_bad_constraints_are_rejected(client):
+    before = client.get("/constraints", headers=headers("c1")).get_json()
+    for body in ({"bedrooms": "x"}, {"bathrooms": -1}, {"budget": [1]}, {"budget": 500_000, "bedrooms": -2}):
+        response = client.post("/constraints", json=body, headers=headers("c1"))
+        assert response.status_code == 400
+    assert client.get("/constraints", headers=headers("c1")).get_json() == before #not even the valid budget
+
+    response = client.post("/constraints", json={"bedrooms": "3", "bathrooms": 1.5}, headers=headers("c1"))
+    assert response.status_code == 200
+    assert (response.get_json()["bedrooms"], response.get_json()["bathrooms"]) == (3, 1.5)
+
+
+def test_feedback_batch_skips_unknown_ids_and_is_idempotent(client):
+    client.post("/constraints", json={"budget": 2_000_000}, headers=headers("b1"))
+    deck = client.get("/init?count=4", headers=headers("b1")).get_json()["deck"]
+    swipes = [{"id": deck[0]["id"], "liked": True}, {"id": "no-such-id", "liked": True},
+              {"id": deck[1]["id"], "liked": False}]
+
+    first = client.post("/feedback/batch", json={"swipes": swipes}, headers=headers("b1")).get_json()
+    assert first["applied"] == [deck[0]["id"], deck[1]["id"]]
+    assert first["skipped"] == ["no-such-id"]
+    assert not {deck[0]["id"], deck[1]["id"]} & {x["id"] for x in first["deck"]}
+
+    resent = client.post("/feedback/batch", json={"swipes": swipes}, headers=headers("b1")).get_json()
+    assert resent["applied"] == []
+    assert resent["skipped"] == [x["id"] for x in swipes]
+    assert resent["updated_weights_example"] == first["updated_weights_example"]
@@ -0,0 +1,73 @@
+"""
+A refresh patched in as a delta serves the same catalog, filters, ranking and facets as a full load of the same DB
+"""
+
+import sqlite3
+
+import pytest
+
+import catalog_delta
+from constraints import Constraint
+from filter_plan import FilterPlan
+
+
+def change(db, stamp, new=3, updated=4):
+    conn = sqlite3.connect(db)
+    ids = [r[0] for r in conn.execute("SELECT id FROM listings ORDER BY id LIMIT ?", (updated,))]
+    conn.executemany("UPDATE listings SET price = price + 1, city = 'Fresno', created_at = ? WHERE id = ?",
+                     [(stamp, i) for i in ids])
+    for j in range(new):
+        conn.execute("INSERT INTO listings (sheet_id, status, price, bedrooms, bathrooms, square_feet, city, "
+                     "property_type, style, created_at) VALUES (?, 'buy', ?, 3, 2, 1500, 'Reno', 'condo', 'brutalist', ?)",
+                     (f"new-{stamp}-{j}", 400_000 + j, stamp))
+        conn.execute("INSERT INTO images (listing_id, url) SELECT MAX(id), 'https://example.com/new.jpg' FROM listings")
+    conn.commit()
+    conn.close()
+
+
+def preferences(engine):
+    for city, budget, styles in (("Fresno", 0, None), ("Reno", 500_000, None), (None, 900_000, {"modern"}), (None, 0, None)):
+        prefs = engine.spawn().constraints
+        if city:
+            prefs.update_constraint_value(Constraint.LOCATION, city)
+        if budget:
+            prefs.update_constraint_value(Constraint.BUDGET, budget)
+        if styles:
+            prefs.update_constraint_value(Constraint.STYLE, styles)
+        yield prefs
+
+
+def ranked(engine, prefs):
+    matches = engine.index.filter(FilterPlan(prefs))
+    return [(round(score, 9), h.id) for score, h in engine.algorithm.rank_listings(matches, prefs, 20)]
+
+
+@pytest.mark.parametrize("mapped", [False, True])
+def test_delta_matches_full_load(tmp_path, synthetic_engine, mapped):
+    db = str(tmp_path / "houselisting.db")
+    engine = synthetic_engine(1000, seed=5, catalog_path=str(tmp_path / "catalog.bin") if mapped else None)
+    engine.facet_cube() #patched by the refreshes rather than rebuilt
+
+    for stamp in ("2999-01-01T00:00:00Z", "2999-01-02T00:00:00Z"):
+        change(db, stamp)
+        assert engine.refresh_catalog() == 7
+        assert isinstance(engine.listings, catalog_delta.DeltaListings)
+
+    full = synthetic_engine()
+    assert [(h.id, h.price, h.city) for h in engine.listings] == [(h.id, h.price, h.city) for h in full.listings]
+    for prefs in preferences(engine):
+        plan = FilterPlan(prefs)
+        assert [h.id for h in engine.index.filter(plan)] == [h.id for h in full.index.filter(plan)]
+        assert ranked(engine, prefs) == ranked(full, prefs)
+        assert engine.facet_cube().query(plan) == full.facet_cube().query(plan)
+    newest = full.listings[-1]
+    assert engine.by_id[newest.id].price == newest.price
+    assert engine.idToImg.get(newest.id) == full.idToImg.get(newest.id)
+
+
+def test_big_delta_rebuilds(tmp_path, synthetic_engine):
+    engine = synthetic_engine(200, seed=5)
+    change(str(tmp_path / "houselisting.db"), "2999-01-01T00:00:00Z", new=20)
+    assert engine.refresh_catalog() == 24
+    assert isinstance(engine.listings, list)
+    assert len(engine.listings) == 220
@@ -0,0 +1,59 @@
+"""
+A catalog snapshot is served while it matches the DB and rebuilt once rows are added or re-stamped
+"""
+
+import sqlite3
+
+import catalog_file
+
+
+def snapshot(db, path, content_hash=False):
+    return catalog_file.open_snapshot(path, catalog_file.db_fingerprint(db, content_hash))
+
+
+def test_snapshot_follows_the_db(tmp_path, synthetic_engine):
+    db, path = str(tmp_path / "houselisting.db"), str(tmp_path / "catalog.bin")
+    engine = synthetic_engine(catalog_path=path)
+    mapped = snapshot(db, path)
+    assert mapped is not None
+    assert [h.id for h in mapped.listings] == [h.id for h in engine.listings]
+
+    conn = sqlite3.connect(db)
+    conn.execute("INSERT INTO images (listing_id, url) VALUES (1, 'https://example.com/late.jpg')")
+    conn.commit()
+    assert snapshot(db, path) is None #new image
+
+    synthetic_engine(catalog_path=path) #rewrites it
+    assert snapshot(db, path) is not None
+    conn.execute("""INSERT INTO listings (id, status, price, city, property_type, style, created_at)
+                    VALUES (100000, 'buy', 500000, 'Fresno', 'House', 'Modern', '2999')""")
+    conn.commit()
+    conn.close()
+    assert snapshot(db, path) is None #new listing
+
+
+def test_content_hash_catches_edits_in_place(tmp_path, synthetic_engine):
+    db, path = str(tmp_path / "houselisting.db"), str(tmp_path / "catalog.bin")
+    synthetic_engine(catalog_path=path, content_hash=True)
+    assert snapshot(db, path, content_hash=True) is not None
+
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE listings SET price = price + 1 WHERE id = 7")
+    conn.commit()
+    conn.close()
+    assert snapshot(db, path) is None #the fingerprint kinds differ, a plain one never matches
+    assert snapshot(db, path, content_hash=True) is None
+
+
+def test_restamped_row_invalidates_the_snapshot(tmp_path, synthetic_engine):
+    db, path = str(tmp_path / "houselisting.db"), str(tmp_path / "catalog.bin")
+    synthetic_engine(catalog_path=path)
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE listings SET price = price + 1, created_at = '2999' WHERE id = 7") #an ingest upsert
+    conn.commit()
+    conn.close()
+    assert snapshot(db, path) is None
+
+    engine = synthetic_engine(catalog_path=path) #rewrites it
+    assert snapshot(db, path).meta["watermark"] == catalog_file.db_watermark(db) == engine.watermark
+    assert engine.by_id["7"].price == snapshot(db, path).by_id["7"].price
@@ -0,0 +1,61 @@
+"""
+The columnar catalog scores and ranks every listing exactly as the scalar score_listing path does
+"""
+
+import pytest
+
+import algorithm
+import columnar
+import vocab
+from constraints import Constraint, UserPreferences
+
+np = pytest.importorskip("numpy")
+
+
+def preference_sets():
+    empty = UserPreferences()
+
+    full = UserPreferences()
+    full.update_constraint_value(Constraint.LOCATION, "Chicago")
+    full.update_constraint_value(Constraint.HOME_TYPE, {"House", "Condo"})
+    full.update_constraint_value(Constraint.SQUARE_FEET, 1800)
+    full.update_constraint_value(Constraint.BUDGET, 650_000)
+    full.update_constraint_value(Constraint.STYLE, {"Modern", "Ranch"})
+    full.update_constraint_rigidity(Constraint.BUDGET, 0.6)
+
+    unknown = UserPreferences()
+    unknown.update_constraint_value(Constraint.LOCATION, "Nowhere")
+    unknown.update_constraint_value(Constraint.STYLE, {"Brutalist"})
+    unknown.update_constraint_value(Constraint.BUDGET, 400_000)
+    return [empty, full, unknown]
+
+
+def learned_recommender(catalog=None):
+    recommender = algorithm.HousingRecommender(catalog=catalog)
+    recommender.weights = {"location": 0.3, "home_type": 0.1, "square_feet": 0.2, "budget": 0.25, "style": 0.15}
+    return recommender
+
+
+def test_scores_match_score_listing(listings):
+    catalog = columnar.build(listings)
+    recommender = learned_recommender()
+    rows = catalog.rows_for(listings)
+    for prefs in preference_sets():
+        batched = catalog.score(recommender, prefs, rows)
+        assert batched.tolist() == [recommender.score_listing(l, prefs) for l in listings]
+
+
+def test_ranking_matches_the_scalar_path(listings):
+    catalog = columnar.build(listings)
+    subset = listings[::3]
+    for prefs in preference_sets():
+        batched = learned_recommender(catalog).rank_listings(subset, prefs, 25)
+        scalar = learned_recommender().rank_listings(subset, prefs, 25)
+        assert [(s, l.id) for s, l in batched] == [(s, l.id) for s, l in scalar]
+
+
+def test_too_many_styles_fall_back_to_scalar(listings, monkeypatch):
+    #styles are interned process-wide, so the column is narrowed rather than flooded with new styles
+    monkeypatch.setattr(columnar, "MAX_STYLES", len(vocab.STYLES) - 1)
+    monkeypatch.setattr(columnar, "_narrow_warned", False)
+    assert columnar.build(listings) is None
@@ -0,0 +1,62 @@
+"""
+Facet counts keep half baths apart, match a linear count, and a pushdown engine's cube follows rows
+written to the DB once they are refreshed
+"""
+
+import sqlite3
+
+import facets
+from constraints import Constraint, UserPreferences
+from filter_plan import FilterPlan
+
+
+def baths(cube, prefs=None):
+    return {v["value"]: v["count"] for v in cube.query(FilterPlan(prefs or UserPreferences()))["baths"]}
+
+
+def write(db, sql):
+    conn = sqlite3.connect(db)
+    conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+
+def test_half_baths_are_their_own_value(tmp_path, synthetic_engine):
+    synthetic_engine(300, seed=4)
+    write(str(tmp_path / "houselisting.db"), "UPDATE listings SET bathrooms = 1.5 WHERE id % 5 = 0")
+    cube = synthetic_engine().facet_cube()
+    assert baths(cube)[1.5] == 60
+
+    plain = facets.FacetCube.__new__(facets.FacetCube)
+    plain.__dict__.update(cube.__dict__, arrays=None) #same cells, answered without numpy
+    assert baths(plain) == baths(cube)
+
+
+def test_counts_match_a_linear_count(synthetic_engine):
+    engine = synthetic_engine(1000, seed=4)
+    prefs = engine.spawn().constraints
+    prefs.update_constraint_value(Constraint.LOCATION, "San Jose")
+    prefs.update_constraint_value(Constraint.STYLE, {"modern", "ranch"})
+    prefs.update_constraint_value(Constraint.BEDROOMS, 3)
+    counts = {v: c for v, c in baths(engine.facet_cube(), prefs).items() if c}
+
+    #the filter is the one facet that ignores it, adding a bathroom floor leaves the bath counts alone
+    expected = {}
+    for h in FilterPlan(prefs).filter(engine.listings):
+        expected[h.baths] = expected.get(h.baths, 0) + 1
+    assert expected and counts == expected
+    prefs.update_constraint_value(Constraint.BATHROOMS, 3)
+    assert {v: c for v, c in baths(engine.facet_cube(), prefs).items() if c} == expected
+
+
+def test_pushdown_cube_follows_the_db(tmp_path, synthetic_engine):
+    engine = synthetic_engine(300, seed=4, pushdown=True)
+    assert engine.facet_cube().rows == 300
+    write(str(tmp_path / "houselisting.db"),
+          "INSERT INTO listings (sheet_id, status, price, bedrooms, bathrooms, square_feet, city, property_type, "
+          "style, created_at) VALUES ('new', 'buy', 1, 3, 2.5, 1500, 'Reno', 'condo', 'modern', '2999')")
+    assert engine.facet_cube().rows == 300 #the DB is only polled by refresh_catalog
+    assert engine.refresh_catalog() == 1
+    cube = engine.facet_cube()
+    assert cube.rows == 301
+    assert baths(cube)[2.5] == 1
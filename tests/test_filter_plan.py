@@ -0,0 +1,72 @@
+"""
+ListingIndex and the catalog file's MappedIndex must pass exactly the listings the linear FilterPlan scan passes
+"""
+
+import random
+
+import pytest
+
+import catalog_file
+from conftest import CITIES, STYLES, make_listings
+from constraints import Constraint, UserPreferences
+from filter_plan import FilterPlan
+from listing_index import ListingIndex
+
+
+@pytest.fixture(scope="module")
+def listings():
+    out = make_listings(3000, seed=7)
+    #a few rows with missing numbers, they never pass a numeric constraint
+    for h in out[::97]:
+        h.price = None
+    for h in out[::89]:
+        h.baths = None
+    return out
+
+
+def random_preferences(rng):
+    prefs = UserPreferences()
+    if rng.random() < 0.7:
+        prefs.update_constraint_value(Constraint.LOCATION, rng.choice(CITIES + ["Nowhere"]))
+    if rng.random() < 0.5:
+        prefs.update_constraint_value(Constraint.STYLE, set(rng.sample(STYLES, rng.randint(1, 3))))
+    for constraint, lo, hi in ((Constraint.BUDGET, 100, 3_000_000), (Constraint.SQUARE_FEET, 300, 4000),
+                               (Constraint.BEDROOMS, 1, 6), (Constraint.BATHROOMS, 1, 4)):
+        if rng.random() < 0.5:
+            prefs.update_constraint_value(constraint, rng.randint(lo, hi))
+            if rng.random() < 0.5:
+                prefs.update_constraint_rigidity(constraint, rng.choice([0.05, 0.2, 0.5, 1.0]))
+    return prefs
+
+
+def ids(listings):
+    return [h.id for h in listings]
+
+
+def test_index_matches_linear_filter(listings):
+    index = ListingIndex(listings)
+    rng = random.Random(1)
+    for _ in range(300):
+        plan = FilterPlan(random_preferences(rng))
+        assert ids(index.filter(plan)) == ids(plan.filter(listings))
+
+
+def test_mapped_index_matches_linear_filter(listings, tmp_path):
+    path = tmp_path / "catalog.bin"
+    catalog_file.write_catalog(str(path), listings, {})
+    mapped = catalog_file.MappedCatalog(str(path))
+    index = mapped.index()
+    rng = random.Random(2)
+    for _ in range(300):
+        plan = FilterPlan(random_preferences(rng))
+        assert ids(index.filter(plan)) == ids(plan.filter(listings))
+
+
+def test_bed_and_bath_minimums(listings):
+    prefs = UserPreferences()
+    prefs.update_constraint_value(Constraint.BEDROOMS, 4)
+    prefs.update_constraint_value(Constraint.BATHROOMS, 3)
+    matched = ListingIndex(listings).filter(FilterPlan(prefs))
+    assert matched
+    assert all(h.beds >= 4 and h.baths >= 3 for h in matched)
+    assert len(matched) == sum(1 for h in listings if h.beds >= 4 and h.baths is not None and h.baths >= 3)
@@ -0,0 +1,89 @@
+"""
+ImageCache against a stub fetcher: hits, misses, thumbnails, LRU eviction and failing urls
+"""
+
+from io import BytesIO
+import os
+
+import pytest
+
+import image_cache
+
+
+class StubFetcher:
+    def __init__(self, images):
+        self.images = images
+        self.calls = []
+
+    def __call__(self, url):
+        self.calls.append(url)
+        if url not in self.images:
+            raise OSError(f"404 {url}")
+        return self.images[url]
+
+
+def png(width, height):
+    from PIL import Image
+    out = BytesIO()
+    Image.new("RGB", (width, height), (200, 80, 40)).save(out, format="PNG")
+    return out.getvalue()
+
+
+@pytest.fixture
+def fetcher():
+    return StubFetcher({f"http://img/{i}": bytes([i]) * 1000 for i in range(10)})
+
+
+def test_miss_then_hit(tmp_path, fetcher):
+    cache = image_cache.ImageCache(str(tmp_path), fetcher=fetcher)
+    assert cache.get("http://img/1") == (bytes([1]) * 1000, "application/octet-stream")
+    assert cache.get("http://img/1")[0] == bytes([1]) * 1000
+    assert fetcher.calls == ["http://img/1"]
+    assert cache.size_bytes() == 1000
+
+
+def test_survives_a_restart(tmp_path, fetcher):
+    image_cache.ImageCache(str(tmp_path), fetcher=fetcher).get("http://img/2")
+    cache = image_cache.ImageCache(str(tmp_path), fetcher=fetcher)
+    assert cache.get("http://img/2")[0] == bytes([2]) * 1000
+    assert fetcher.calls == ["http://img/2"]
+
+
+def test_evicts_least_recently_used(tmp_path, fetcher):
+    cache = image_cache.ImageCache(str(tmp_path), max_bytes=3000, fetcher=fetcher)
+    for i in (1, 2, 3):
+        cache.get(f"http://img/{i}")
+    cache.get("http://img/1") #2 is now the oldest
+    cache.get("http://img/4")
+    assert cache.size_bytes() == 3000
+    assert len(os.listdir(tmp_path)) == 3
+    cache.get("http://img/1")
+    cache.get("http://img/3")
+    assert fetcher.calls == ["http://img/1", "http://img/2", "http://img/3", "http://img/4"]
+    cache.get("http://img/2")
+    assert fetcher.calls[-1] == "http://img/2"
+
+
+def test_thumbnail_at_snapped_width(tmp_path):
+    pytest.importorskip("PIL")
+    from PIL import Image
+    fetcher = StubFetcher({"http://img/big": png(1000, 500)})
+    cache = image_cache.ImageCache(str(tmp_path), fetcher=fetcher)
+    data, content_type = cache.get("http://img/big", 300)
+    assert content_type == "image/jpeg"
+    assert Image.open(BytesIO(data)).size == (320, 160)
+    cache.get("http://img/big", 310) #same snapped width
+    cache.get("http://img/big")      #original, cached while making the thumbnail
+    assert fetcher.calls == ["http://img/big"]
+
+
+def test_failed_fetch_leaves_nothing_behind(tmp_path, fetcher):
+    cache = image_cache.ImageCache(str(tmp_path), fetcher=fetcher)
+    for _ in range(3):
+        with pytest.raises(OSError):
+            cache.get("http://img/missing")
+    assert fetcher.calls == ["http://img/missing"] * 3
+    assert cache._key_locks == {}
+    assert cache.size_bytes() == 0
+    cache.get("http://img/5")
+    assert cache._key_locks == {}
@@ -0,0 +1,68 @@
+"""
+Every ingest batch is stamped later than the one before, so hot reload and the snapshot fingerprint see upserts
+"""
+
+import csv
+
+import catalog_file
+import ingest
+
+
+def write_csv(path, price):
+    with open(path, "w", newline="") as f:
+        out = csv.writer(f)
+        out.writerow(["ID", "STATUS", "PRICE", "CITY", "TYPE", "STYLE"])
+        for i in range(10):
+            out.writerow([f"s{i}", "buy", price + i, "Reno", "condo", "modern"])
+
+
+def created(db):
+    conn = ingest.connect(db)
+    try:
+        return [r[0] for r in conn.execute("SELECT created_at FROM listings ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_batches_get_increasing_stamps(tmp_path):
+    db, src = str(tmp_path / "houselisting.db"), str(tmp_path / "listings.csv")
+    write_csv(src, 100)
+    ingest.ingest(db, src, batch_size=3)
+    first = created(db)
+    assert len(set(first)) == 4 #one stamp per batch
+    assert first == sorted(first)
+
+    before = catalog_file.db_fingerprint(db)
+    write_csv(src, 200)
+    assert ingest.ingest(db, src, batch_size=3)["listings"] == 10
+    assert min(created(db)) > max(first)
+    assert catalog_file.db_fingerprint(db) != before
+
+
+def test_stamp_passes_a_later_clock():
+    assert ingest.stamp("2999-01-01T00:00:00Z") > "2999-01-01T00:00:00Z"
+    now = ingest.stamp()
+    assert ingest.stamp(now) > now
+
+
+def indexes(db):
+    conn = ingest.connect(db)
+    try:
+        return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        conn.close()
+
+
+def test_indexes_stay_during_a_live_load(tmp_path, monkeypatch):
+    db, src = str(tmp_path / "houselisting.db"), str(tmp_path / "listings.csv")
+    write_csv(src, 100)
+    served = {ingest._index_name(sql) for sql in ingest.RECOMMENDER_INDEXES}
+    seen = []
+    listings = ingest.ingest_listings
+    monkeypatch.setattr(ingest, "ingest_listings", lambda conn, *args: seen.append(indexes(db)) or listings(conn, *args))
+
+    ingest.ingest(db, src)
+    assert served <= seen[-1]
+    ingest.ingest(db, src, offline=True)
+    assert not served & seen[-1]
+    assert served <= indexes(db) #rebuilt at the end
@@ -0,0 +1,26 @@
+"""
+Cards show each listing's own first photo, the full gallery is read on demand and dropped when hot reload re-reads it
+"""
+
+import sqlite3
+
+
+def test_card_photo_is_the_first_of_the_gallery(synthetic_engine):
+    engine = synthetic_engine(200, images_per_listing=3)
+    for h in engine.listings[:50]:
+        gallery = engine.get_home_gallery(h.id)
+        assert len(gallery) == 3
+        assert engine.idToImg[h.id] == gallery[0]
+
+
+def test_refresh_invalidates_the_gallery(tmp_path, synthetic_engine):
+    engine = synthetic_engine(200)
+    before = engine.get_home_gallery("5")
+    conn = sqlite3.connect(str(tmp_path / "houselisting.db"))
+    conn.execute("INSERT INTO images (listing_id, url) VALUES (5, 'https://example.com/late.jpg')")
+    conn.commit()
+    conn.close()
+
+    engine.refresh_catalog()
+    assert engine.get_home_gallery("5") == before + ["https://example.com/late.jpg"]
+    assert engine.idToImg["5"] == before[0] #the card keeps its photo
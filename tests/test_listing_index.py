@@ -0,0 +1,44 @@
+"""
+ListingIndex returns the same listings, in the same order, as the linear filter_listings scan
+"""
+
+import itertools
+
+import algorithm
+import listing_index
+from constraints import Constraint, UserPreferences
+
+
+def preference_sets():
+    locations = ["", "Chicago", "Nowhere"]
+    styles = [set(), {"Modern"}, {"Victorian", "Ranch"}]
+    sqfts = [0, 1500, 3900]
+    budgets = [0, 500_000, 1_100_000]
+    rigidities = [0, 0.4, 1]
+    for loc, style, sqft, budget, rigidity in itertools.product(locations, styles, sqfts, budgets, rigidities):
+        prefs = UserPreferences()
+        prefs.update_constraint_value(Constraint.LOCATION, loc)
+        prefs.update_constraint_value(Constraint.STYLE, style)
+        prefs.update_constraint_value(Constraint.SQUARE_FEET, sqft)
+        prefs.update_constraint_value(Constraint.BUDGET, budget)
+        prefs.update_constraint_rigidity(Constraint.SQUARE_FEET, rigidity)
+        prefs.update_constraint_rigidity(Constraint.BUDGET, 1 - rigidity)
+        yield prefs
+
+
+def test_index_matches_linear_filter(listings):
+    index = listing_index.ListingIndex(listings)
+    indexed = algorithm.HousingRecommender(index=index)
+    linear = algorithm.HousingRecommender()
+    for prefs in preference_sets():
+        expected = [l.id for l in linear.filter_listings(listings, prefs)]
+        assert [l.id for l in indexed.filter_listings(listings, prefs)] == expected
+
+
+def test_uncovered_listings_use_the_linear_scan(listings):
+    index = listing_index.ListingIndex(listings)
+    subset = listings[::5]
+    prefs = UserPreferences()
+    prefs.update_constraint_value(Constraint.LOCATION, "Austin")
+    got = algorithm.HousingRecommender(index=index).filter_listings(subset, prefs)
+    assert [l.id for l in got] == [l.id for l in subset if l.city == "Austin"]
@@ -0,0 +1,48 @@
+"""
+The "more like this" index is built in the background: a like does not wait for it, and a refresh rebuilds it
+"""
+
+import sqlite3
+
+from constraints import Constraint
+
+
+def test_likes_do_not_wait_for_the_index(tmp_path, synthetic_engine):
+    engine = synthetic_engine(500, seed=3)
+    neighbors = engine.neighbors
+    some = engine.listings[0]
+
+    assert neighbors.similar_ids(some.id, 5) == [] #not built yet, the build is started instead
+    neighbors._thread.join()
+    assert neighbors.ready()
+    assert len(neighbors.similar_ids(some.id, 5)) == 5
+
+    conn = sqlite3.connect(str(tmp_path / "houselisting.db"))
+    conn.execute("UPDATE listings SET price = price + 1, created_at = '2999' WHERE id = ?", (some.id,))
+    conn.commit()
+    conn.close()
+    engine.refresh_catalog()
+    assert engine.neighbors is not neighbors and engine.neighbors.started()
+
+
+def test_like_boosts_the_neighbors(synthetic_engine):
+    engine = synthetic_engine(500, seed=3)
+    engine.neighbors.start()
+    engine.neighbors._thread.join()
+    session = engine.spawn()
+    session.update_constraint(Constraint.BUDGET, 900_000)
+    session.fill_feed(2)
+    liked = session.feed[0]
+    session.give_feedback(True)
+    nearest = {i for _, i in engine.neighbors.similar_ids(liked.id, session.algorithm.neighbor_count)}
+    assert session.algorithm.boosts and set(session.algorithm.boosts) <= nearest
+
+
+def test_pushdown_has_no_index(synthetic_engine):
+    engine = synthetic_engine(200, seed=3, pushdown=True)
+    assert engine.neighbors is None
+    session = engine.spawn()
+    session.update_constraint(Constraint.BUDGET, 900_000)
+    session.fill_feed(2)
+    session.give_feedback(True) #a like boosts nothing and reads no index
+    assert engine.get_similar_homes(session.feed[0].id) == []
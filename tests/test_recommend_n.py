@@ -0,0 +1,48 @@
+"""
+recommend_n hands out distinct, unconsumed listings, the same ones as k recommend_listing calls in a row
+"""
+
+import random
+
+import pytest
+
+import algorithm
+import columnar
+import listing_index
+from constraints import Constraint, UserPreferences
+
+
+@pytest.fixture
+def prefs():
+    out = UserPreferences()
+    out.update_constraint_value(Constraint.BUDGET, 800_000)
+    out.update_constraint_value(Constraint.HOME_TYPE, {"Condo", "House"})
+    return out
+
+
+def recommender(listings):
+    out = algorithm.HousingRecommender(catalog=columnar.build(listings), index=listing_index.ListingIndex(listings))
+    out.explore_epsilon = 0.5 #plenty of runner-up picks
+    return out
+
+
+def test_recommend_n_returns_distinct_ids(listings, prefs):
+    consumed = {l.id for l in listings[:300]}
+    random.seed(4)
+    picks = recommender(listings).recommend_n(prefs, listings, 20, consumed=consumed)
+    ids = [l.id for l in picks]
+    assert len(ids) == 20
+    assert len(set(ids)) == 20
+    assert not consumed & set(ids)
+
+
+def test_recommend_n_matches_sequential_calls(listings, prefs):
+    random.seed(5)
+    batch = [l.id for l in recommender(listings).recommend_n(prefs, listings, 12, consumed=set())]
+
+    random.seed(5)
+    one_by_one = recommender(listings)
+    consumed = []
+    for _ in range(12):
+        consumed.append(one_by_one.recommend_listing(prefs, listings, consumed=set(consumed)).id)
+    assert batch == consumed
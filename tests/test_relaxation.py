@@ -0,0 +1,73 @@
+"""
+The relaxation ladder counts the same live listings in every catalog mode as a linear scan does,
+and a session keeps its chosen step until the preferences change or the step runs dry
+"""
+
+import pytest
+
+import relaxation
+from constraints import Constraint
+
+
+def narrow_session(engine):
+    session = engine.spawn()
+    session.update_constraint(Constraint.LOCATION, "Reno")
+    session.update_constraint(Constraint.BUDGET, 300_000)
+    session.update_constraint(Constraint.BEDROOMS, 4)
+    session.update_constraint(Constraint.STYLE, {"victorian"})
+    return session
+
+
+@pytest.mark.parametrize("mode", [{}, {"catalog_path": "catalog.bin"}, {"pushdown": True}])
+def test_counts_match_linear(synthetic_engine, mode):
+    memory = synthetic_engine(3000, seed=2)
+    engine = synthetic_engine(**mode)
+    session = narrow_session(engine)
+    ids = [h.id for h in memory.listings[::7]]
+    session.consumed.update(ids[:150])
+    session.algorithm.exclude_ids.update(ids[150:200])
+
+    ladder = relaxation.Relaxation(session.constraints)
+    ladder.choose(session.algorithm, session.listings, session.consumed, len(memory.listings) + 1)
+    dead = session.consumed | session.algorithm.exclude_ids
+    linear = [sum(1 for h in ladder.plan(level).filter(memory.listings) if h.id not in dead)
+              for level in range(1, len(ladder.steps) + 1)]
+    assert ladder.counts == linear
+
+
+def test_chosen_step_is_kept(synthetic_engine, monkeypatch):
+    engine = synthetic_engine(3000, seed=2)
+    starts = []
+    choose = relaxation.Relaxation.choose
+    monkeypatch.setattr(relaxation.Relaxation, "choose",
+                        lambda self, *args: starts.append(args[-1]) or choose(self, *args))
+    session = narrow_session(engine)
+    for _ in range(30):
+        session.fill_feed(3)
+        if len(session.feed) < 3:
+            session.relax_feed(3)
+        session.give_feedback(True, target_len=0)
+    assert starts and len(starts) < 5
+    assert starts == sorted(starts)
+
+    session.update_constraint(Constraint.BEDROOMS, 3)
+    session.feed.clear()
+    session.relax_feed(3)
+    assert starts[-1] == 1
+
+
+def test_relaxed_copy_has_its_own_version(engine):
+    session = narrow_session(engine)
+    prefs = session.constraints
+    relaxed = relaxation.relaxed_preferences(prefs, {Constraint.STYLE})
+    assert relaxed.version != prefs.version
+    #a cache keyed on the version alone would hand the unrelaxed plan back
+    plan = session.algorithm.filter_plan(prefs)
+    assert session.algorithm.filter_plan(relaxed).signature != plan.signature
+
+
+def test_relaxed_copy_has_its_own_version(synthetic_engine):
+    prefs = narrow_session(synthetic_engine(3000, seed=2)).constraints
+    relaxed = relaxation.relaxed_preferences(prefs, {Constraint.STYLE})
+    assert relaxed.version != prefs.version
+    assert relaxation.relaxed_preferences(prefs, set()).version not in (prefs.version, relaxed.version)
@@ -0,0 +1,44 @@
+"""
+Re-ranking from the cached similarity vectors gives the same scores and order as scoring every match again
+"""
+
+import random
+
+import pytest
+
+import algorithm
+import columnar
+import listing_index
+from constraints import Constraint, UserPreferences
+
+
+def full_rank(recommender, prefs, listings, consumed, k):
+    scalar = algorithm.HousingRecommender()
+    scalar.weights = dict(recommender.weights)
+    live = [l for l in listings if l.id not in consumed and l.id not in recommender.exclude_ids]
+    return scalar.rank_listings(scalar.filter_listings(live, prefs), prefs, k)
+
+
+@pytest.mark.parametrize("batched", [True, False])
+def test_cached_rerank_matches_full_rerank(listings, batched):
+    if batched and not columnar.available():
+        pytest.skip("numpy is not installed")
+    catalog = columnar.build(listings) if batched else None
+    recommender = algorithm.HousingRecommender(catalog=catalog, index=listing_index.ListingIndex(listings))
+    prefs = UserPreferences()
+    prefs.update_constraint_value(Constraint.LOCATION, "San Jose")
+    prefs.update_constraint_value(Constraint.BUDGET, 900_000)
+    prefs.update_constraint_value(Constraint.SQUARE_FEET, 1200)
+    prefs.update_constraint_value(Constraint.HOME_TYPE, {"House"})
+
+    rng = random.Random(3)
+    consumed = set()
+    for _ in range(40):
+        cached = recommender._rank_indexed(prefs, listings, consumed, 10)
+        expected = full_rank(recommender, prefs, listings, consumed, 10)
+        assert [(s, l.id) for s, l in cached] == [(s, l.id) for s, l in expected]
+
+        shown = cached[0][1]
+        consumed.add(shown.id)
+        recommender.update_user_feedback(prefs, shown, rng.random() < 0.5)
+    assert len(recommender.sim_cache) == 1 #feedback moved the weights, the matches were never re-scored
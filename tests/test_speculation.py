@@ -0,0 +1,53 @@
+"""
+A speculative refill is only used when it is finished and still matches the session; a failed one is logged and counted
+"""
+
+import logging
+from concurrent.futures import Future
+
+import metrics
+from constraints import Constraint
+
+
+def speculating_session(engine):
+    session = engine.spawn()
+    session.update_constraint(Constraint.BUDGET, 900_000)
+    session.fill_feed(2)
+    session.speculate(target_len=2)
+    return session
+
+
+def outcomes(result):
+    return metrics.SPECULATIONS._values.get((result,), 0)
+
+
+def test_finished_speculation_is_used(engine):
+    session = speculating_session(engine)
+    session.speculation.future.result()
+    before = outcomes("used")
+    picks = session.speculation.take(session, session.feed[0], True)
+    assert picks and session.feed[0] not in picks
+    assert outcomes("used") == before + 1
+
+
+def test_unfinished_speculation_is_not_waited_for(engine):
+    session = speculating_session(engine)
+    session.speculation.future.result()
+    session.speculation.future = Future()
+    before = outcomes("not_ready")
+    assert session.speculation.take(session, session.feed[0], True) is None
+    assert session.speculation.future.cancelled()
+    assert outcomes("not_ready") == before + 1
+
+
+def test_failed_speculation_is_logged_and_counted(engine, caplog):
+    session = speculating_session(engine)
+    session.speculation.future.result()
+    failed = Future()
+    failed.set_exception(RuntimeError("boom"))
+    session.speculation.future = failed
+    before = outcomes("error")
+    with caplog.at_level(logging.ERROR, logger="housefindr"):
+        assert session.speculation.take(session, session.feed[0], True) is None
+    assert "Speculative ranking failed" in caplog.text
+    assert outcomes("error") == before + 1
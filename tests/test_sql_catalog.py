@@ -0,0 +1,46 @@
+"""
+Pushdown mode filters in SQLite and ranks the streamed matches the same way the in-memory catalog does
+"""
+
+import pytest
+
+import sql_catalog
+from constraints import Constraint, PurchaseType
+from filter_plan import FilterPlan
+
+PREFERENCES = [
+    {},
+    {Constraint.LOCATION: "San Jose"},
+    {Constraint.BUDGET: 900_000, Constraint.STYLE: {"modern", "spanish"}},
+    {Constraint.LOCATION: "Oakland", Constraint.SQUARE_FEET: 1200, Constraint.BEDROOMS: 3, Constraint.BATHROOMS: 2},
+    {Constraint.HOME_TYPE: {"condo"}, Constraint.BUY_OR_RENT: PurchaseType.RENT}, #scored only, never filtered
+]
+
+
+@pytest.fixture
+def engines(tmp_path, synthetic_engine):
+    memory = synthetic_engine(1500, seed=11)
+    assert sql_catalog.ensure_indexes(str(tmp_path / "houselisting.db"))
+    return memory, synthetic_engine(pushdown=True)
+
+
+def ranked(scored):
+    #ties may come out in either order, the listings tied at a score are compared as a set
+    return sorted((round(score, 9), int(h.id)) for score, h in scored)
+
+
+@pytest.mark.parametrize("values", PREFERENCES)
+def test_pushdown_ranking_matches_memory(engines, values):
+    memory, pushdown = engines
+    assert pushdown.store is not None and len(pushdown.store) == len(memory.listings)
+    prefs = memory.spawn().constraints
+    for constraint, value in values.items():
+        prefs.update_constraint_value(constraint, value)
+
+    matches = memory.index.filter(FilterPlan(prefs))
+    assert matches
+    streamed = pushdown.algorithm._rank_streamed(prefs, set(), len(matches))
+    assert ranked(streamed) == ranked(memory.algorithm.rank_listings(matches, prefs, len(matches)))
+
+    top = [round(score, 9) for score, _ in pushdown.algorithm._rank_streamed(prefs, set(), 20)]
+    assert top == [round(score, 9) for score, _ in memory.algorithm.rank_listings(matches, prefs, 20)]
@@ -0,0 +1,114 @@
+"""
+Session state survives the trip through SessionStateStore, and an evicted session's pending state is read back before the saved row
+"""
+
+import threading
+
+import pytest
+
+import sessions
+import state_store
+from constraints import Constraint, PurchaseType
+
+
+@pytest.fixture
+def store(tmp_path):
+    out = state_store.SessionStateStore(str(tmp_path / "sessions.db"), flush_interval=3600)
+    yield out
+    out.close()
+
+
+def used_session(engine):
+    session = engine.spawn()
+    session.update_constraint(Constraint.LOCATION, "San Jose")
+    session.update_constraint(Constraint.STYLE, {"modern", "spanish"})
+    session.update_constraint(Constraint.BUDGET, 1_800_000)
+    session.update_constraint(Constraint.BEDROOMS, 2)
+    session.constraints.update_constraint_value(Constraint.BUY_OR_RENT, PurchaseType.RENT)
+    session.fill_feed(4)
+    session.give_feedback(True, target_len=4)
+    session.give_feedback(False, target_len=4)
+    return session
+
+
+def test_round_trip(engine, store):
+    session = used_session(engine)
+    store.mark_dirty("u1", session)
+    assert store.flush() == 1
+
+    restored = engine.spawn()
+    restored.import_state(store.load("u1"))
+    assert restored.constraints.get_constraints() == session.constraints.get_constraints()
+    assert restored.algorithm.weights == session.algorithm.weights
+    assert restored.algorithm.exclude_ids == session.algorithm.exclude_ids
+    assert restored.algorithm.boosts == session.algorithm.boosts
+    assert restored.consumed == session.consumed
+    assert [h.id for h in restored.feed] == [h.id for h in session.feed]
+
+
+def test_unknown_token(store):
+    assert store.load("nobody") is None
+
+
+def test_later_flush_wins(engine, store):
+    session = used_session(engine)
+    store.mark_dirty("u2", session)
+    store.flush()
+    session.give_feedback(True, target_len=4)
+    store.mark_dirty("u2", session)
+    store.flush()
+    assert set(store.load("u2")["consumed"]) == session.consumed
+
+
+def evicting_store(engine, store):
+    now = [0.0]
+
+    def factory(token):
+        session = engine.spawn()
+        state = store.load(token)
+        if state:
+            session.import_state(state)
+        return session
+
+    return sessions.SessionStore(factory, ttl=10, clock=lambda: now[0], on_evict=store.evicted), now
+
+
+def test_evicted_session_is_read_back_before_it_is_flushed(engine, store):
+    live, now = evicting_store(engine, store)
+    session = live.get("u3")
+    session.update_constraint(Constraint.BUDGET, 900_000)
+    session.fill_feed(2)
+    store.mark_dirty("u3", session) #not flushed yet, the flush thread is far away
+
+    now[0] = 60 #idle past the ttl
+    again = live.get("u3")
+    assert again is not session
+    assert again.constraints.get_constraints() == session.constraints.get_constraints()
+    assert [h.id for h in again.feed] == [h.id for h in session.feed]
+    assert store.pending() == 1 #the snapshot, nothing was written on the request path
+    assert store.flush() == 1
+    assert store.load("u3")["feed"] == [h.id for h in session.feed]
+
+
+def test_session_evicted_mid_request(engine, store):
+    live, _ = evicting_store(engine, store)
+    session = live.get("u4")
+    store.mark_dirty("u4", session)
+    held, done = threading.Event(), threading.Event()
+
+    def request():
+        with session.lock:
+            held.set()
+            session.update_constraint(Constraint.BUDGET, 700_000)
+            session.fill_feed(2)
+            done.wait()
+
+    worker = threading.Thread(target=request)
+    worker.start()
+    held.wait()
+    live.drop("u4") #does not wait for the request
+    assert store.pending() == 1
+    done.set()
+    worker.join()
+    again = live.get("u4")
+    assert again.constraints.get_constraints() == session.constraints.get_constraints()
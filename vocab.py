@@ -0,0 +1,86 @@
+"""
+Process-wide interning of the categorical listing fields
+Listings store small integer codes for city, listing type and tenure, and a bitmask for styles,
+instead of a string (or a set of strings) per listing
+Vocabulary is also the table behind every local code space, e.g. a catalog file's or a facet cube's dictionaries
+"""
+
+import threading
+
+
+class Vocabulary:
+    """
+    value <-> code, codes are handed out in first-seen order and never change; None is code -1
+    values: codes 0, 1, ... of a table to extend (e.g. a copy of a facet cube's), new values get the next codes
+    """
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.codes = {v: code for code, v in enumerate(self.values)}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        code = self.codes.get(value)
+        if code is not None:
+            return code
+        if value is None:
+            return -1
+        with self._lock: #two loader threads may meet the same new value
+            code = self.codes.get(value)
+            if code is None:
+                code = len(self.values)
+                self.values.append(value)
+                self.codes[value] = code
+        return code
+
+    def code(self, value):
+        """
+        Code of a value seen before, None otherwise (lookups never grow the vocabulary)
+        """
+        return self.codes.get(value)
+
+    def value(self, code):
+        return self.values[code] if code >= 0 else None
+
+    #===BITMASKS===#
+    #a set of values is the OR of 1 << code
+
+    def intern_mask(self, values):
+        #a plain string is one value, None is the empty set
+        if isinstance(values, str):
+            return 1 << self.intern(values)
+        if values is None:
+            return 0
+        mask = 0
+        for v in values:
+            mask |= 1 << self.intern(v)
+        return mask
+
+    def mask(self, values):
+        """
+        Mask of the known values, unknown ones can't match any listing so they are skipped
+        """
+        mask = 0
+        for v in values:
+            code = self.codes.get(v)
+            if code is not None:
+                mask |= 1 << code
+        return mask
+
+    def members(self, mask):
+        out = []
+        code = 0
+        while mask:
+            if mask & 1:
+                out.append(self.values[code])
+            mask >>= 1
+            code += 1
+        return out
+
+
+CITIES = Vocabulary()
+LISTING_TYPES = Vocabulary()
+TENURES = Vocabulary()
+STYLES = Vocabulary()
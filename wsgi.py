@@ -0,0 +1,13 @@
+"""
+WSGI entry point for serving the API with a production server instead of app.py's dev server
+
+    gunicorn --threads 8 wsgi:application
+    gunicorn --workers 4 --threads 4 --preload wsgi:application
+
+Threads share one catalog and never lock it; each session has its own lock, so requests for the
+same user are handled one at a time while different users run in parallel.
+Sessions live in the worker process that created them, so with several workers the load balancer
+should route on the X-Session-Token header. Saved state (sessions.db) is shared by all workers.
+"""
+
+from app import app as application